@@ -0,0 +1,46 @@
+"""
+Compares the per-frame cost of py-cord's PCMVolumeTransformer with AudioPlayer's gain stage
+
+Run with `python -m benchmarks.volume`
+"""
+
+import os
+import timeit
+
+from discord import AudioSource, PCMVolumeTransformer
+
+from friend_boat.services._base import AudioPlayer, BaseAudioStream
+
+FRAME = os.urandom(3840)
+"""20ms of 48kHz 16-bit stereo PCM"""
+
+
+class StaticStream(BaseAudioStream):
+    def __init__(self) -> None:
+        self._init_stream(0)
+
+    def read(self) -> bytes:
+        return FRAME
+
+    def is_opus(self) -> bool:
+        return False
+
+
+class StaticSource(AudioSource):
+    def read(self) -> bytes:
+        return FRAME
+
+
+def benchmark(name: str, source: AudioSource, number: int = 2000) -> None:
+    seconds = timeit.timeit(source.read, number=number)
+    print(f"{name:<40} {seconds / number * 1_000_000:>10.1f} us/frame")
+
+
+def main() -> None:
+    benchmark("PCMVolumeTransformer (volume=0.5)", PCMVolumeTransformer(StaticSource(), volume=0.5))
+    benchmark("AudioPlayer (volume=0.5)", AudioPlayer(StaticStream(), volume=0.5))
+    benchmark("AudioPlayer (volume=1.0)", AudioPlayer(StaticStream(), volume=1.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,18 @@ import argparse
 import os
 
 from friend_boat.bots.bot import init_bot, run_bot
+from friend_boat.bots.settings import get_settings
+from friend_boat.bots.supervisor import run_supervisor
 
 parser = argparse.ArgumentParser(prog="FriendBoat", description="A simple music bot for Discord")
 parser.add_argument("--discord-token", type=str, help="your Discord Bot Token", required=False)
 parser.add_argument(
     "--youtube-api-key", type=str, help="your Google API Key with access to the YouTube Data API v3 ", required=False
 )
+parser.add_argument("--shards", type=int, help="how many shards to split the bot into", required=False)
+parser.add_argument(
+    "--workers", type=int, help="how many processes to run shards in, managed by a supervisor", required=False
+)
 
 
 def main() -> None:
@@ -18,14 +24,22 @@ def main() -> None:
         os.environ["discord_bot_token"] = args.discord_token
     if args.youtube_api_key:
         os.environ["youtube_api_key"] = args.youtube_api_key
+    if args.shards:
+        os.environ["sharded"] = "true"
+        os.environ["shard_count"] = str(args.shards)
+    if args.workers:
+        os.environ["worker_count"] = str(args.workers)
 
     if not all([os.environ.get("DISCORD_BOT_TOKEN"), os.environ.get("YOUTUBE_API_KEY")]):
         raise Exception(
             "You must provide both a Discord Bot Token and a Google API Key with access to the YouTube Data API v3"
         )
 
-    bot = init_bot()
-    run_bot(bot)
+    if get_settings().worker_count > 1:
+        run_supervisor()
+    else:
+        bot = init_bot()
+        run_bot(bot)
 
 
 if __name__ == "__main__":
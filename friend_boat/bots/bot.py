@@ -1,19 +1,52 @@
 import logging
+from typing import cast
 
 import discord
-from discord.ext.commands import Bot, when_mentioned_or
+from discord.ext.commands import AutoShardedBot, Bot, when_mentioned_or
+
+from friend_boat.services.metrics import REGISTRY, MetricsServer
 
 from .cogs import all_cogs
-from .settings import Settings
+from .settings import get_settings
 
 
 def run_bot(bot: Bot) -> None:
-    settings = Settings()
+    settings = get_settings()
     bot.run(settings.discord_bot_token)
 
 
-def init_bot() -> Bot:
-    settings = Settings()
+def _serve_metrics(bot: Bot, port: int) -> None:
+    server = MetricsServer(port)
+    REGISTRY.register_callback("friend_boat_guilds", "How many servers the bot is in", lambda: len(bot.guilds))
+    REGISTRY.register_callback(
+        "friend_boat_voice_clients", "How many voice channels the bot is connected to", lambda: len(bot.voice_clients)
+    )
+
+    started = False
+
+    async def on_ready() -> None:
+        # on_ready fires again after reconnecting, but the server keeps running
+        nonlocal started
+        if not started:
+            started = True
+            await server.start()
+
+    bot.add_listener(on_ready, "on_ready")
+
+
+def init_bot(
+    shard_ids: list[int] | None = None, shard_count: int | None = None, metrics_port: int | None = None
+) -> Bot:
+    """
+    Sets up the bot. If it's sharded, it's set up as an `AutoShardedBot`
+
+    shard_ids: Which shards to run in this process. Defaults to every shard
+    shard_count: How many shards the bot is split into in total. Defaults to `Settings.shard_count`,
+        or Discord's recommendation
+    metrics_port: Which port to serve metrics on. Defaults to `Settings.app_port`
+    """
+
+    settings = get_settings()
     logging.basicConfig(level=settings.log_level)
 
     # set up bot
@@ -21,8 +54,23 @@ def init_bot() -> Bot:
     intents.message_content = True
     intents.voice_states = True
 
-    bot = Bot(command_prefix=when_mentioned_or(settings.command_prefix), intents=intents)
+    if settings.sharded or shard_ids is not None:
+        # AutoShardedBot has the same interface as Bot, but doesn't subclass it
+        bot = cast(
+            Bot,
+            AutoShardedBot(
+                command_prefix=when_mentioned_or(settings.command_prefix),
+                intents=intents,
+                shard_ids=shard_ids,
+                shard_count=shard_count or settings.shard_count,
+            ),
+        )
+    else:
+        bot = Bot(command_prefix=when_mentioned_or(settings.command_prefix), intents=intents)
+
     bot.load_extension("slash_cog")
+    if settings.metrics_enabled:
+        _serve_metrics(bot, metrics_port or settings.app_port)
 
     # register cogs
     for cog in [cog(bot) for cog in all_cogs()]:
@@ -1,10 +1,18 @@
+import asyncio
 import logging
+import os
 import random
+import re
+import threading
+import time
 import traceback
+from typing import Callable
 
-from discord import ApplicationContext, Member, Option, VoiceState, option, slash_command
+from discord import ApplicationContext, DiscordException, Guild, Member, Option, User, VoiceState, option, slash_command
+from discord.abc import Messageable
 from discord.channel import VocalGuildChannel
-from discord.ext.commands import Cog
+from discord.ext.commands import Bot, Cog, command, is_owner
+from pyyoutube import PyYouTubeException  # type: ignore
 
 from friend_boat.models.bots import (
     DiscordCogBase,
@@ -12,35 +20,559 @@ from friend_boat.models.bots import (
     UserNotInVoiceChannelError,
     require_server_presence,
 )
-from friend_boat.models.music import MusicQueueFullError, MusicQueueItem
-from friend_boat.models.paginator import SimplePaginator
+from friend_boat.models.music import MusicQueueFullError, MusicQueueItem, MusicQueueSnapshot
+from friend_boat.models.paginator import QueuePaginator
 from friend_boat.models.youtube import NoResultsFoundError
 from friend_boat.services._base import AudioStreamEffect
+from friend_boat.services.cache import FileCache, LRUCache
+from friend_boat.services.loudness import LoudnessAnalyzer, LoudnessCache
+from friend_boat.services.metrics import REGISTRY, MetricType
 from friend_boat.services.music import MusicQueueService
-from friend_boat.services.youtube import YouTubeService
+from friend_boat.services.replay import ReplayCache
+from friend_boat.services.snapshots import MusicQueueSnapshotStore
+from friend_boat.services.youtube import YouTubeSearchCache, YouTubeService, YouTubeStreamCache
 
-from ..settings import Settings
+from ..settings import Settings, get_settings, get_settings_provider
 
 _player_service_by_guild: dict[int, MusicQueueService] = {}
 
+STREAM_METRICS: list[tuple[str, str, MetricType]] = [
+    ("latency_p50", "Median read latency of each server's stream, in seconds", "gauge"),
+    ("latency_p99", "99th percentile read latency of each server's stream, in seconds", "gauge"),
+    ("wait_p99", "99th percentile time each server's stream spent waiting on ffmpeg per read, in seconds", "gauge"),
+    ("drift", "How far each server's stream has fallen behind the wall clock, in seconds", "gauge"),
+    ("short_frames", "How many short frames each server's stream has read", "counter"),
+    ("empty_frames", "How many empty frames each server's stream has read", "counter"),
+    ("stalls", "How many reads of each server's stream have stalled", "counter"),
+    ("buffered", "How much audio each server's stream has read ahead, in seconds", "gauge"),
+    ("underruns", "How many reads of each server's stream found its read-ahead buffer empty", "counter"),
+]
+"""stream read instrumentation exported as metrics, keyed by `StreamStats.summary` key"""
+
+
+def _get_stream_metric_name(key: str, type: MetricType) -> str:
+    return f"friend_boat_stream_{key}_total" if type == "counter" else f"friend_boat_stream_{key}"
+
 
 class Music(DiscordCogBase):
+    def __init__(self, bot: Bot):
+        super().__init__(bot)
+        self._yt_service: YouTubeService | None = None
+
+        self._settings_provider = get_settings_provider()
+        self._settings_provider.subscribe(self._apply_settings)
+        self._settings_task: asyncio.Task | None = None
+
+        settings = self._settings_provider.settings
+        self._snapshot_interval = settings.snapshot_interval
+        self._snapshot_max_age = settings.snapshot_max_age
+        self._snapshot_restore_concurrency = settings.snapshot_restore_concurrency
+        self._snapshot_store = (
+            MusicQueueSnapshotStore(os.path.join(settings.data_dir, "snapshots"))
+            if settings.snapshot_interval
+            else None
+        )
+        self._saved_snapshots: dict[int, MusicQueueSnapshot] = {}
+        """the last snapshot saved for each guild, so unchanged guilds aren't saved again. Only updated on the loop"""
+        self._snapshot_save_lock = threading.Lock()
+        self._snapshots_finalized = False
+        self._pending_restores: set[int] = set()
+        self._snapshot_task: asyncio.Task | None = None
+
+        self._queue_service_idle_ttl = settings.queue_service_idle_ttl
+        self._queue_service_sweep_interval = settings.queue_service_sweep_interval
+        self._queue_service_idle_since: dict[int, float] = {}
+        self._queue_service_sweep_task: asyncio.Task | None = None
+        self.queue_services_created = 0
+        self.queue_services_evicted = 0
+
+        self._leave_when_alone_delay = settings.leave_when_alone_delay
+        self._queue_paginator_timeout = settings.queue_paginator_timeout
+        self._occupied_channels: dict[int, int] = {}
+        """the guild id of every voice channel the bot is in, keyed by channel id"""
+        self._pending_leaves: dict[int, asyncio.Task] = {}
+        """tasks which leave a guild's voice channel after a delay, keyed by guild id"""
+
+        self._metric_names: list[str] = []
+        self._register_metrics()
+
+    @property
+    def yt_service(self) -> YouTubeService:
+        """The YouTube service shared by every guild, created on first use"""
+
+        if self._yt_service:
+            return self._yt_service
+
+        settings = get_settings()
+        search_cache = YouTubeSearchCache(
+            os.path.join(settings.data_dir, "youtube_search_cache.json") if settings.search_cache_persist else None,
+            max_size=settings.search_cache_size,
+            ttl=settings.search_cache_ttl,
+        )
+        search_cache.load()
+
+        loudness_analyzer: LoudnessAnalyzer | None = None
+        if settings.loudness_normalization:
+            loudness_cache = LoudnessCache(
+                os.path.join(settings.data_dir, "loudness_cache.json"), max_size=settings.loudness_cache_size
+            )
+            loudness_cache.load()
+            loudness_analyzer = LoudnessAnalyzer(
+                loudness_cache,
+                target=settings.loudness_target,
+                max_gain=settings.loudness_max_gain,
+                tolerance=settings.loudness_tolerance,
+            )
+
+        self._yt_service = YouTubeService(
+            settings.youtube_api_key,
+            search_cache=search_cache,
+            stream_cache=YouTubeStreamCache(
+                max_size=settings.stream_cache_size,
+                ttl=settings.stream_cache_default_ttl,
+                expiry_margin=settings.stream_cache_expiry_margin,
+            ),
+            audio_cache=(
+                FileCache(os.path.join(settings.data_dir, "audio"), settings.audio_cache_max_bytes)
+                if settings.audio_cache_enabled
+                else None
+            ),
+            replay_cache=(
+                ReplayCache(settings.replay_cache_track_max_bytes, settings.replay_cache_max_bytes)
+                if settings.replay_cache_enabled
+                else None
+            ),
+            loudness_analyzer=loudness_analyzer,
+            opus_passthrough=settings.opus_passthrough,
+            read_ahead=settings.read_ahead_duration,
+            rewind_history=settings.rewind_history_duration,
+            rewind_history_pcm=settings.rewind_history_pcm_duration,
+            http_pool_size=settings.youtube_http_pool_size,
+            ytdl_pool_size=settings.ytdl_pool_size,
+        )
+
+        return self._yt_service
+
+    def _apply_settings(self, settings: Settings) -> None:
+        """Applies reloaded settings to this cog, every queue service, and the YouTube service's caches"""
+
+        self._queue_service_idle_ttl = settings.queue_service_idle_ttl
+        self._leave_when_alone_delay = settings.leave_when_alone_delay
+        self._queue_paginator_timeout = settings.queue_paginator_timeout
+
+        for player_service in _player_service_by_guild.values():
+            player_service.apply_settings(settings)
+
+        if self._yt_service:
+            self._yt_service.resize_caches(
+                search_cache_size=settings.search_cache_size,
+                stream_cache_size=settings.stream_cache_size,
+                audio_cache_max_bytes=settings.audio_cache_max_bytes,
+                replay_cache_max_bytes=settings.replay_cache_max_bytes,
+                loudness_cache_size=settings.loudness_cache_size,
+            )
+
+        logging.info("Applied reloaded settings")
+
+    def cog_unload(self) -> None:
+        for name in self._metric_names:
+            REGISTRY.unregister(name)
+
+        self._settings_provider.unsubscribe(self._apply_settings)
+        if self._settings_task:
+            self._settings_task.cancel()
+
+        if self._queue_service_sweep_task:
+            self._queue_service_sweep_task.cancel()
+
+        for task in self._pending_leaves.values():
+            task.cancel()
+
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+            snapshots = self._take_snapshots()
+            self._save_snapshots(snapshots, final=True)
+            self._mark_snapshots_saved(snapshots)
+
+        if self._yt_service:
+            self.bot.loop.create_task(self._yt_service.close())
+
+    ### Snapshots ###
+
+    @Cog.listener()
+    async def on_ready(self) -> None:
+        loop = asyncio.get_running_loop()
+        for voice_client in self.bot.voice_clients:
+            channel = getattr(voice_client, "channel", None)
+            if isinstance(channel, VocalGuildChannel):
+                self._occupied_channels[channel.id] = channel.guild.id
+
+        if not self._queue_service_sweep_task:
+            self._queue_service_sweep_task = loop.create_task(self._sweep_queue_services())
+
+        if not self._settings_task and self._settings_provider.settings.settings_reload_interval:
+            self._settings_task = loop.create_task(self._settings_provider.watch())
+
+        if not self._snapshot_store or self._snapshot_task:
+            return
+
+        self._snapshot_task = loop.create_task(self._snapshot_loop())
+
+        # only guilds handled by this shard are restored
+        guild_ids = [
+            guild_id
+            for guild_id in await loop.run_in_executor(None, self._snapshot_store.guild_ids)
+            if self.bot.get_guild(guild_id)
+        ]
+        self._pending_restores.update(guild_ids)
+
+        semaphore = asyncio.Semaphore(self._snapshot_restore_concurrency)
+
+        async def restore(guild_id: int) -> None:
+            async with semaphore:
+                try:
+                    await self._restore_guild(guild_id)
+                except Exception:
+                    logging.exception(f"Unable to restore guild {guild_id}")
+                finally:
+                    self._pending_restores.discard(guild_id)
+
+        for guild_id in guild_ids:
+            loop.create_task(restore(guild_id))
+
+    def _take_snapshots(self) -> dict[int, MusicQueueSnapshot | None]:
+        """Snapshots every guild which has changed since it was last saved. `None` means a guild's snapshot is stale"""
+
+        changed: dict[int, MusicQueueSnapshot | None] = {}
+        for guild_id, player_service in _player_service_by_guild.items():
+            snapshot = player_service.snapshot()
+            if not snapshot and (player_service.currently_playing or player_service.queue_size):
+                # briefly disconnected from voice, e.g. while reconnecting, so there's still something to resume
+                continue
+
+            if snapshot != self._saved_snapshots.get(guild_id):
+                changed[guild_id] = snapshot
+
+        # guilds which were stopped, but still have a snapshot
+        for guild_id in self._saved_snapshots.keys() - _player_service_by_guild.keys():
+            changed[guild_id] = None
+
+        return changed
+
+    def _save_snapshots(self, snapshots: dict[int, MusicQueueSnapshot | None], *, final: bool = False) -> None:
+        """
+        Writes snapshots to the store. This runs in an executor, so it must not touch the cog's state
+
+        final: Whether this is the last save before unloading. Saves still running in an executor afterwards are
+            skipped, so they can't replace newer snapshots with older ones
+        """
+
+        if not self._snapshot_store:
+            return
+
+        with self._snapshot_save_lock:
+            if self._snapshots_finalized:
+                return
+
+            self._snapshots_finalized = final
+            for guild_id, snapshot in snapshots.items():
+                if snapshot:
+                    self._snapshot_store.save(guild_id, snapshot)
+                else:
+                    self._snapshot_store.delete(guild_id)
+
+    def _mark_snapshots_saved(self, snapshots: dict[int, MusicQueueSnapshot | None]) -> None:
+        for guild_id, snapshot in snapshots.items():
+            if snapshot:
+                self._saved_snapshots[guild_id] = snapshot
+            else:
+                self._saved_snapshots.pop(guild_id, None)
+
+    async def _snapshot_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+
+            # guilds waiting to be restored haven't started playing yet, so their snapshots are left alone
+            snapshots = {
+                guild_id: snapshot
+                for guild_id, snapshot in self._take_snapshots().items()
+                if guild_id not in self._pending_restores
+            }
+
+            if snapshots:
+                await loop.run_in_executor(None, self._save_snapshots, snapshots)
+                self._mark_snapshots_saved(snapshots)
+
+    async def _restore_guild(self, guild_id: int) -> None:
+        """Rejoins a guild's voice channel and resumes playback from its snapshot"""
+
+        if not self._snapshot_store:
+            return
+
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, self._snapshot_store.load, guild_id)
+        guild = self.bot.get_guild(guild_id)
+        if not (snapshot and guild) or time.time() - snapshot.saved_at > self._snapshot_max_age:
+            return self._snapshot_store.delete(guild_id)
+
+        existing_service = _player_service_by_guild.get(guild_id)
+        if existing_service and (existing_service.currently_playing or existing_service.queue_size):
+            # someone started playing something new before we got to this guild
+            return
+
+        voice_channel = guild.get_channel(snapshot.voice_channel_id)
+        if not (isinstance(voice_channel, VocalGuildChannel) and any(not m.bot for m in voice_channel.members)):
+            return self._snapshot_store.delete(guild_id)
+
+        item_snapshots = ([snapshot.currently_playing] if snapshot.currently_playing else []) + snapshot.queue
+        requestors: dict[int, Member | User] = {}
+        items: list[MusicQueueItem] = []
+
+        # the snapshot's videos are usually in the search cache, so this rarely touches the network
+        settings = get_settings()
+        videos = self.yt_service.search_videos_async(
+            [item.url for item in item_snapshots], settings.play_many_concurrency
+        )
+        i = 0
+        async for _, video in videos:
+            item_snapshot = item_snapshots[i]
+            i += 1
+            if not video:
+                continue
+
+            if item_snapshot.requestor_id not in requestors:
+                requestors[item_snapshot.requestor_id] = await self._get_requestor(guild, item_snapshot.requestor_id)
+
+            items.append(
+                MusicQueueItem(
+                    player_service=self.yt_service,
+                    music=video,
+                    requestor=requestors[item_snapshot.requestor_id],
+                    start_at=item_snapshot.start_at,
+                )
+            )
+
+        if not items:
+            return self._snapshot_store.delete(guild_id)
+
+        message_channel = guild.get_channel(snapshot.message_channel_id) if snapshot.message_channel_id else None
+        player_service = self.get_queue_service(guild_id)
+        await player_service.restore(
+            snapshot,
+            items,
+            voice_channel,
+            message_channel if isinstance(message_channel, Messageable) else None,
+        )
+
+    @staticmethod
+    async def _get_requestor(guild: Guild, user_id: int) -> Member | User:
+        member = guild.get_member(user_id)
+        if member:
+            return member
+
+        try:
+            return await guild.fetch_member(user_id)
+        except DiscordException:
+            # they've left the server since the snapshot was taken
+            return guild.me
+
     def get_queue_service(self, guild_id: int | None) -> MusicQueueService:
+        """Gets a guild's queue service, creating it if it doesn't exist yet"""
+
         if guild_id is None:
             raise UserNotInServerError()
 
         if guild_id not in _player_service_by_guild:
             _player_service_by_guild[guild_id] = MusicQueueService(self.bot, guild_id)
+            self.queue_services_created += 1
 
         return _player_service_by_guild[guild_id]
 
+    def find_queue_service(self, guild_id: int | None) -> MusicQueueService | None:
+        """Gets a guild's queue service, if it exists. Use this when there's nothing to do for guilds without one"""
+
+        if guild_id is None:
+            raise UserNotInServerError()
+
+        return _player_service_by_guild.get(guild_id)
+
+    @property
+    def queue_service_metrics(self) -> dict[str, int]:
+        return {
+            "active": len(_player_service_by_guild),
+            "idle": len(self._queue_service_idle_since),
+            "created": self.queue_services_created,
+            "evicted": self.queue_services_evicted,
+        }
+
+    def _get_caches(self) -> dict[str, LRUCache | FileCache | ReplayCache]:
+        """Every cache the YouTube service uses, keyed by name. Empty until the YouTube service is created"""
+
+        if not self._yt_service:
+            return {}
+
+        caches: dict[str, LRUCache | FileCache | ReplayCache | None] = {
+            "search": self._yt_service.search_cache,
+            "stream": self._yt_service.stream_cache,
+            "audio": self._yt_service.audio_cache,
+            "replay": self._yt_service.replay_cache,
+            "loudness": self._yt_service.loudness_analyzer.cache if self._yt_service.loudness_analyzer else None,
+        }
+        return {name: cache for name, cache in caches.items() if cache is not None}
+
+    def _get_stream_metrics(self) -> dict[str, dict[str, float]]:
+        """
+        Read instrumentation for every stream currently playing, keyed by metric name and then by guild id
+
+        Each stream is summarized once per collection, and only the exported percentiles are computed
+        """
+
+        metrics: dict[str, dict[str, float]] = {
+            _get_stream_metric_name(key, type): {} for key, _, type in STREAM_METRICS
+        }
+        for guild_id, player_service in _player_service_by_guild.items():
+            stats = player_service.stream_stats
+            if not stats:
+                continue
+
+            summary = stats.summary(latency_percentiles=(50, 99), wait_percentiles=(99,))
+            for key, _, type in STREAM_METRICS:
+                metrics[_get_stream_metric_name(key, type)][str(guild_id)] = float(summary[key])
+
+        return metrics
+
+    def _register_metrics(self) -> None:
+        """Registers metrics which are computed when they're collected, so they cost nothing until then"""
+
+        def register(name: str, documentation: str, callback: Callable[[], dict[str, float]], **kwargs) -> None:
+            REGISTRY.register_callback(name, documentation, callback, **kwargs)
+            self._metric_names.append(name)
+
+        register(
+            "friend_boat_queue_services",
+            "How many queue services there are, and how many have been created and evicted",
+            lambda: {k: float(v) for k, v in self.queue_service_metrics.items()},
+            label="state",
+        )
+        register(
+            "friend_boat_queue_depth",
+            "How many items are queued in each server",
+            lambda: {str(guild_id): float(s.queue_size) for guild_id, s in _player_service_by_guild.items()},
+            label="guild",
+        )
+
+        REGISTRY.register_callback_group(
+            "friend_boat_stream",
+            [(_get_stream_metric_name(key, type), documentation, type) for key, documentation, type in STREAM_METRICS],
+            self._get_stream_metrics,
+            label="guild",
+        )
+        self._metric_names.append("friend_boat_stream")
+
+        register(
+            "friend_boat_cache_hits_total",
+            "How many cache lookups found an entry",
+            lambda: {name: float(cache.hits) for name, cache in self._get_caches().items()},
+            type="counter",
+            label="cache",
+        )
+        register(
+            "friend_boat_cache_misses_total",
+            "How many cache lookups didn't find an entry",
+            lambda: {name: float(cache.misses) for name, cache in self._get_caches().items()},
+            type="counter",
+            label="cache",
+        )
+        register(
+            "friend_boat_cache_hit_ratio",
+            "The share of cache lookups which found an entry",
+            lambda: {
+                name: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0
+                for name, cache in self._get_caches().items()
+            },
+            label="cache",
+        )
+
+    def evict_idle_queue_services(self) -> None:
+        """Tears down queue services which have been idle for longer than the idle TTL"""
+
+        now = time.time()
+        for guild_id, player_service in list(_player_service_by_guild.items()):
+            if not player_service.is_idle or guild_id in self._pending_restores:
+                self._queue_service_idle_since.pop(guild_id, None)
+                continue
+
+            idle_since = self._queue_service_idle_since.setdefault(guild_id, now)
+            if now - idle_since >= self._queue_service_idle_ttl:
+                player_service.clear()
+                del _player_service_by_guild[guild_id]
+                del self._queue_service_idle_since[guild_id]
+                self.queue_services_evicted += 1
+
+        # services which were stopped and removed elsewhere
+        for guild_id in self._queue_service_idle_since.keys() - _player_service_by_guild.keys():
+            del self._queue_service_idle_since[guild_id]
+
+    async def _sweep_queue_services(self) -> None:
+        while True:
+            await asyncio.sleep(self._queue_service_sweep_interval)
+            self.evict_idle_queue_services()
+            logging.debug(f"Queue services: {self.queue_service_metrics}")
+
     @Cog.listener()
     async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState) -> None:
         """Leave empty voice channels"""
 
-        player_service = self.get_queue_service(member.guild.id)
+        before_channel_id = before.channel.id if before.channel else None
+        after_channel_id = after.channel.id if after.channel else None
+        if before_channel_id == after_channel_id:
+            # mutes, deafens, etc.
+            return
+
+        guild_id = member.guild.id
+        if self.bot.user and member.id == self.bot.user.id:
+            if before_channel_id:
+                self._occupied_channels.pop(before_channel_id, None)
+            if not after_channel_id:
+                return self._cancel_leave(guild_id)
+
+            self._occupied_channels[after_channel_id] = guild_id
+        elif before_channel_id not in self._occupied_channels and after_channel_id not in self._occupied_channels:
+            # this doesn't involve any channel we're in
+            return
+
+        player_service = self.find_queue_service(guild_id)
+        if not player_service:
+            return
+
         if player_service.is_alone:
-            await player_service.stop()
+            self._schedule_leave(guild_id)
+        else:
+            self._cancel_leave(guild_id)
+
+    def _schedule_leave(self, guild_id: int) -> None:
+        """Leaves a guild's voice channel after a delay, unless someone rejoins first"""
+
+        if guild_id in self._pending_leaves:
+            return
+
+        async def leave() -> None:
+            try:
+                await asyncio.sleep(self._leave_when_alone_delay)
+                player_service = self.find_queue_service(guild_id)
+                if player_service and player_service.is_alone:
+                    await player_service.stop()
+            finally:
+                # a cancelled leave may have already been replaced by a new one
+                if self._pending_leaves.get(guild_id) is asyncio.current_task():
+                    del self._pending_leaves[guild_id]
+
+        self._pending_leaves[guild_id] = asyncio.get_running_loop().create_task(leave())
+
+    def _cancel_leave(self, guild_id: int) -> None:
+        task = self._pending_leaves.pop(guild_id, None)
+        if task:
+            task.cancel()
 
     async def cog_command_error(self, ctx: ApplicationContext, error: Exception):
         """Base error handling"""
@@ -62,33 +594,38 @@ class Music(DiscordCogBase):
     @option("skip_ahead", description="how far to skip ahead when starting playback, in seconds")
     @option("play_immediately", description="play immediately after the current track, bypassing the queue")
     async def play(self, ctx: ApplicationContext, query: str, skip_ahead: int = 0, play_immediately: bool = False):
+        await self._play(ctx, query, skip_ahead=skip_ahead, play_immediately=play_immediately)
+
+    @require_server_presence()
+    @slash_command(description="Play a YouTube video, or search for one, at a specific position in the queue")
+    @option("query", description="a YouTube Video URL or search query")
+    @option("position", description="where to put it in the queue, starting from 1", min_value=1)
+    @option("skip_ahead", description="how far to skip ahead when starting playback, in seconds")
+    async def play_at(self, ctx: ApplicationContext, query: str, position: int, skip_ahead: int = 0):
+        await self._play(ctx, query, skip_ahead=skip_ahead, position=position - 1)
+
+    async def _play(
+        self,
+        ctx: ApplicationContext,
+        query: str,
+        *,
+        skip_ahead: int = 0,
+        play_immediately: bool = False,
+        position: int | None = None,
+    ):
         if skip_ahead < 0:
             skip_ahead = 0
 
-        # make sure the command was issued from a user in a voice channel
-        if (
-            isinstance(ctx.author, Member)
-            and isinstance(ctx.author.voice, VoiceState)
-            and isinstance(ctx.author.voice.channel, VocalGuildChannel)
-        ):
-            voice_channel = ctx.author.voice.channel
-        else:
-            voice_channel = None
-
-        if not (voice_channel and ctx.guild):
-            raise UserNotInVoiceChannelError()
+        voice_channel = self._get_voice_channel(ctx)
 
         # find the youtube video
         async with ctx.typing():
-            settings = Settings()
-            yt_service = YouTubeService(settings.youtube_api_key)
-
-            yt_video = yt_service.search_video(query)
+            yt_video = await self.yt_service.search_video_async(query)
             if not yt_video:
                 raise NoResultsFoundError(query)
 
             music_item = MusicQueueItem(
-                player_service=yt_service,
+                player_service=self.yt_service,
                 music=yt_video,
                 requestor=ctx.author,
                 start_at=skip_ahead * 1000,
@@ -97,11 +634,31 @@ class Music(DiscordCogBase):
         await ctx.respond("Queued:", embed=music_item.embeds.queued, ephemeral=True)
 
         # queue up the youtube video and start playback if nothing else is playing
-        player_service = self.get_queue_service(ctx.guild.id)
+        player_service = self.get_queue_service(ctx.guild_id)
         if play_immediately:
             player_service.set_next_item(music_item)
         else:
-            player_service.add_to_queue(music_item)
+            player_service.add_to_queue(music_item, position)
+
+        await self._start_playback(ctx, player_service, voice_channel)
+
+    def _get_voice_channel(self, ctx: ApplicationContext) -> VocalGuildChannel:
+        """Gets the voice channel the command was issued from. Raises a `UserNotInVoiceChannelError` if there is none"""
+
+        if (
+            ctx.guild
+            and isinstance(ctx.author, Member)
+            and isinstance(ctx.author.voice, VoiceState)
+            and isinstance(ctx.author.voice.channel, VocalGuildChannel)
+        ):
+            return ctx.author.voice.channel
+        else:
+            raise UserNotInVoiceChannelError()
+
+    async def _start_playback(
+        self, ctx: ApplicationContext, player_service: MusicQueueService, voice_channel: VocalGuildChannel
+    ) -> None:
+        """Starts playing the queue if nothing is playing, otherwise follows the user to their voice channel"""
 
         if not player_service.currently_playing:
             currently_playing_message = await ctx.send("Initializing...")
@@ -110,6 +667,7 @@ class Music(DiscordCogBase):
             await player_service.switch_voice_channel(voice_channel)
 
     @play.error
+    @play_at.error
     async def play_error(self, ctx: ApplicationContext, ex: Exception):
         if isinstance(ex, NoResultsFoundError):
             await ctx.respond(
@@ -118,11 +676,106 @@ class Music(DiscordCogBase):
         elif isinstance(ex, MusicQueueFullError):
             await ctx.respond("Sorry, the queue is currently full", ephemeral=True)
 
+    @require_server_presence()
+    @slash_command(description="Queue several YouTube videos or searches at once")
+    @option("queries", description='YouTube Video URLs or search queries, separated by ";"')
+    async def play_many(self, ctx: ApplicationContext, queries: str):
+        voice_channel = self._get_voice_channel(ctx)
+        query_list = [query.strip() for query in re.split(r"[;\n]", queries) if query.strip()]
+        if not query_list:
+            return await ctx.respond("Please provide at least one query", ephemeral=True)
+
+        settings = get_settings()
+        if len(query_list) > settings.play_many_max_queries:
+            return await ctx.respond(
+                f"Sorry, you can only queue up to {settings.play_many_max_queries} tracks at once", ephemeral=True
+            )
+
+        await ctx.respond(f"Searching for {len(query_list)} tracks...", ephemeral=True)
+
+        # searches run concurrently, but results arrive in order, so tracks are queued in the order they were given
+        player_service = self.get_queue_service(ctx.guild_id)
+        queued = 0
+        not_found: list[str] = []
+        not_queued = 0
+        resolved = 0
+        async for query, video in self.yt_service.search_videos_async(query_list, settings.play_many_concurrency):
+            resolved += 1
+            if not video:
+                not_found.append(query)
+                continue
+
+            try:
+                player_service.add_to_queue(
+                    MusicQueueItem(player_service=self.yt_service, music=video, requestor=ctx.author)
+                )
+            except MusicQueueFullError:
+                not_queued = len(query_list) - resolved + 1
+                break
+
+            queued += 1
+            if queued == 1:
+                await self._start_playback(ctx, player_service, voice_channel)
+
+        lines = [f"Queued {queued} of {len(query_list)} tracks"]
+        if not_found:
+            lines.append("No results found for: " + ", ".join(f'"{query}"' for query in not_found))
+        if not_queued:
+            lines.append(f"The queue filled up before {not_queued} tracks could be queued")
+
+        await ctx.edit(content="\n".join(lines))
+
+    @require_server_presence()
+    @slash_command(description="Queue every video in a YouTube playlist")
+    @option("url", description="a YouTube playlist URL")
+    async def play_playlist(self, ctx: ApplicationContext, url: str):
+        voice_channel = self._get_voice_channel(ctx)
+        playlist_id = self.yt_service.get_youtube_playlist_id_from_url(url)
+        if not playlist_id:
+            return await ctx.respond("That doesn't look like a YouTube playlist URL", ephemeral=True)
+
+        await ctx.respond("Loading playlist...", ephemeral=True)
+
+        # queue each page as soon as it arrives, so playback can start before the whole playlist is loaded
+        player_service = self.get_queue_service(ctx.guild_id)
+        queued = 0
+        queue_full = False
+        try:
+            async for videos in self.yt_service.iter_playlist(playlist_id):
+                for video in videos:
+                    try:
+                        player_service.add_to_queue(
+                            MusicQueueItem(player_service=self.yt_service, music=video, requestor=ctx.author)
+                        )
+                    except MusicQueueFullError:
+                        queue_full = True
+                        break
+
+                    queued += 1
+                    if queued == 1:
+                        await self._start_playback(ctx, player_service, voice_channel)
+
+                if queue_full:
+                    break
+
+                await ctx.edit(content=f"Loading playlist... ({queued} tracks queued so far)")
+        except PyYouTubeException:
+            logging.warning(f"Unable to load playlist {playlist_id}", exc_info=True)
+
+        if not queued:
+            content = "Sorry, that playlist is empty, private, or doesn't exist"
+        elif queue_full:
+            content = f"Queued {queued} tracks from the playlist before the queue filled up"
+        else:
+            content = f"Queued {queued} tracks from the playlist"
+
+        await ctx.edit(content=content)
+
     @require_server_presence()
     @slash_command(description="Pause the current track")
     async def pause(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         if player_service.is_paused:
@@ -136,8 +789,8 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="Resume the current track, if paused")
     async def resume(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         await player_service.resume()
@@ -147,9 +800,9 @@ class Music(DiscordCogBase):
     @slash_command(description="Fast-forward or rewind the current track")
     @option("seconds", description="how far to seek, in seconds. To rewind, input a negative number")
     async def seek(self, ctx: ApplicationContext, seconds: int = 10):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
-            await ctx.respond("Nothing is currently playing", ephemeral=True)
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
+            return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         if seconds == 0:
             response = random.choice(
@@ -174,7 +827,10 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="Skip the current track")
     async def skip(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
+            return await ctx.respond("Nothing is currently playing", ephemeral=True)
+
         async with ctx.typing():
             await player_service.skip()
 
@@ -183,21 +839,21 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="Stop playing the current track and clear the queue")
     async def stop(self, ctx: ApplicationContext):
-        if ctx.guild_id not in _player_service_by_guild:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not player_service:
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
-        player_service = self.get_queue_service(ctx.guild_id)
         async with ctx.typing():
             await player_service.stop()
-            del _player_service_by_guild[ctx.guild_id]
+            _player_service_by_guild.pop(player_service.guild_id, None)
 
         await ctx.respond("Stopped playback and cleared the queue", ephemeral=True)
 
     @require_server_presence()
     @slash_command(description="Restart the current track")
     async def restart(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         player_service.toggle_repeat_once(force_on=True)
@@ -207,8 +863,8 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="Repeat the current track once after it ends")
     async def toggle_repeat(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         if player_service.toggle_repeat_once():
@@ -219,8 +875,8 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="Loop the current track forever (or at least until you all leave)")
     async def toggle_repeat_forever(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         if player_service.toggle_repeat_forever():
@@ -234,8 +890,8 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="Shuffle the queue")
     async def shuffle(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.queue_size:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.queue_size):
             return await ctx.respond("Nothing is currently queued", ephemeral=True)
 
         player_service.shuffle()
@@ -243,16 +899,51 @@ class Music(DiscordCogBase):
 
     ### Queue Controls ###
 
+    @require_server_presence()
+    @slash_command(
+        description="Take turns playing each person's tracks, instead of playing them in the order they were added"
+    )
+    async def toggle_fair_queue(self, ctx: ApplicationContext):
+        player_service = self.get_queue_service(ctx.guild_id)
+        if player_service.toggle_fair_queue():
+            await ctx.respond("Okay, everyone will take turns", ephemeral=True)
+        else:
+            await ctx.respond("Okay, tracks will play in the order they're added", ephemeral=True)
+
     @require_server_presence()
     @slash_command(description="Empty the queue without stopping the current track")
     async def clear_queue(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.queue_size:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.queue_size):
             return await ctx.respond("Nothing is currently queued", ephemeral=True)
 
         player_service.clear()
         await ctx.respond("Queue cleared")
 
+    @require_server_presence()
+    @slash_command(description="Remove a track from the queue")
+    @option("position", description="the track's position in the queue, starting from 1", min_value=1)
+    async def remove(self, ctx: ApplicationContext, position: int):
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and 1 <= position <= player_service.queue_size):
+            return await ctx.respond(f"There's nothing queued at position {position}", ephemeral=True)
+
+        item = player_service.remove_from_queue(position - 1)
+        await ctx.respond(f"Removed **{item.music.name}** from the queue", ephemeral=True)
+
+    @require_server_presence()
+    @slash_command(description="Move a track to a different position in the queue")
+    @option("position", description="the track's position in the queue, starting from 1", min_value=1)
+    @option("new_position", description="where to move the track to, starting from 1", min_value=1)
+    async def move(self, ctx: ApplicationContext, position: int, new_position: int):
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and 1 <= position <= player_service.queue_size):
+            return await ctx.respond(f"There's nothing queued at position {position}", ephemeral=True)
+
+        new_position = min(new_position, player_service.queue_size)
+        item = player_service.move_in_queue(position - 1, new_position - 1)
+        await ctx.respond(f"Moved **{item.music.name}** to position {new_position}", ephemeral=True)
+
     @require_server_presence()
     @slash_command(description="Apply an audio effect to the currently playing song")
     async def apply_effect(
@@ -262,8 +953,8 @@ class Music(DiscordCogBase):
             str, choices=[e.value for e in AudioStreamEffect], description="Choose your effect"
         ),
     ):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         try:
@@ -277,11 +968,19 @@ class Music(DiscordCogBase):
         else:
             return await ctx.respond("Effect applied", ephemeral=True)
 
+    @require_server_presence()
+    @slash_command(description="Change the volume for everyone in this server")
+    @option("percent", description="the new volume, from 0 to 200 percent", min_value=0, max_value=200)
+    async def volume(self, ctx: ApplicationContext, percent: int = 100):
+        player_service = self.get_queue_service(ctx.guild_id)
+        await player_service.set_volume(percent / 100)
+        await ctx.respond(f"Volume set to {round(player_service.volume * 100)}%", ephemeral=True)
+
     @require_server_presence()
     @slash_command(description="Show what's currently playing")
     async def now_playing(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        if not player_service.currently_playing:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.currently_playing):
             return await ctx.respond("Nothing is currently playing", ephemeral=True)
 
         text = "Now Playing (Currently Paused):" if player_service.is_paused else "Now Playing:"
@@ -290,14 +989,50 @@ class Music(DiscordCogBase):
     @require_server_presence()
     @slash_command(description="List everything coming up")
     async def up_next(self, ctx: ApplicationContext):
-        player_service = self.get_queue_service(ctx.guild_id)
-        pages = player_service.embeds.queue_pages
-        if not pages:
+        player_service = self.find_queue_service(ctx.guild_id)
+        if not (player_service and player_service.queue_size):
             return await ctx.respond("Nothing is currently queued", ephemeral=True)
 
-        settings = Settings()
         await ctx.respond("Here's what's up next:")
-        await SimplePaginator(timeout=settings.queue_paginator_timeout).start(ctx, pages=pages)
+        await QueuePaginator(player_service.embeds, timeout=self._queue_paginator_timeout).start(ctx)
+
+    ### Diagnostics ###
+
+    @command()
+    @is_owner()
+    async def stream_stats(self, ctx: ApplicationContext, guild_id: int | None = None):
+        """Shows read instrumentation for a server's stream, to tell network starvation from CPU starvation"""
+
+        guild_id = guild_id or (ctx.guild.id if ctx.guild else None)
+        player_service = _player_service_by_guild.get(guild_id) if guild_id else None
+        stats = player_service.stream_stats if player_service else None
+        if not stats:
+            return await ctx.send("Nothing is currently playing")
+
+        summary = stats.summary()
+        lines = [
+            f"reads: {summary['reads']}",
+            "latency p50/p90/p99: "
+            + "/".join(f"{summary[k] * 1000:.2f}ms" for k in ["latency_p50", "latency_p90", "latency_p99"]),
+            "ffmpeg wait p50/p90/p99: "
+            + "/".join(f"{summary[k] * 1000:.2f}ms" for k in ["wait_p50", "wait_p90", "wait_p99"]),
+            f"short frames: {summary['short_frames']}, empty frames: {summary['empty_frames']}",
+            f"drift: {summary['drift'] * 1000:.0f}ms",
+            f"stalls: {summary['stalls']}",
+        ]
+        if stats.read_ahead:
+            lines.append(
+                f"read-ahead: {summary['buffered'] * 1000:.0f}/{summary['buffer_capacity'] * 1000:.0f}ms buffered, "
+                f"{summary['underruns']} underruns"
+            )
+
+        for stall in stats.stalls:
+            lines.append(
+                f"  {time.strftime('%H:%M:%S', time.gmtime(stall.at))} UTC: {stall.duration * 1000:.0f}ms "
+                f"({stall.wait * 1000:.0f}ms waiting on ffmpeg, likely {stall.cause})"
+            )
+
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
 
     ### Custom Commands ###
 
@@ -1,5 +1,10 @@
+import asyncio
+import json
 import logging
+import os
+from typing import Callable
 
+from pydantic import ValidationError
 from pydantic_settings import BaseSettings
 
 
@@ -9,6 +14,28 @@ class Settings(BaseSettings):
 
     # bot config
     command_prefix: str = "/"
+    sharded: bool = False
+    """Whether to split the bot into shards, which is required once it's in more than 2,500 servers"""
+    shard_count: int | None = None
+    """How many shards to split the bot into. Defaults to Discord's recommendation"""
+    worker_count: int = 1
+    """How many processes to run shards in. More than one starts a supervisor which runs each in its own process"""
+    worker_heartbeat_interval: int = 10
+    """How often each worker process reports its health to the supervisor, in seconds"""
+    worker_heartbeat_timeout: int = 120
+    """How long a worker can go without reporting its health before the supervisor restarts it, in seconds"""
+    worker_restart_delay: int = 5
+    """How long the supervisor waits before restarting a worker, in seconds"""
+    app_port: int = 9000
+    """The port to serve metrics on. With several workers, each worker serves its own metrics on the next port up"""
+    metrics_enabled: bool = True
+    """Whether to serve metrics over HTTP at /metrics"""
+    data_dir: str = "data"
+    """Where to persist data between restarts, such as caches"""
+    settings_file: str = "settings.json"
+    """A JSON file in the data directory which can override some settings while the bot is running"""
+    settings_reload_interval: int = 30
+    """How often to check the settings file for changes, in seconds. Use 0 to disable reloading"""
 
     # auth
     discord_bot_token: str = ""
@@ -16,6 +43,203 @@ class Settings(BaseSettings):
 
     # queue
     max_queue_size: int = 100
+    fair_queue: bool = False
+    """Whether queues take turns between requestors by default, rather than playing tracks in the order they're added"""
+    play_many_max_queries: int = 25
+    """The most queries /play_many accepts at once"""
+    play_many_concurrency: int = 4
+    """How many /play_many queries to search for at the same time"""
     queue_paginator_page_size: int = 5
     queue_paginator_timeout: int = 60
     """How long until the queue paginator embed list times out, in seconds"""
+
+    queue_service_idle_ttl: int = 60 * 5
+    """How long a server can go without playing anything before its queue is torn down, in seconds"""
+    queue_service_sweep_interval: int = 60
+    """How often to look for idle queues to tear down, in seconds"""
+
+    # snapshots
+    snapshot_interval: int = 15
+    """How often to save each guild's queue and playback state, in seconds. Use 0 to disable snapshots"""
+    snapshot_max_age: int = 60 * 60
+    """How old a snapshot can be and still be restored after a restart, in seconds"""
+    snapshot_restore_concurrency: int = 4
+    """How many guilds to restore at the same time after a restart"""
+
+    # playback
+    leave_when_alone_delay: int = 30
+    """How long to wait before leaving a voice channel everyone else has left, in seconds"""
+    prefetch_delay: int = 10
+    """How far into the current track to start preparing the next one, in seconds"""
+    prefetch_spawn_player: bool = False
+    """Whether to start the next track's ffmpeg process ahead of time, rather than just resolving its stream"""
+    prefetch_buffer_duration: int = 3000
+    """How much audio to buffer when starting the next track's ffmpeg process ahead of time, in milliseconds"""
+    opus_passthrough: bool = True
+    """Whether to send Opus audio to Discord without re-encoding it when no effects are applied"""
+    rewind_history_duration: int = 30_000
+    """How much played Opus audio to keep in memory for instant rewinds, in ms. Takes ~20KB per second per stream"""
+    rewind_history_pcm_duration: int = 0
+    """The same for decoded audio, e.g. with effects. Off by default, since it takes ~192KB per second per stream"""
+    read_ahead_duration: int = 0
+    """How much decoded audio to read ahead of playback on a separate thread, in milliseconds. Use 0 to disable"""
+
+    # youtube
+    youtube_http_pool_size: int = 10
+    """How many keep-alive connections to hold open to the YouTube Data API"""
+    ytdl_pool_size: int = 4
+    """How many streams can be extracted concurrently"""
+    search_cache_size: int = 1000
+    """How many search results to keep cached"""
+    search_cache_ttl: int = 60 * 60 * 24
+    """How long search results stay cached, in seconds"""
+    search_cache_persist: bool = True
+    """Whether to save search results to the data directory so they survive restarts"""
+    stream_cache_size: int = 500
+    """How many resolved media streams to keep cached"""
+    stream_cache_expiry_margin: int = 60 * 15
+    """How long before a media URL expires to stop using it, in seconds"""
+    stream_cache_default_ttl: int = 60 * 60
+    """How long to cache media URLs which don't report when they expire, in seconds"""
+
+    # audio cache
+    audio_cache_enabled: bool = False
+    """Whether to save audio to the data directory while it plays, so it can be replayed from disk"""
+    audio_cache_max_bytes: int = 2 * 1024**3
+    """How much disk space the audio cache can use, in bytes. With several workers, this is shared by all of them"""
+
+    # replay cache
+    replay_cache_enabled: bool = True
+    """Whether to keep Opus audio in memory while it plays, so repeats are played without ffmpeg or the network"""
+    replay_cache_track_max_bytes: int = 8 * 1024**2
+    """The largest track to keep in the replay cache, in bytes. Opus audio takes roughly 1MB per minute"""
+    replay_cache_max_bytes: int = 128 * 1024**2
+    """How much memory the replay cache can use in total, including tracks still being captured, in bytes"""
+
+    # loudness normalization
+    loudness_normalization: bool = False
+    """Whether to measure each track's loudness in the background and normalize it the next time it plays"""
+    loudness_target: float = -14.0
+    """The loudness to normalize tracks to, in LUFS"""
+    loudness_max_gain: float = 12.0
+    """The most a track can be boosted or cut by when normalizing, in dB"""
+    loudness_tolerance: float = 1.0
+    """Tracks within this many dB of the target aren't normalized, so Opus audio can still be passed through"""
+    loudness_cache_size: int = 10000
+    """How many track measurements to keep"""
+
+
+RELOADABLE_SETTINGS = {
+    "max_queue_size",
+    "play_many_max_queries",
+    "play_many_concurrency",
+    "queue_paginator_page_size",
+    "queue_paginator_timeout",
+    "queue_service_idle_ttl",
+    "leave_when_alone_delay",
+    "search_cache_size",
+    "stream_cache_size",
+    "audio_cache_max_bytes",
+    "replay_cache_max_bytes",
+    "loudness_cache_size",
+}
+"""Settings which can be changed in the settings file without restarting"""
+
+
+class SettingsProvider:
+    def __init__(self, settings: Settings | None = None) -> None:
+        """
+        Parses the settings once and shares them across the process
+
+        Settings in `RELOADABLE_SETTINGS` can be overridden by the settings file, which is checked for changes by
+        `watch`. Subscribers are called with the new settings whenever they change
+        """
+
+        self._base_settings = settings or Settings()
+        self._settings = self._base_settings
+        self._subscribers: list[Callable[[Settings], None]] = []
+
+        self.path = os.path.join(self._base_settings.data_dir, self._base_settings.settings_file)
+        self._mtime: float | None = None
+
+    @property
+    def settings(self) -> Settings:
+        return self._settings
+
+    def subscribe(self, subscriber: Callable[[Settings], None]) -> None:
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: Callable[[Settings], None]) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+
+    def _read_overrides(self) -> dict:
+        try:
+            with open(self.path) as f:
+                overrides = json.load(f)
+        except FileNotFoundError:
+            return {}
+
+        if not isinstance(overrides, dict):
+            raise ValueError("expected a JSON object")
+
+        for key in overrides.keys() - RELOADABLE_SETTINGS:
+            logging.warning(f'Ignoring "{key}" in settings file "{self.path}", since it can\'t be reloaded')
+
+        return {k: v for k, v in overrides.items() if k in RELOADABLE_SETTINGS}
+
+    def reload(self) -> bool:
+        """Re-reads the settings file if it has changed, and returns whether any settings changed"""
+
+        try:
+            mtime: float | None = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self._mtime:
+            return False
+
+        self._mtime = mtime
+        try:
+            # validating a copy doesn't parse the environment again
+            settings = Settings.model_validate(self._base_settings.model_dump() | self._read_overrides())
+        except (OSError, ValueError, ValidationError):
+            logging.exception(f'Unable to load settings file "{self.path}", keeping the current settings')
+            return False
+
+        if settings == self._settings:
+            return False
+
+        self._settings = settings
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber(settings)
+            except Exception:
+                logging.exception("Unable to apply reloaded settings")
+
+        return True
+
+    async def watch(self) -> None:
+        """Reloads the settings file whenever it changes. Runs until cancelled"""
+
+        while True:
+            self.reload()
+            await asyncio.sleep(self._base_settings.settings_reload_interval)
+
+
+_provider: SettingsProvider | None = None
+
+
+def get_settings_provider() -> SettingsProvider:
+    global _provider
+    if not _provider:
+        _provider = SettingsProvider()
+        _provider.reload()
+
+    return _provider
+
+
+def get_settings() -> Settings:
+    """The current settings, which are only parsed once per process"""
+
+    return get_settings_provider().settings
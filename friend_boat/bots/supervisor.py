@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from dataclasses import asdict, dataclass, field
+from multiprocessing.context import SpawnProcess
+from queue import Empty
+
+import aiohttp
+from discord import Bot
+
+from .bot import init_bot, run_bot
+from .settings import get_settings
+
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+@dataclass
+class WorkerHeartbeat:
+    """Sent periodically from each worker process to the supervisor"""
+
+    worker_id: int
+    guilds: int
+    voice_clients: int
+    latency: float
+    sent_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class WorkerHealth:
+    worker_id: int
+    shard_ids: list[int]
+
+    pid: int | None = None
+    restarts: int = 0
+    started_at: float | None = None
+    last_heartbeat: WorkerHeartbeat | None = None
+
+    def is_healthy(self, heartbeat_timeout: float) -> bool:
+        return bool(self.last_heartbeat and time.time() - self.last_heartbeat.sent_at < heartbeat_timeout)
+
+
+def get_recommended_shard_count(token: str) -> int:
+    """Asks Discord how many shards the bot should be split into"""
+
+    async def fetch() -> int:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(DISCORD_GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return int(data["shards"])
+
+    return asyncio.run(fetch())
+
+
+def split_shards(shard_count: int, worker_count: int) -> list[list[int]]:
+    """Splits shards into contiguous ranges, one per worker, as evenly as possible"""
+
+    worker_count = max(min(worker_count, shard_count), 1)
+    base, extra = divmod(shard_count, worker_count)
+
+    ranges: list[list[int]] = []
+    start = 0
+    for i in range(worker_count):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
+
+
+def _send_heartbeats(bot: Bot, worker_id: int, heartbeats: multiprocessing.Queue, interval: float) -> None:
+    started = False
+
+    async def send_heartbeats() -> None:
+        while not bot.is_closed():
+            heartbeat = WorkerHeartbeat(
+                worker_id=worker_id,
+                guilds=len(bot.guilds),
+                voice_clients=len(bot.voice_clients),
+                latency=bot.latency,
+            )
+            heartbeats.put_nowait(heartbeat)
+            await asyncio.sleep(interval)
+
+    async def on_ready() -> None:
+        # on_ready fires again after reconnecting, but we only need one heartbeat loop
+        nonlocal started
+        if not started:
+            started = True
+            asyncio.get_running_loop().create_task(send_heartbeats())
+
+    bot.add_listener(on_ready, "on_ready")
+
+
+def run_worker(
+    worker_id: int, shard_ids: list[int], shard_count: int, heartbeats: multiprocessing.Queue, interval: float
+) -> None:
+    """Runs the shards assigned to this worker. This is the entry point of each worker process"""
+
+    # workers can't share a port, so each serves its metrics on its own
+    bot = init_bot(shard_ids=shard_ids, shard_count=shard_count, metrics_port=get_settings().app_port + worker_id)
+    _send_heartbeats(bot, worker_id, heartbeats, interval)
+    run_bot(bot)
+
+
+class Supervisor:
+    def __init__(
+        self,
+        worker_count: int,
+        shard_count: int,
+        *,
+        heartbeat_interval: float = 10,
+        heartbeat_timeout: float = 60,
+        restart_delay: float = 5,
+    ) -> None:
+        """
+        Runs the bot's shards across several worker processes, so they aren't all competing for one GIL
+
+        Workers which crash, or stop sending heartbeats, are restarted
+
+        heartbeat_interval: How often workers report their health, in seconds
+        heartbeat_timeout: How long a worker can go without reporting its health before it's restarted, in seconds.
+            Workers have this long to connect to Discord after starting
+        restart_delay: How long to wait before restarting a worker, in seconds
+        """
+
+        self.shard_count = shard_count
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_delay = restart_delay
+
+        self._context = multiprocessing.get_context("spawn")
+        self._heartbeats: multiprocessing.Queue = self._context.Queue()
+        self._processes: dict[int, SpawnProcess] = {}
+        self._workers = {
+            worker_id: WorkerHealth(worker_id=worker_id, shard_ids=shard_ids)
+            for worker_id, shard_ids in enumerate(split_shards(shard_count, worker_count))
+        }
+        self._restart_at: dict[int, float] = {}
+        self._stopping = False
+
+    def _start_worker(self, worker_id: int) -> None:
+        worker = self._workers[worker_id]
+        process = self._context.Process(
+            target=run_worker,
+            args=(worker_id, worker.shard_ids, self.shard_count, self._heartbeats, self.heartbeat_interval),
+            name=f"friend_boat-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+
+        self._processes[worker_id] = process
+        worker.pid = process.pid
+        worker.started_at = time.time()
+        worker.last_heartbeat = None
+        logging.info(f"Started worker {worker_id} (pid {process.pid}) with shards {worker.shard_ids}")
+
+    def _schedule_restart(self, worker_id: int, reason: str) -> None:
+        if worker_id in self._restart_at:
+            return
+
+        logging.warning(f"Worker {worker_id} {reason}, restarting in {self.restart_delay} seconds")
+        self._restart_at[worker_id] = time.time() + self.restart_delay
+
+    def start(self) -> None:
+        for worker_id in self._workers:
+            self._start_worker(worker_id)
+
+    def poll(self) -> None:
+        """Collects heartbeats and restarts workers which have crashed or hung"""
+
+        while True:
+            try:
+                heartbeat: WorkerHeartbeat = self._heartbeats.get_nowait()
+            except Empty:
+                break
+
+            self._workers[heartbeat.worker_id].last_heartbeat = heartbeat
+
+        now = time.time()
+        for worker_id, process in self._processes.items():
+            worker = self._workers[worker_id]
+            if worker_id in self._restart_at:
+                continue
+
+            if not process.is_alive():
+                self._schedule_restart(worker_id, f"exited with code {process.exitcode}")
+                continue
+
+            last_seen = worker.last_heartbeat.sent_at if worker.last_heartbeat else worker.started_at or now
+            if now - last_seen > self.heartbeat_timeout:
+                process.kill()
+                self._schedule_restart(worker_id, "stopped responding")
+
+        for worker_id, restart_at in list(self._restart_at.items()):
+            if restart_at <= now:
+                del self._restart_at[worker_id]
+                self._processes[worker_id].join(timeout=5)
+                self._workers[worker_id].restarts += 1
+                self._start_worker(worker_id)
+
+    @property
+    def health(self) -> dict:
+        """The aggregate health of every worker"""
+
+        workers = list(self._workers.values())
+        heartbeats = [worker.last_heartbeat for worker in workers if worker.last_heartbeat]
+        return {
+            "healthy": all(worker.is_healthy(self.heartbeat_timeout) for worker in workers),
+            "workers": len(workers),
+            "healthy_workers": sum(worker.is_healthy(self.heartbeat_timeout) for worker in workers),
+            "shards": self.shard_count,
+            "guilds": sum(heartbeat.guilds for heartbeat in heartbeats),
+            "voice_clients": sum(heartbeat.voice_clients for heartbeat in heartbeats),
+            "restarts": sum(worker.restarts for worker in workers),
+            "worker_health": [asdict(worker) for worker in workers],
+        }
+
+    def stop(self, *_) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        """Starts every worker and supervises them until the supervisor is terminated"""
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.start()
+        last_report = time.time()
+        try:
+            while not self._stopping:
+                self.poll()
+                if time.time() - last_report >= self.heartbeat_interval:
+                    health = self.health
+                    logging.info(
+                        f"{health['healthy_workers']}/{health['workers']} workers healthy, "
+                        f"{health['guilds']} guilds, {health['voice_clients']} voice clients"
+                    )
+                    last_report = time.time()
+
+                time.sleep(1)
+        finally:
+            for process in self._processes.values():
+                process.terminate()
+
+            for process in self._processes.values():
+                process.join(timeout=10)
+
+
+def run_supervisor() -> None:
+    settings = get_settings()
+    logging.basicConfig(level=settings.log_level)
+
+    shard_count = settings.shard_count or get_recommended_shard_count(settings.discord_bot_token)
+    Supervisor(
+        settings.worker_count,
+        shard_count,
+        heartbeat_interval=settings.worker_heartbeat_interval,
+        heartbeat_timeout=settings.worker_heartbeat_timeout,
+        restart_delay=settings.worker_restart_delay,
+    ).run()
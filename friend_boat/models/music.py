@@ -1,18 +1,18 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Generator, TypeVar
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Callable
 
 from discord import Embed, Member, User
 from discord.ext.commands import CommandError
 
-from friend_boat.bots.settings import Settings
-from friend_boat.services._base import AudioPlayer, AudioStream, AudioStreamEffect, MusicPlayerServiceBase
+from friend_boat.services._base import AudioPlayer, AudioStreamEffect, BaseAudioStream, MusicPlayerServiceBase
+from friend_boat.services.music_queue import IndexedQueue
 
 from ._base import MusicItemBase
 
-T = TypeVar("T")
-
 
 @dataclass
 class MusicQueueItem:
@@ -20,12 +20,13 @@ class MusicQueueItem:
     music: MusicItemBase
     requestor: Member | User
 
-    source: AudioStream | None = None
+    source: BaseAudioStream | None = None
     """The AudioStream source, if it already exists"""
     start_at: int = 0
     """When to start playback, in milliseconds"""
 
     effect: AudioStreamEffect | None = None
+    volume: float = 1.0
 
     _embeds: MusicQueueItemEmbeds | None = None
     _player: AudioPlayer | None = None
@@ -52,17 +53,29 @@ class MusicQueueItem:
 
             if not self.source:
                 self.source = await self.player_service.get_source(
-                    self.music, start_at=self.start_at, effect=self.effect
+                    self.music,
+                    start_at=self.start_at,
+                    effect=self.effect,
+                    allow_passthrough=self.volume == 1.0,
                 )
 
-            self._player = await self.player_service.get_player(self.source)
+            self._player = await self.player_service.get_player(self.source, volume=self.volume)
 
         return self._player
 
+    def unload_player(self) -> None:
+        """Stops and discards the loaded source and player, if any, so they can be loaded again later"""
+
+        if self.source:
+            self.source.cleanup()
+
+        self.source = None
+        self._player = None
+
     def copy(self, **kwargs) -> MusicQueueItem:
         attrs = {
             k: kwargs[k] if k in kwargs else getattr(self, k)
-            for k in ["player_service", "music", "requestor", "start_at", "effect"]
+            for k in ["player_service", "music", "requestor", "start_at", "effect", "volume"]
         }
 
         return MusicQueueItem(**attrs)
@@ -92,33 +105,121 @@ class MusicQueueItemEmbeds:
 
 
 class MusicQueueEmbeds:
-    def __init__(self, queue_items: list[MusicQueueItem]) -> None:
-        self._items = queue_items
+    def __init__(self, queue: IndexedQueue[MusicQueueItem], page_size: int) -> None:
+        """
+        Renders pages of the queue on demand
 
-    @staticmethod
-    def chunk_list(list_: list[T], chunk_size: int) -> Generator[list[T], list[T], None]:
-        """Break a list into smaller list of size `chunk_size`"""
-        for i in range(0, len(list_), chunk_size):
-            yield list_[i : i + chunk_size]
+        Rendered pages are reused until the queue changes
+        """
+
+        self._queue = queue
+        self.page_size = page_size
+
+        self._pages: dict[int, Embed] = {}
+        self._pages_key = (queue.version, page_size)
+        """the queue version and page size the cached pages were rendered with"""
+
+    @property
+    def page_count(self) -> int:
+        """How many pages there are. An empty queue still has one (empty) page"""
+
+        return max(math.ceil(len(self._queue) / self.page_size), 1)
 
     def _build_queue_item_text(self, item: MusicQueueItem) -> str:
         return f"**{item.music.name}**, requested by *{item.requestor.display_name}*"
 
     def _build_queue_item_page(self, items: list[MusicQueueItem]) -> Embed:
+        if not items:
+            return Embed(title="Up Next", description="Nothing is currently queued")
+
         return Embed(
-            title="Up Next" if len(items) == 1 else f"Up Next ({len(items)} items queued)",
+            title="Up Next" if len(self._queue) == 1 else f"Up Next ({len(self._queue)} items queued)",
             description="\n---\n".join([self._build_queue_item_text(item) for item in items]),
         )
 
-    @property
-    def queue_pages(self) -> list[Embed]:
-        """A list of embeds, each representing one page of queue items"""
-
-        settings = Settings()
-        return [
-            self._build_queue_item_page(chunk)
-            for chunk in self.chunk_list(self._items, settings.queue_paginator_page_size)
-        ]
+    def get_page(self, page: int) -> Embed:
+        """Renders one page of queue items, starting from 0. Pages past the end are clamped to the last page"""
+
+        if self._pages_key != (self._queue.version, self.page_size):
+            self._pages.clear()
+            self._pages_key = (self._queue.version, self.page_size)
+
+        page = min(max(page, 0), self.page_count - 1)
+        if page not in self._pages:
+            start = page * self.page_size
+            stop = min(start + self.page_size, len(self._queue))
+            self._pages[page] = self._build_queue_item_page([self._queue[i] for i in range(start, stop)])
+
+        return self._pages[page]
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Calls `listener` whenever the queue changes, i.e. whenever the pages may have changed"""
+
+        self._queue.add_listener(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        self._queue.remove_listener(listener)
+
+
+@dataclass
+class MusicQueueItemSnapshot:
+    url: str
+    requestor_id: int
+    start_at: int = 0
+    """When to start playback, in milliseconds"""
+
+    def to_json(self) -> list:
+        return [self.url, self.requestor_id, self.start_at]
+
+    @classmethod
+    def from_json(cls, data: list) -> MusicQueueItemSnapshot:
+        return cls(*data)
+
+
+@dataclass
+class MusicQueueSnapshot:
+    """The state of a guild's queue and playback, which can be saved and restored after a restart"""
+
+    voice_channel_id: int
+    message_channel_id: int | None
+    """The channel the "Now Playing" message was sent in"""
+
+    currently_playing: MusicQueueItemSnapshot | None
+    """The item which was playing, which starts from where it left off"""
+    queue: list[MusicQueueItemSnapshot]
+
+    effect: str | None = None
+    volume: float = 1.0
+    repeat_once: bool = False
+    repeat_forever: bool = False
+    fair_queue: bool = False
+
+    saved_at: float = field(default_factory=time.time, compare=False)
+    """When the snapshot was taken, as a unix timestamp. Ignored when comparing snapshots"""
+
+    def to_json(self) -> dict:
+        return {
+            "voice_channel_id": self.voice_channel_id,
+            "message_channel_id": self.message_channel_id,
+            "currently_playing": self.currently_playing.to_json() if self.currently_playing else None,
+            "queue": [item.to_json() for item in self.queue],
+            "effect": self.effect,
+            "volume": self.volume,
+            "repeat_once": self.repeat_once,
+            "repeat_forever": self.repeat_forever,
+            "fair_queue": self.fair_queue,
+            "saved_at": self.saved_at,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> MusicQueueSnapshot:
+        currently_playing = data.pop("currently_playing")
+        queue = data.pop("queue")
+        return cls(
+            currently_playing=MusicQueueItemSnapshot.from_json(currently_playing) if currently_playing else None,
+            queue=[MusicQueueItemSnapshot.from_json(item) for item in queue],
+            **data,
+        )
 
 
 class MusicQueueFullError(CommandError):
@@ -4,8 +4,12 @@
 
 from __future__ import annotations
 
+import asyncio
+
 import discord
 
+from friend_boat.models.music import MusicQueueEmbeds
+
 
 class SimplePaginator(discord.ui.View):
     """
@@ -48,9 +52,21 @@ class SimplePaginator(discord.ui.View):
 
         super().__init__(timeout=timeout)
 
+    def _get_page(self, index: int) -> discord.Embed:
+        return self.pages[index]
+
+    def _get_page_count(self) -> int:
+        return len(self.pages)
+
+    def _update_page_counter(self) -> None:
+        self.page_counter.label = f"{self.current_page + 1}/{self.total_page_count}"
+
     async def start(self, ctx: discord.ApplicationContext, pages: list[discord.Embed]):
         self.pages = pages
-        self.total_page_count = len(pages)
+        await self._start(ctx)
+
+    async def _start(self, ctx: discord.ApplicationContext):
+        self.total_page_count = self._get_page_count()
         self.ctx = ctx
         self.current_page = self.InitialPage
 
@@ -65,7 +81,7 @@ class SimplePaginator(discord.ui.View):
         self.add_item(self.page_counter)
         self.add_item(self.NextButton)
 
-        self.message = await ctx.send(embed=self.pages[self.InitialPage], view=self)
+        self.message = await ctx.send(embed=self._get_page(self.InitialPage), view=self)
 
     async def previous(self):
         if self.current_page == 0:
@@ -73,8 +89,8 @@ class SimplePaginator(discord.ui.View):
         else:
             self.current_page -= 1
 
-        self.page_counter.label = f"{self.current_page + 1}/{self.total_page_count}"
-        await self.message.edit(embed=self.pages[self.current_page], view=self)
+        self._update_page_counter()
+        await self.message.edit(embed=self._get_page(self.current_page), view=self)
 
     async def next(self):
         if self.current_page == self.total_page_count - 1:
@@ -82,8 +98,8 @@ class SimplePaginator(discord.ui.View):
         else:
             self.current_page += 1
 
-        self.page_counter.label = f"{self.current_page + 1}/{self.total_page_count}"
-        await self.message.edit(embed=self.pages[self.current_page], view=self)
+        self._update_page_counter()
+        await self.message.edit(embed=self._get_page(self.current_page), view=self)
 
     async def next_button_callback(self, interaction: discord.Interaction):
         if interaction.user != self.ctx.author:
@@ -109,3 +125,71 @@ class SimplePaginator(discord.ui.View):
 class SimplePaginatorPageCounter(discord.ui.Button):
     def __init__(self, style: discord.ButtonStyle, TotalPages, InitialPage):
         super().__init__(label=f"{InitialPage + 1}/{TotalPages}", style=style, disabled=True)
+
+
+class QueuePaginator(SimplePaginator):
+    """
+    Paginates the music queue, rendering each page when it's shown
+
+    The shown page is refreshed whenever the queue changes, until the paginator times out. Changes are batched
+    together so bulk changes, like queueing a playlist, only edit the message once
+    """
+
+    REFRESH_DELAY = 1
+    """How long to wait after the queue changes before refreshing, in seconds"""
+
+    def __init__(self, embeds: MusicQueueEmbeds, **kwargs) -> None:
+        super().__init__(**kwargs)
+
+        self.embeds = embeds
+        self._refresh_task: asyncio.Task | None = None
+
+    def _get_page(self, index: int) -> discord.Embed:
+        return self.embeds.get_page(index)
+
+    def _get_page_count(self) -> int:
+        return self.embeds.page_count
+
+    async def start(self, ctx: discord.ApplicationContext):
+        await self._start(ctx)
+        self.embeds.add_listener(self._schedule_refresh)
+
+    async def previous(self):
+        self.total_page_count = self._get_page_count()
+        self.current_page = min(self.current_page, self.total_page_count - 1)
+        await super().previous()
+
+    async def next(self):
+        self.total_page_count = self._get_page_count()
+        self.current_page = min(self.current_page, self.total_page_count - 1)
+        await super().next()
+
+    async def refresh(self):
+        """Re-renders the shown page, moving back to the last page if the queue has shrunk"""
+
+        self.total_page_count = self._get_page_count()
+        self.current_page = min(self.current_page, self.total_page_count - 1)
+
+        self._update_page_counter()
+        await self.message.edit(embed=self._get_page(self.current_page), view=self)
+
+    def _schedule_refresh(self) -> None:
+        if self.message and not (self._refresh_task and not self._refresh_task.done()):
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_later())
+
+    async def _refresh_later(self):
+        await asyncio.sleep(self.REFRESH_DELAY)
+        try:
+            await self.refresh()
+        except discord.HTTPException:
+            # e.g. the message was deleted
+            self.stop_refreshing()
+
+    def stop_refreshing(self) -> None:
+        self.embeds.remove_listener(self._schedule_refresh)
+        if self._refresh_task and self._refresh_task is not asyncio.current_task():
+            self._refresh_task.cancel()
+
+    async def on_timeout(self):
+        self.stop_refreshing()
+        await super().on_timeout()
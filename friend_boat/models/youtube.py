@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from enum import Enum
 
 from discord.ext.commands import CommandError
@@ -14,6 +15,22 @@ class SearchType(Enum):
 class YoutubeVideo(MusicItemBase): ...
 
 
+@dataclass
+class YoutubeStream:
+    """A resolved media stream for a YouTube video"""
+
+    url: str
+    bitrate: int
+    format_id: str | None = None
+    ext: str | None = None
+    acodec: str | None = None
+
+    expires_at: float | None = None
+    """When the media URL expires, as a unix timestamp"""
+    duration: float | None = None
+    """How long the video is, in seconds"""
+
+
 class NoResultsFoundError(CommandError):
     def __init__(self, query: str) -> None:
         super().__init__(f'No results found for query: "{query}"')
@@ -1,13 +1,25 @@
 import html
+import logging
+import subprocess
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import deque
 from enum import Enum
 from io import BufferedIOBase
-from typing import IO
+from typing import IO, cast
 
-from discord import FFmpegPCMAudio, PCMVolumeTransformer
+from discord import AudioSource, FFmpegOpusAudio, FFmpegPCMAudio
+from discord.opus import Encoder as OpusEncoder
 
 from friend_boat.models._base import MusicItemBase
 
+from .effects import EffectChain, Mixer, Phaser, PitchShifter, ReversedRightChannel, apply_gain
+from .metrics import FIRST_FRAME_LATENCY, QUEUE_TO_AUDIO_LATENCY
+from .read_ahead import ReadAheadBuffer
+from .replay import ReplayCapture
+from .stream_stats import StreamStats
+
 
 class AudioStreamEffect(Enum):
     clear = "clear effect"
@@ -19,15 +31,253 @@ class AudioStreamEffect(Enum):
     demonic = "demonic"
     schizo = "schizophrenia"
 
+    def build_chain(self) -> EffectChain | None:
+        """Builds the DSP chain for this effect, or `None` if this effect doesn't change the audio"""
+
+        if self is AudioStreamEffect.chipmunk:
+            return EffectChain([PitchShifter(2)])
+        elif self is AudioStreamEffect.deep:
+            return EffectChain([PitchShifter(3 / 4)])
+        elif self is AudioStreamEffect.void:
+            return EffectChain([PitchShifter(1 / 2)])
+        elif self is AudioStreamEffect.space_odyssey:
+            return EffectChain([Phaser(in_gain=0.3, out_gain=0.6, delay=3.0, decay=0.9, speed=0.75)])
+        elif self is AudioStreamEffect.demonic:
+            return EffectChain([Mixer([], [PitchShifter(1.414213)], [PitchShifter(1 / 2)])])
+        elif self is AudioStreamEffect.dark_brandon:
+            # pitched down by 3/4 and slowed down to 3/4 * 5/4 speed,
+            # i.e. resampled to 15/16 speed then pitched down the rest of the way
+            return EffectChain(
+                [
+                    Phaser(in_gain=0.3, out_gain=0.6, delay=3.0, decay=0.9, speed=0.75),
+                    PitchShifter((3 / 4) / (15 / 16)),
+                ],
+                rate=15 / 16,
+            )
+        elif self is AudioStreamEffect.schizo:
+            return EffectChain([ReversedRightChannel()])
+        else:
+            return None
+
+
+class BaseAudioStream(AudioSource):
+    """Playback position tracking and prebuffering shared by every ffmpeg-backed stream"""
+
+    _position: int
+    """counter of how far into playback we are, in milliseconds"""
+    _prebuffered_frames: deque[bytes]
+
+    gain: float
+    """constant gain applied on top of the player's volume, e.g. to normalize loudness"""
+
+    due_at: float | None
+    """when this stream was due to start playing, from `time.perf_counter`, to measure how long until it did"""
+    _spawned_at: float
+    _first_frame_received: bool
+
+    stats: StreamStats
+
+    _history: deque[bytes]
+    """the most recently played frames, oldest first, so short rewinds can be replayed from memory"""
+    _pending_rewind: int
+    """how many frames to rewind by, applied by the audio thread on its next read"""
+    _rewind_lock: threading.Lock
+
+    _capture: ReplayCapture | None
+    """collects every frame read from ffmpeg, so the whole track can be replayed from memory later"""
+    _capture_ended: bool
+    """whether the capture has read to the end of the stream, so it can be kept if ffmpeg exits successfully"""
+
+    PROCESS_EXIT_TIMEOUT = 2.0
+    """how long to wait for ffmpeg to exit once its output has been read, in seconds"""
+
+    def _init_stream(self, start_at: int, gain: float = 1.0, history: int = 0) -> None:
+        self._position = start_at
+        self._prebuffered_frames = deque()
+        self.gain = gain
+
+        self._history = deque(maxlen=history // 20)
+        self._pending_rewind = 0
+        self._rewind_lock = threading.Lock()
+        self._capture: ReplayCapture | None = None
+        self._capture_ended = False
+        self.stats = StreamStats(None if self.is_opus() else OpusEncoder.FRAME_SIZE)
+        self._read_ahead: ReadAheadBuffer | None = None
+
+        self.due_at = None
+        self._spawned_at = time.perf_counter()
+        self._first_frame_received = False
+
+        # the first frame is read through a one-off wrapper which removes itself, so measuring
+        # latencies doesn't cost anything on every other frame
+        self._read_frame = self._read_first_frame  # type: ignore [method-assign]
+
+    def _record_first_frame(self) -> None:
+        if not self._first_frame_received:
+            self._first_frame_received = True
+            FIRST_FRAME_LATENCY.observe(time.perf_counter() - self._spawned_at)
+
+    @property
+    def position(self) -> int:
+        """The playback position, in milliseconds"""
+
+        return self._position
+
+    @property
+    def effect(self) -> AudioStreamEffect | None:
+        return None
+
+    @staticmethod
+    def _consolidate_options(options: dict[str, str | None] | None) -> str:
+        if not options:
+            return ""
+
+        options_strings: list[str] = []
+        for k, v in options.items():
+            if v is None:
+                options_strings.append(k)
+            else:
+                options_strings.extend([k, v])
+
+        return " ".join(options_strings)
+
+    def prebuffer(self, duration: int) -> None:
+        """
+        Reads ahead up to `duration` milliseconds of audio so playback can start immediately
+
+        This blocks until the audio is read, so it should be run in an executor
+        """
+
+        if self._read_ahead:
+            # the read-ahead thread owns the pipe, so just wait for it to fill up
+            if self._read_ahead.wait_until_buffered(duration // 20):
+                self._record_first_frame()
+
+            return
+
+        try:
+            for _ in range(duration // 20):
+                frame = super().read()
+                if not frame:
+                    break
+
+                self._prebuffered_frames.append(frame)
+                if self._capture:
+                    self._capture_frame(frame)
+
+            if self._prebuffered_frames:
+                self._record_first_frame()
+        except (OSError, ValueError, AttributeError):
+            # the stream was cleaned up while we were buffering
+            logging.debug("Stopped prebuffering a closed audio stream")
+
+    def rewind(self, duration: int) -> bool:
+        """
+        Rewinds playback by replaying recently played frames from memory, without restarting ffmpeg
+
+        Returns `False`, without rewinding, if not enough audio has been kept to rewind that far
+
+        duration: How far to rewind, in milliseconds
+        """
+
+        frames = duration // 20
+        with self._rewind_lock:
+            if self._pending_rewind + frames > len(self._history):
+                return False
+
+            self._pending_rewind += frames
+            return True
+
+    def _apply_rewind(self) -> None:
+        with self._rewind_lock:
+            frames = min(self._pending_rewind, len(self._history))
+            self._pending_rewind = 0
+
+        # the most recent frames are pushed back first, so they end up in their original order
+        for _ in range(frames):
+            self._prebuffered_frames.appendleft(self._history.pop())
+
+        self._position -= frames * 20
+
+    def _capture_frame(self, frame: bytes) -> None:
+        assert self._capture
+        if not frame:
+            # the stream ended, but it's only kept on cleanup if ffmpeg exited successfully
+            self._capture_ended = True
+        elif not self._capture.add(frame):
+            self._capture = None
+
+    def _exited_successfully(self) -> bool:
+        """Whether the ffmpeg process behind this stream, if any, exited successfully rather than failing"""
+
+        process = getattr(self, "_process", None)
+        if not isinstance(process, subprocess.Popen):
+            # not backed by ffmpeg, e.g. replayed from memory
+            return True
+
+        try:
+            # ffmpeg closes its output just before exiting
+            return process.wait(self.PROCESS_EXIT_TIMEOUT) == 0
+        except subprocess.TimeoutExpired:
+            return False
+
+    def _read_frame(self) -> bytes:
+        if self._pending_rewind:
+            self._apply_rewind()
+
+        self._position += 20  # reads are buffered in 20ms chunks
+
+        if self._prebuffered_frames:
+            frame = self._prebuffered_frames.popleft()
+        else:
+            started_at = time.perf_counter()
+            frame = self._read_ahead.read() if self._read_ahead else super().read()
+            self.stats.pending_wait += time.perf_counter() - started_at
+            if self._capture and not self._capture_ended:
+                self._capture_frame(frame)
+
+        if frame:
+            self._history.append(frame)
+
+        return frame
+
+    def _read_first_frame(self) -> bytes:
+        del self._read_frame
+        frame = self._read_frame()
+        if frame:
+            self._record_first_frame()
+            if self.due_at is not None:
+                QUEUE_TO_AUDIO_LATENCY.observe(time.perf_counter() - self.due_at)
+
+        return frame
+
+    def read(self) -> bytes:
+        return self._read_frame()
+
+    def cleanup(self) -> None:
+        if self._read_ahead:
+            self._read_ahead.close()
+
+        capture, self._capture = self._capture, None
+        if capture and self._capture_ended and self._exited_successfully():
+            if not capture.finish():
+                logging.info(f"Not keeping {capture.key} for replays, since it ended early")
+        elif capture:
+            capture.discard()
+
+        super().cleanup()
+
 
-class AudioStream(FFmpegPCMAudio):
+class AudioStream(BaseAudioStream, FFmpegPCMAudio):
     def __init__(
         self,
         source: str | BufferedIOBase,
-        bitrate: int,
         *,
         start_at: int = 0,
         effect: AudioStreamEffect | None = None,
+        gain: float = 1.0,
+        read_ahead: int = 0,
+        history: int = 0,
         executable: str = "ffmpeg",
         pipe: bool = False,
         stderr: IO[bytes] | None = None,
@@ -37,63 +287,27 @@ class AudioStream(FFmpegPCMAudio):
         """
         Wrapper around FFmpegPCMAudio to enable additional effects
 
+        Effects are applied in-process to each frame, so they can be changed without restarting ffmpeg
+
         start_at: Time to start playback, in milliseconds
+        gain: A constant gain to apply, e.g. to normalize loudness
+        read_ahead: How much audio to read ahead of playback on a separate thread, in milliseconds.
+            Use 0 to read from ffmpeg on demand
+        history: How much recently played audio to keep so it can be rewound instantly, in milliseconds
         """
 
-        self._constructor_kwargs = {
-            "source": source,
-            "bitrate": bitrate,
-            "start_at": start_at,
-            "effect": effect,
-            "executable": executable,
-            "pipe": pipe,
-            "stderr": stderr,
-            "before_options": before_options,
-            "options": options,
-        }
-
         self._source = source
-        self._position: int = start_at
-        """counter of how far into playback we are, in milliseconds"""
+        self._init_stream(start_at, gain, history)
+
+        self._effect: AudioStreamEffect | None = None
+        self._effect_chain: EffectChain | None = None
+        self.apply_effect(effect)
 
         before_options = before_options or {}
         options = options or {}
         if start_at:
             before_options["-ss"] = f"{start_at}ms"
 
-        options.pop("-af", None)
-        options.pop("-filter_complex", None)
-        options.pop("-map", None)
-        if effect and effect is not AudioStreamEffect.clear:
-            if effect is AudioStreamEffect.chipmunk:
-                options["-af"] = f"atempo=1/2,asetrate={bitrate}*2/1"
-            elif effect is AudioStreamEffect.deep:
-                options["-af"] = f"asetrate={bitrate}*3/4,atempo=4/3"
-            elif effect is AudioStreamEffect.void:
-                options["-af"] = f"asetrate={bitrate}*1/2,atempo=2/1"
-            elif effect is AudioStreamEffect.space_odyssey:
-                options["-filter_complex"] = "aphaser=in_gain=0.3:out_gain=0.6:delay=3.0:decay=0.9:speed=0.75:type=t"
-            elif effect is AudioStreamEffect.demonic:
-                options["-filter_complex"] = (
-                    f"[0:a:0]atempo=1/1[normal];"
-                    f"[0:a:0]atempo=0.707107,asetrate={bitrate}*1.414213[transposeup];"
-                    f"[0:a:0]asetrate={bitrate}*1/2,atempo=2/1[transposedown];"
-                    f"[normal][transposeup][transposedown]amix=inputs=3[a]"
-                )
-                options["-map"] = "[a]"
-            elif effect is AudioStreamEffect.dark_brandon:
-                options["-filter_complex"] = (
-                    f"aphaser=in_gain=0.3:out_gain=0.6:delay=3.0:decay=0.9:speed=0.75:type=t,"
-                    f"asetrate={bitrate}*3/4,atempo=5/4"
-                )
-            elif effect is AudioStreamEffect.schizo:
-                options["-filter_complex"] = (
-                    "[0:a:0]channelsplit=channel_layout=mono[left];"
-                    "[0:a:0]areverse,channelsplit=channel_layout=mono[right];"
-                    "[left][right]join=inputs=2:channel_layout=stereo[a]"
-                )
-                options["-map"] = "[a]"
-
         super().__init__(
             source,
             executable=executable,
@@ -103,45 +317,117 @@ class AudioStream(FFmpegPCMAudio):
             options=self._consolidate_options(options),
         )
 
+        if read_ahead:
+            stdout = cast(BufferedIOBase, self._stdout)
+            self._read_ahead = ReadAheadBuffer(stdout.readinto, OpusEncoder.FRAME_SIZE, read_ahead // 20)
+            self.stats.read_ahead = self._read_ahead
+            self._read_ahead.start()
+
     @property
-    def position(self) -> int:
-        """The playback position, in milliseconds"""
+    def effect(self) -> AudioStreamEffect | None:
+        return self._effect
 
-        return self._position
+    def apply_effect(self, effect: AudioStreamEffect | None) -> None:
+        """Applies the desired effect, starting with the next frame"""
 
-    @staticmethod
-    def _consolidate_options(options: dict[str, str | None] | None) -> str:
-        if not options:
-            return ""
+        # the chain is swapped in with a single assignment, so the audio thread never sees a partial change
+        self._effect_chain = effect.build_chain() if effect else None
+        self._effect = effect
 
-        options_strings: list[str] = []
-        for k, v in options.items():
-            if v is None:
-                options_strings.append(k)
-            else:
-                options_strings.extend([k, v])
+    def read(self) -> bytes:
+        effect_chain = self._effect_chain
+        if not effect_chain:
+            return self._read_frame()
 
-        return " ".join(options_strings)
+        # effects which change the playback speed may read more or less than one frame of the source
+        return effect_chain.read(self._read_frame)
+
+
+class OpusAudioStream(BaseAudioStream, FFmpegOpusAudio):
+    def __init__(
+        self,
+        source: str,
+        *,
+        start_at: int = 0,
+        history: int = 0,
+        capture: ReplayCapture | None = None,
+        executable: str = "ffmpeg",
+        before_options: dict[str, str | None] | None = None,
+        options: dict[str, str | None] | None = None,
+    ) -> None:
+        """
+        Passes Opus audio straight through to Discord without decoding or re-encoding it
+
+        Each packet is expected to hold 20ms of audio, which is what YouTube serves. Effects aren't supported,
+        since applying them requires decoding the audio
+
+        start_at: Time to start playback, in milliseconds
+        history: How much recently played audio to keep so it can be rewound instantly, in milliseconds
+        capture: If provided, every packet is captured so the track can be replayed from memory
+        """
+
+        self._source = source
+        self._init_stream(start_at, history=history)
+        self._capture = capture
+
+        before_options = before_options or {}
+        if start_at:
+            before_options["-ss"] = f"{start_at}ms"
+
+        super().__init__(
+            source,
+            codec="copy",
+            executable=executable,
+            before_options=self._consolidate_options(before_options),
+            options=self._consolidate_options(options),
+        )
 
-    def apply_effect(self, effect: AudioStreamEffect) -> "AudioStream":
-        """Applies the desired effect and returns a new audio stream"""
 
-        kwargs = self._constructor_kwargs.copy()
-        kwargs["effect"] = effect
-        kwargs["start_at"] = self._position
-        return AudioStream(**kwargs)  # type: ignore
+class _ReplayedPackets(AudioSource):
+    def __init__(self, packets: tuple[bytes, ...]) -> None:
+        self._packets = iter(packets)
+
+    def is_opus(self) -> bool:
+        return True
 
     def read(self) -> bytes:
-        self._position += 20  # reads are buffered in 20ms chunks
+        return next(self._packets, b"")
+
+
+class ReplayAudioStream(BaseAudioStream, _ReplayedPackets):
+    def __init__(self, packets: tuple[bytes, ...], *, history: int = 0) -> None:
+        """
+        Replays a track's Opus packets from memory, e.g. when repeating it, without ffmpeg or the network
+
+        history: How much recently played audio to keep so it can be rewound instantly, in milliseconds
+        """
+
+        _ReplayedPackets.__init__(self, packets)
+        self._init_stream(0, history=history)
+
 
-        return super().read()
+class AudioPlayer(AudioSource):
+    MAX_VOLUME = 2.0
 
+    def __init__(self, source: BaseAudioStream, volume: float = 1.0):
+        """
+        Plays an audio stream, scaling the volume of PCM streams
+
+        The volume is combined with the stream's own gain, so both cost a single multiplication. At a combined gain
+        of 1.0 frames are passed through untouched. Opus streams are always passed through as-is,
+        so their volume can't be changed
+        """
 
-class AudioPlayer(PCMVolumeTransformer):
-    def __init__(self, source: AudioStream, volume: float = 0.5):
         self.source = source
+        self.volume = volume
+
+    @property
+    def volume(self) -> float:
+        return self._volume
 
-        super().__init__(source, volume)
+    @volume.setter
+    def volume(self, value: float) -> None:
+        self._volume = min(max(value, 0.0), self.MAX_VOLUME)
 
     @property
     def position(self) -> int:
@@ -149,15 +435,48 @@ class AudioPlayer(PCMVolumeTransformer):
 
         return self.source.position
 
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+
+    def read(self) -> bytes:
+        started_at = time.perf_counter()
+        frame = self.source.read()
+        gain = self._volume * self.source.gain
+        if not (gain == 1.0 or not frame or self.source.is_opus()):
+            frame = apply_gain(frame, gain)
+
+        self.source.stats.record(started_at, time.perf_counter(), frame)
+        return frame
+
 
 class MusicPlayerServiceBase(ABC):
     @abstractmethod
     async def get_source(
-        self, item: MusicItemBase, *, start_at: int = 0, effect: AudioStreamEffect | None = None
-    ) -> AudioStream: ...
+        self,
+        item: MusicItemBase,
+        *,
+        start_at: int = 0,
+        effect: AudioStreamEffect | None = None,
+        allow_passthrough: bool = True,
+    ) -> BaseAudioStream:
+        """
+        Gets an audio stream for an item
+
+        allow_passthrough: Whether the stream may skip decoding. Disable this if the audio needs to be processed,
+            e.g. to change its volume
+        """
+        ...
+
+    async def get_player(self, source: BaseAudioStream, volume: float = 1.0) -> AudioPlayer:
+        return AudioPlayer(source, volume)
+
+    async def prefetch(self, item: MusicItemBase) -> None:
+        """Prepares an item ahead of time so `get_source` is faster when it's played"""
 
-    async def get_player(self, source: AudioStream) -> AudioPlayer:
-        return AudioPlayer(source)
+        return None
 
     @staticmethod
     def cln(text: str | None, unescape_html: bool = True) -> str:
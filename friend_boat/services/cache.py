@@ -0,0 +1,418 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class LRUCache(Generic[T]):
+    def __init__(self, max_size: int, ttl: float | None = None) -> None:
+        """
+        A thread-safe, size-bounded cache which evicts the least-recently-used entries first
+
+        max_size: The maximum number of entries to hold before evicting
+        ttl: How long entries live for, in seconds. Use `None` to never expire entries
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries: OrderedDict[str, tuple[float | None, T]] = OrderedDict()
+        """entries keyed by cache key, stored as (expires at as a unix timestamp, value)"""
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.peek(key) is not None
+
+    @staticmethod
+    def _is_expired(expires_at: float | None, now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def _evict(self) -> None:
+        """Removes expired entries, then the least-recently-used ones until the cache fits. Requires the lock"""
+
+        now = time.time()
+        for key in [k for k, (expires_at, _) in self._entries.items() if self._is_expired(expires_at, now)]:
+            del self._entries[key]
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def resize(self, max_size: int) -> None:
+        """Changes how many entries the cache holds, evicting entries straight away if it shrinks"""
+
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def peek(self, key: str) -> T | None:
+        """Gets a value without affecting its recency or the hit counters"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or self._is_expired(entry[0], time.time()):
+                return None
+
+            return entry[1]
+
+    def get(self, key: str) -> T | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if self._is_expired(expires_at, time.time()):
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: T, *, expires_at: float | None = None) -> None:
+        """
+        Stores a value in the cache
+
+        expires_at: When this entry expires, as a unix timestamp. Defaults to now + the cache's ttl
+        """
+
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def pop(self, key: str) -> T | None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class PersistentLRUCache(LRUCache[T], ABC):
+    def __init__(self, path: str | None, max_size: int, ttl: float | None = None, save_delay: float = 10) -> None:
+        """
+        An LRUCache which can be saved to, and loaded from, a JSON file
+
+        path: Where to persist the cache. Use `None` to keep the cache in memory only
+        save_delay: How long `schedule_save` waits before saving, in seconds, so bursts of changes are saved once
+        """
+
+        super().__init__(max_size, ttl)
+        self.path = path
+        self.save_delay = save_delay
+
+        self._save_timer: threading.Timer | None = None
+        """the pending save, if there are changes which haven't been saved yet"""
+        self._save_lock = threading.Lock()
+
+    @abstractmethod
+    def _serialize(self, value: T) -> dict: ...
+
+    @abstractmethod
+    def _deserialize(self, data: dict) -> T: ...
+
+    def load(self) -> None:
+        """Loads unexpired entries from disk, if the cache file exists"""
+
+        if not (self.path and os.path.isfile(self.path)):
+            return
+
+        try:
+            with open(self.path) as f:
+                raw_entries: list[list] = json.load(f)
+
+            now = time.time()
+            with self._lock:
+                for key, expires_at, data in raw_entries:
+                    if self._is_expired(expires_at, now):
+                        continue
+
+                    self._entries[key] = (expires_at, self._deserialize(data))
+
+                self._evict()
+        except Exception:
+            logging.exception(f'Unable to load cache file "{self.path}", starting with an empty cache')
+
+    def save(self) -> None:
+        """Atomically writes the cache to disk"""
+
+        if not self.path:
+            return
+
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+            raw_entries = [
+                [key, expires_at, self._serialize(value)] for key, (expires_at, value) in self._entries.items()
+            ]
+
+        # saves are serialized so an older snapshot can't replace a newer one
+        with self._save_lock:
+            tmp_path: str | None = None
+            try:
+                directory = os.path.dirname(self.path) or "."
+                os.makedirs(directory, exist_ok=True)
+
+                # several threads and processes may save the same cache file, so each write gets its own temp file
+                with tempfile.NamedTemporaryFile(
+                    "w", dir=directory, prefix=f"{os.path.basename(self.path)}.", suffix=".tmp", delete=False
+                ) as f:
+                    tmp_path = f.name
+                    json.dump(raw_entries, f)
+
+                os.replace(tmp_path, self.path)
+            except OSError:
+                logging.exception(f'Unable to save cache file "{self.path}"')
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def schedule_save(self) -> None:
+        """Saves the cache in the background after `save_delay`, unless a save is already pending"""
+
+        if not self.path:
+            return
+
+        with self._lock:
+            if self._save_timer:
+                return
+
+            self._save_timer = threading.Timer(self.save_delay, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def close(self) -> None:
+        """Saves any changes which are waiting on a pending save"""
+
+        with self._lock:
+            pending = self._save_timer is not None
+
+        if pending:
+            self.save()
+
+
+class FileCache:
+    PARTIAL_DIRECTORY = ".partial"
+    PARTIAL_SUFFIX = ".part"
+    PARTIAL_MAX_AGE = 60 * 60
+    """How old a partial file has to be before it's considered abandoned, in seconds"""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        """
+        A directory of cached files, keyed by file name (without extensions), which evicts the least-recently-used
+        files once they exceed `max_bytes`
+
+        Files are written to a temporary ".part" path in a ".partial" subdirectory and only become visible once
+        they're committed, so partially downloaded files are never served. Evicting a file which is still being read is safe, since open file handles
+        keep the data around until they're closed.
+
+        Several processes can share the same directory, e.g. when running multiple workers. Each one rescans the
+        directory before evicting, so `max_bytes` applies to the whole directory rather than to each process, and
+        picks up files committed by the others when the directory changes. Partial files are kept out of the
+        directory itself so starting and abandoning downloads doesn't count as a change. Hits update a file's modification time,
+        so every process shares the same least-recently-used order.
+        """
+
+        self.directory = directory
+        self.partial_directory = os.path.join(directory, self.PARTIAL_DIRECTORY)
+        self.max_bytes = max_bytes
+
+        self._files: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        """file paths and sizes keyed by cache key, from least to most recently used"""
+        self._scanned_at: int | None = None
+        """the directory's modification time when it was last scanned, in nanoseconds"""
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.partial_directory, exist_ok=True)
+        with self._lock:
+            self._remove_abandoned()
+            self._scan()
+            self._evict()
+
+    def _remove_abandoned(self) -> None:
+        """Removes leftovers from interrupted downloads. Newer ones may still be written to by another process"""
+
+        # partial files used to be written to the directory itself
+        for directory in [self.partial_directory, self.directory]:
+            for entry in os.scandir(directory):
+                try:
+                    if (
+                        entry.is_file()
+                        and entry.name.endswith(self.PARTIAL_SUFFIX)
+                        and time.time() - entry.stat().st_mtime > self.PARTIAL_MAX_AGE
+                    ):
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    # committed or removed by another process while we were scanning
+                    continue
+
+    def _scan(self) -> None:
+        """Rebuilds the file list from the directory, ordered by modification time. Requires the lock"""
+
+        self._scanned_at = os.stat(self.directory).st_mtime_ns
+
+        files: list[tuple[float, str, str, int]] = []
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file() or entry.name.endswith(self.PARTIAL_SUFFIX):
+                    continue
+
+                stat = entry.stat()
+            except FileNotFoundError:
+                # evicted by another process while we were scanning
+                continue
+
+            key = self.get_key(entry.name)
+            files.append((stat.st_mtime, key, entry.path, stat.st_size))
+
+        self._files.clear()
+        for _, key, path, size in sorted(files):
+            self._files[key] = (path, size)
+
+    def _rescan_if_changed(self) -> None:
+        """Rescans the directory if files were added or removed since it was last scanned. Requires the lock"""
+
+        try:
+            if os.stat(self.directory).st_mtime_ns != self._scanned_at:
+                self._scan()
+        except FileNotFoundError:
+            self._files.clear()
+
+    @property
+    def size(self) -> int:
+        """The total size of all cached files, in bytes"""
+
+        return sum(size for _, size in self._files.values())
+
+    def _evict(self) -> None:
+        """Removes the least-recently-used files until the cache fits in its budget. Requires the lock"""
+
+        total_size = self.size
+        while self._files and total_size > self.max_bytes:
+            _, (path, size) = self._files.popitem(last=False)
+            total_size -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def resize(self, max_bytes: int) -> None:
+        """Changes how much disk space the cache can use, evicting files straight away if it shrinks"""
+
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key: str) -> str | None:
+        """Gets the path of a cached file, if it exists"""
+
+        with self._lock:
+            entry = self._files.get(key)
+            if not entry:
+                # another process may have downloaded it
+                self._rescan_if_changed()
+                entry = self._files.get(key)
+
+            if not (entry and os.path.isfile(entry[0])):
+                self._files.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._files.move_to_end(key)
+
+        # keep the on-disk order in sync so the cache loads in the same order after a restart
+        try:
+            os.utime(entry[0])
+        except FileNotFoundError:
+            # another process evicted it after we checked
+            with self._lock:
+                if self._files.get(key) == entry:
+                    del self._files[key]
+
+                self.misses += 1
+                return None
+
+        with self._lock:
+            self.hits += 1
+
+        return entry[0]
+
+    @staticmethod
+    def get_key(filename: str) -> str:
+        """Gets the cache key of a file name. Everything after the first "." is treated as the extension"""
+
+        return filename.split(".", 1)[0]
+
+    def get_partial_path(self, key: str, ext: str) -> str:
+        """
+        The path to write a file to before it's committed. Keys must not contain a "."
+
+        Partial paths are unique to each process, so processes sharing a cache can't write to the same file
+        """
+
+        return os.path.join(self.partial_directory, f"{key}.{ext}.{os.getpid()}{self.PARTIAL_SUFFIX}")
+
+    def commit(self, partial_path: str) -> str:
+        """Moves a fully-written file into the cache, evicting old files if necessary, and returns its new path"""
+
+        filename = os.path.basename(partial_path).removesuffix(self.PARTIAL_SUFFIX).rsplit(".", 1)[0]
+        path = os.path.join(self.directory, filename)
+        os.replace(partial_path, path)
+
+        key = self.get_key(filename)
+        with self._lock:
+            # other processes' files count towards the budget too
+            self._scan()
+            self._files[key] = (path, os.path.getsize(path))
+            self._files.move_to_end(key)
+            self._evict()
+
+        return path
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls which share a key into a single in-flight call"""
+
+    def __init__(self) -> None:
+        self._in_flight: dict[str, asyncio.Future[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """Awaits `func`, or joins the call already in flight for `key`"""
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # shield the shared call so one caller being cancelled doesn't cancel it for everyone else
+        return await asyncio.shield(future)
@@ -0,0 +1,244 @@
+from abc import ABC, abstractmethod
+from typing import Callable
+
+import numpy as np
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME_SAMPLES = SAMPLE_RATE // 50
+"""Samples per channel in one 20ms frame"""
+
+
+def pcm_to_samples(frame: bytes) -> np.ndarray:
+    """Converts interleaved 16-bit stereo PCM into a float32 array of shape (samples, channels) in [-1, 1]"""
+
+    return np.frombuffer(frame, dtype=np.int16).reshape(-1, CHANNELS).astype(np.float32) / 32768
+
+
+def samples_to_pcm(samples: np.ndarray) -> bytes:
+    """Converts a float32 array of shape (samples, channels) back into interleaved 16-bit PCM, clipping as needed"""
+
+    return np.clip(samples * 32768, -32768, 32767).astype(np.int16).tobytes()
+
+
+def apply_gain(frame: bytes, gain: float) -> bytes:
+    """Scales 16-bit PCM by `gain`, saturating instead of wrapping around"""
+
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    samples *= gain
+    return np.clip(samples, -32768, 32767, out=samples).astype(np.int16).tobytes()
+
+
+class AudioProcessor(ABC):
+    """A stateful DSP stage which transforms a block of samples into a block of the same length"""
+
+    @abstractmethod
+    def process(self, samples: np.ndarray) -> np.ndarray: ...
+
+
+class PitchShifter(AudioProcessor):
+    def __init__(self, ratio: float, window: int = 2048) -> None:
+        """
+        Shifts pitch by `ratio` without changing tempo, using two crossfaded read heads sweeping through a delay line
+
+        window: The length of the delay line, in samples. Longer windows smear transients, shorter ones sound rougher
+        """
+
+        self.ratio = ratio
+        self.window = window
+
+        self._phase = 0.0
+        self._history = np.zeros((window + 2, CHANNELS), dtype=np.float32)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        n = len(samples)
+        buffer = np.concatenate([self._history, samples])
+        base = len(self._history)
+        indices = np.arange(n)
+
+        # the delay changes by (1 - ratio) samples per sample, so each read head moves at `ratio` speed
+        phase = (self._phase + indices * (1 - self.ratio) / self.window) % 1.0
+        output = np.zeros_like(samples)
+        for offset in [0.0, 0.5]:
+            head_phase = (phase + offset) % 1.0
+            positions = base + indices - head_phase * self.window - 1
+            floor = positions.astype(np.int64)
+            frac = (positions - floor)[:, None]
+            head = buffer[floor] * (1 - frac) + buffer[floor + 1] * frac
+
+            # the heads are faded out as they wrap around, and their gains always sum to constant power
+            output += head * np.sin(np.pi * head_phase)[:, None]
+
+        self._phase = (self._phase + n * (1 - self.ratio) / self.window) % 1.0
+        self._history = buffer[-len(self._history) :]
+        return output
+
+
+class Phaser(AudioProcessor):
+    def __init__(
+        self,
+        *,
+        in_gain: float = 0.4,
+        out_gain: float = 0.74,
+        delay: float = 3.0,
+        decay: float = 0.4,
+        speed: float = 0.5,
+        block_size: int = 24,
+    ) -> None:
+        """
+        A triangle-modulated feedback delay, modeled after ffmpeg's aphaser filter
+
+        delay: The maximum delay, in milliseconds
+        speed: The modulation speed, in Hz
+        block_size: The shortest delay, in samples. Blocks of this size are processed at once, since every sample
+            in a block only depends on feedback from previous blocks
+        """
+
+        self.in_gain = in_gain
+        self.out_gain = out_gain
+        self.decay = decay
+        self.block_size = block_size
+
+        self._max_delay = max(int(delay * SAMPLE_RATE / 1000), block_size)
+        self._modulation_length = int(SAMPLE_RATE / speed)
+        self._modulation_pos = 0
+        self._history = np.zeros((self._max_delay, CHANNELS), dtype=np.float32)
+
+        # triangle wave from the longest delay to the shortest and back
+        half = self._modulation_length // 2
+        self._modulation = np.concatenate(
+            [
+                np.linspace(self._max_delay, block_size, half, endpoint=False),
+                np.linspace(block_size, self._max_delay, self._modulation_length - half, endpoint=False),
+            ]
+        ).astype(np.int64)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        n = len(samples)
+        history_length = len(self._history)
+        output = np.concatenate([self._history, np.empty_like(samples)])
+        delays = self._modulation[(self._modulation_pos + np.arange(n)) % self._modulation_length]
+
+        for start in range(0, n, self.block_size):
+            end = min(start + self.block_size, n)
+            positions = history_length + np.arange(start, end)
+            feedback = output[positions - delays[start:end]]
+            output[positions] = samples[start:end] * self.in_gain + feedback * self.decay
+
+        self._modulation_pos = (self._modulation_pos + n) % self._modulation_length
+        self._history = output[-history_length:]
+        return output[history_length:] * self.out_gain
+
+
+class Mixer(AudioProcessor):
+    def __init__(self, *branches: list[AudioProcessor]) -> None:
+        """Runs the input through each branch of processors and averages the results. An empty branch is a dry signal"""
+
+        self.branches = branches
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        output = np.zeros_like(samples)
+        for branch in self.branches:
+            branch_samples = samples
+            for processor in branch:
+                branch_samples = processor.process(branch_samples)
+
+            output += branch_samples
+
+        return output / len(self.branches)
+
+
+class ReversedRightChannel(AudioProcessor):
+    def __init__(self, grain: int = SAMPLE_RATE // 2) -> None:
+        """
+        Plays the left channel normally and the right channel backwards
+
+        Reversing a stream requires knowing how it ends, so the right channel instead plays each `grain` of audio
+        backwards, one grain behind the left channel.
+        """
+
+        self.grain = grain
+
+        self._reversed = np.zeros(grain, dtype=np.float32)
+        self._reversed_pos = 0
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        n = len(samples)
+        self._pending = np.concatenate([self._pending, samples[:, 0]])
+
+        right = np.empty(n, dtype=np.float32)
+        filled = 0
+        while filled < n:
+            if self._reversed_pos >= self.grain:
+                self._reversed = self._pending[: self.grain][::-1]
+                self._pending = self._pending[self.grain :]
+                self._reversed_pos = 0
+
+            take = min(n - filled, self.grain - self._reversed_pos)
+            right[filled : filled + take] = self._reversed[self._reversed_pos : self._reversed_pos + take]
+            self._reversed_pos += take
+            filled += take
+
+        return np.stack([samples[:, 0], right], axis=1)
+
+
+class EffectChain:
+    def __init__(self, processors: list[AudioProcessor], *, rate: float = 1.0) -> None:
+        """
+        A series of processors applied to 20ms frames
+
+        rate: How fast to play the input back, as a ratio. Resampling changes both tempo and pitch,
+            and reads more (or fewer) input frames than it produces
+        """
+
+        self.processors = processors
+        self.rate = rate
+
+        self._buffer = np.zeros((0, CHANNELS), dtype=np.float32)
+        self._buffer_pos = 0.0
+        """the fractional read position in the input buffer"""
+        self._ended = False
+
+    def _resample(self, read_frame: Callable[[], bytes]) -> np.ndarray | None:
+        positions = self._buffer_pos + np.arange(FRAME_SAMPLES) * self.rate
+        while not self._ended and len(self._buffer) < int(positions[-1]) + 2:
+            frame = read_frame()
+            if not frame:
+                self._ended = True
+                break
+
+            self._buffer = np.concatenate([self._buffer, pcm_to_samples(frame)])
+
+        if len(self._buffer) < int(positions[-1]) + 2:
+            return None
+
+        floor = positions.astype(np.int64)
+        frac = (positions - floor)[:, None]
+        samples = self._buffer[floor] * (1 - frac) + self._buffer[floor + 1] * frac
+
+        # drop input we've read past
+        next_pos = positions[-1] + self.rate
+        consumed = int(next_pos)
+        self._buffer = self._buffer[consumed:]
+        self._buffer_pos = next_pos - consumed
+        return samples
+
+    def read(self, read_frame: Callable[[], bytes]) -> bytes:
+        if self.rate == 1.0:
+            frame = read_frame()
+            if not frame:
+                return b""
+
+            samples = pcm_to_samples(frame)
+        else:
+            resampled = self._resample(read_frame)
+            if resampled is None:
+                return b""
+
+            samples = resampled
+
+        for processor in self.processors:
+            samples = processor.process(samples)
+
+        return samples_to_pcm(samples)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import re
+
+from .cache import PersistentLRUCache
+
+integrated_loudness_pattern = re.compile(r"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+class LoudnessCache(PersistentLRUCache[float]):
+    """Caches the integrated loudness of tracks, in LUFS"""
+
+    def _serialize(self, value: float) -> dict:
+        return {"loudness": value}
+
+    def _deserialize(self, data: dict) -> float:
+        return float(data["loudness"])
+
+
+class LoudnessAnalyzer:
+    def __init__(
+        self,
+        cache: LoudnessCache,
+        *,
+        target: float = -14.0,
+        max_gain: float = 12.0,
+        tolerance: float = 1.0,
+        max_duration: int = 600,
+        executable: str = "ffmpeg",
+    ) -> None:
+        """
+        Measures the integrated loudness of tracks in the background, one at a time and at low CPU priority,
+        so playback can normalize them with a constant gain instead of a realtime filter
+
+        target: The loudness to normalize to, in LUFS
+        max_gain: The most a track can be boosted or cut by, in dB
+        tolerance: Tracks within this many dB of the target aren't adjusted, so they can skip decoding
+        max_duration: How much of each track to measure, in seconds
+        """
+
+        self.cache = cache
+        self.target = target
+        self.max_gain = max_gain
+        self.tolerance = tolerance
+        self.max_duration = max_duration
+        self.executable = executable
+
+        self._queue: asyncio.Queue[tuple[str, str, list[str]]] = asyncio.Queue()
+        self._pending: set[str] = set()
+        self._worker: asyncio.Task | None = None
+
+    def get_gain(self, key: str) -> float:
+        """The linear gain which normalizes a track, or 1.0 if it hasn't been measured or is close enough already"""
+
+        loudness = self.cache.get(key)
+        if loudness is None:
+            return 1.0
+
+        gain_db = min(max(self.target - loudness, -self.max_gain), self.max_gain)
+        if abs(gain_db) <= self.tolerance:
+            return 1.0
+
+        return 10 ** (gain_db / 20)
+
+    def enqueue(self, key: str, source: str, before_options: list[str] | None = None) -> None:
+        """Queues a track to be measured, unless it already has been"""
+
+        if key in self._pending or key in self.cache:
+            return
+
+        self._pending.add(key)
+        self._queue.put_nowait((key, source, before_options or []))
+        if not self._worker or self._worker.done():
+            self._worker = asyncio.get_event_loop().create_task(self._work())
+
+    def close(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+        self.cache.close()
+
+    async def _work(self) -> None:
+        while True:
+            key, source, before_options = await self._queue.get()
+            try:
+                loudness = await self.measure(source, before_options)
+                if loudness is not None:
+                    self.cache.set(key, loudness)
+                    # saving is a JSON dump of the whole cache, so it's batched and kept off the event loop
+                    self.cache.schedule_save()
+            except Exception:
+                logging.exception(f"Unable to measure the loudness of {key}")
+            finally:
+                self._pending.discard(key)
+
+    async def measure(self, source: str, before_options: list[str] | None = None) -> float | None:
+        """Measures the integrated loudness of a source, in LUFS"""
+
+        process = await asyncio.create_subprocess_exec(
+            self.executable,
+            "-hide_banner",
+            "-nostats",
+            *(before_options or []),
+            "-t",
+            str(self.max_duration),
+            "-i",
+            source,
+            "-vn",
+            "-af",
+            "ebur128=framelog=quiet",
+            "-f",
+            "null",
+            "-",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            # analysis isn't time-sensitive, so it shouldn't compete with playback for the CPU
+            preexec_fn=(lambda: os.nice(19)) if hasattr(os, "nice") else None,
+        )
+
+        _, stderr = await process.communicate()
+        matches = integrated_loudness_pattern.findall(stderr.decode(errors="ignore"))
+        if process.returncode or not matches:
+            return None
+
+        # the summary is printed last
+        return float(matches[-1])
@@ -0,0 +1,281 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Literal
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""histogram buckets, in seconds"""
+
+MetricType = Literal["counter", "gauge"]
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = {k: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value))
+
+
+def _format_callback_metric(
+    name: str, documentation: str, type: MetricType, label: str | None, value: float | dict[str, float]
+) -> list[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {type}"]
+    if isinstance(value, dict):
+        for label_value, v in value.items():
+            lines.append(f"{name}{_format_labels({label or 'key': str(label_value)})} {_format_value(v)}")
+    else:
+        lines.append(f"{name} {_format_value(value)}")
+
+    return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """
+        Counts observations into cumulative buckets, e.g. to track latencies
+
+        Observations are thread-safe, so they can be made from the audio thread
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+
+        self._counts = [0] * (len(self.buckets) + 1)
+        """non-cumulative counts per bucket, with a final bucket for anything larger"""
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes how long the block takes, in seconds"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip([*self.buckets, math.inf], counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels({'le': _format_value(bound)})} {cumulative}")
+
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def collect(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {_format_value(self._value)}",
+        ]
+
+
+class CallbackMetric:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float | dict[str, float]],
+        *,
+        type: MetricType = "gauge",
+        label: str | None = None,
+    ) -> None:
+        """
+        A metric whose value is only computed when it's collected, so keeping it up to date costs nothing
+
+        callback: Returns the metric's value, or its values keyed by `label`
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.type = type
+        self.label = label
+
+    def collect(self) -> list[str]:
+        return _format_callback_metric(self.name, self.documentation, self.type, self.label, self.callback())
+
+
+class CallbackMetricGroup:
+    def __init__(
+        self,
+        name: str,
+        metrics: list[tuple[str, str, MetricType]],
+        callback: Callable[[], dict[str, dict[str, float]]],
+        *,
+        label: str | None = None,
+    ) -> None:
+        """
+        Several metrics computed together when they're collected, for when they share expensive work
+
+        metrics: The name, documentation and type of each metric
+        callback: Returns each metric's values keyed by `label`, keyed by metric name. It's called once per collection
+        """
+
+        self.name = name
+        self.metrics = metrics
+        self.callback = callback
+        self.label = label
+
+    def collect(self) -> list[str]:
+        values_by_name = self.callback()
+        lines: list[str] = []
+        for name, documentation, type in self.metrics:
+            lines.extend(_format_callback_metric(name, documentation, type, self.label, values_by_name.get(name, {})))
+
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """Holds every metric, and renders them in the Prometheus text format"""
+
+        self._metrics: dict[str, Histogram | Counter | CallbackMetric | CallbackMetricGroup] = {}
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        metric = Counter(name, documentation)
+        self._metrics[name] = metric
+        return metric
+
+    def register_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float | dict[str, float]],
+        *,
+        type: MetricType = "gauge",
+        label: str | None = None,
+    ) -> None:
+        """Registers a metric computed when it's collected, replacing any existing metric with the same name"""
+
+        self._metrics[name] = CallbackMetric(name, documentation, callback, type=type, label=label)
+
+    def register_callback_group(
+        self,
+        name: str,
+        metrics: list[tuple[str, str, MetricType]],
+        callback: Callable[[], dict[str, dict[str, float]]],
+        *,
+        label: str | None = None,
+    ) -> None:
+        """
+        Registers several metrics computed by one callback when they're collected,
+        replacing any existing group with the same name
+        """
+
+        self._metrics[name] = CallbackMetricGroup(name, metrics, callback, label=label)
+
+    def unregister(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def get(self, name: str) -> Histogram | Counter | CallbackMetric | CallbackMetricGroup | None:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.collect())
+            except Exception:
+                logging.exception(f'Unable to collect metric "{metric.name}"')
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+SEARCH_LATENCY = REGISTRY.histogram("friend_boat_search_seconds", "How long searching for a video takes")
+GET_SOURCE_LATENCY = REGISTRY.histogram(
+    "friend_boat_get_source_seconds", "How long extracting a stream and building its audio source takes"
+)
+FIRST_FRAME_LATENCY = REGISTRY.histogram(
+    "friend_boat_first_frame_seconds", "How long ffmpeg takes to produce its first frame after being spawned"
+)
+HOT_SWAP_DURATION = REGISTRY.histogram(
+    "friend_boat_hot_swap_seconds", "How long preparing a hot swap takes, e.g. when seeking or applying an effect"
+)
+QUEUE_TO_AUDIO_LATENCY = REGISTRY.histogram(
+    "friend_boat_queue_to_audio_seconds", "How long an item takes to start playing once it's due to play"
+)
+
+
+class MetricsServer:
+    def __init__(self, port: int, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY) -> None:
+        """Serves metrics over HTTP at /metrics, in the Prometheus text format"""
+
+        self.port = port
+        self.host = host
+        self.registry = registry
+
+        self._runner: web.AppRunner | None = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Serving metrics on port {self.port}")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
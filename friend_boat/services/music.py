@@ -1,15 +1,24 @@
 import asyncio
-import random
-from queue import Empty, Queue
+import time
 from typing import cast
 
 from discord import Bot, Message
+from discord.abc import Messageable
 from discord.channel import VocalGuildChannel
 from discord.voice import VoiceClient
 
-from friend_boat.bots.settings import Settings
-from friend_boat.models.music import MusicQueueEmbeds, MusicQueueFullError, MusicQueueItem
-from friend_boat.services._base import AudioStreamEffect
+from friend_boat.bots.settings import Settings, get_settings
+from friend_boat.models.music import (
+    MusicQueueEmbeds,
+    MusicQueueFullError,
+    MusicQueueItem,
+    MusicQueueItemSnapshot,
+    MusicQueueSnapshot,
+)
+from friend_boat.services._base import AudioPlayer, AudioStream, AudioStreamEffect
+from friend_boat.services.metrics import HOT_SWAP_DURATION
+from friend_boat.services.music_queue import IndexedQueue, QueueRounds
+from friend_boat.services.stream_stats import StreamStats
 
 
 class MusicQueueService:
@@ -17,11 +26,24 @@ class MusicQueueService:
         self.bot = bot
         self.guild_id = guild_id
 
-        settings = Settings()
+        settings = get_settings()
 
         # queue
-        self._queue: Queue[MusicQueueItem] = Queue()
-        self._max_queue_size = settings.max_queue_size
+        self._queue: IndexedQueue[MusicQueueItem] = IndexedQueue(maxsize=settings.max_queue_size)
+        self._fair_queue = settings.fair_queue
+        """Whether the queue takes turns between requestors. The queue is always kept in the order it will play in"""
+        self._rounds = QueueRounds()
+        self._rounds_version = -1
+        """the queue version `_rounds` is up to date with. Other changes to the queue rebuild the rounds when needed"""
+        self._embeds = MusicQueueEmbeds(self._queue, settings.queue_paginator_page_size)
+
+        # prefetching
+        self._prefetch_delay = settings.prefetch_delay * 1000
+        self._prefetch_spawn_player = settings.prefetch_spawn_player
+        self._prefetch_buffer_duration = settings.prefetch_buffer_duration
+        self._prefetch_task: asyncio.Task | None = None
+        self._prefetched_item: MusicQueueItem | None = None
+        """The next item to play, if it has already been prepared"""
 
         # state
         self._currently_playing: MusicQueueItem | None = None
@@ -31,7 +53,7 @@ class MusicQueueService:
         """The music to play immediately after the current item stops"""
 
         self._next_item_to_play: MusicQueueItem | None = None
-        """The next item to play, ignoring the queue"""
+        """The next item to play, ignoring the queue, e.g. when repeating the current item"""
 
         self._currently_playing_message: Message | None = None
         """The message showing the currently playing item"""
@@ -39,6 +61,7 @@ class MusicQueueService:
         self._applied_effect: AudioStreamEffect | None = None
         self._repeat_once: bool = False
         self._repeat_forever: bool = False
+        self._volume: float = 1.0
 
     def _get_voice_client(self) -> VoiceClient | None:
         guild = self.bot.get_guild(self.guild_id)
@@ -52,6 +75,7 @@ class MusicQueueService:
 
     def _reset_state(self) -> None:
         self.clear()
+        self._cancel_prefetch()
 
         self._currently_playing = None
         self._hot_swap_currently_playing = None
@@ -68,7 +92,15 @@ class MusicQueueService:
 
     @property
     def queue_size(self) -> int:
-        return self._queue.qsize()
+        return len(self._queue)
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @property
+    def fair_queue(self) -> bool:
+        return self._fair_queue
 
     @property
     def is_alone(self) -> bool:
@@ -82,6 +114,16 @@ class MusicQueueService:
         current_channel = cast(VocalGuildChannel, voice_client.channel)
         return len(current_channel.members) <= 1
 
+    @property
+    def is_idle(self) -> bool:
+        """Whether nothing is playing or queued, and the bot isn't in a voice channel"""
+
+        if self._currently_playing or self._queue:
+            return False
+
+        voice_client = self._get_voice_client()
+        return not (voice_client and voice_client.is_connected())
+
     @property
     def is_paused(self) -> bool:
         voice_client = self._get_voice_client()
@@ -90,6 +132,15 @@ class MusicQueueService:
 
         return voice_client.is_paused()
 
+    @property
+    def stream_stats(self) -> StreamStats | None:
+        """Read instrumentation for the stream currently playing, if any"""
+
+        if not (self._currently_playing and self._currently_playing.source):
+            return None
+
+        return self._currently_playing.source.stats
+
     @property
     def current_voice_channel_id(self) -> int | None:
         voice_client = self._get_voice_client()
@@ -98,15 +149,23 @@ class MusicQueueService:
         else:
             return voice_client.channel.id  # type: ignore [attr-defined]
 
+    def apply_settings(self, settings: Settings) -> None:
+        """Applies reloaded settings. A smaller queue size only stops new items from being queued"""
+
+        self._queue.maxsize = settings.max_queue_size
+        self._embeds.page_size = settings.queue_paginator_page_size
+
     @property
     def embeds(self) -> MusicQueueEmbeds:
-        queue_items = list(self._queue.queue)
-        if self._next_item_to_play:
-            queue_items.insert(0, self._next_item_to_play)
+        return self._embeds
+
+    @property
+    def queue_version(self) -> int:
+        """Changes whenever the queue changes"""
 
-        return MusicQueueEmbeds(queue_items)
+        return self._queue.version
 
-    async def start_playing(self, currently_playing_message: Message, voice_channel: VocalGuildChannel) -> None:
+    async def start_playing(self, currently_playing_message: Message | None, voice_channel: VocalGuildChannel) -> None:
         """Start playing the queue"""
 
         self._currently_playing_message = currently_playing_message
@@ -125,24 +184,156 @@ class MusicQueueService:
         if skip_current and self._currently_playing:
             await self.skip()
 
+    def snapshot(self) -> MusicQueueSnapshot | None:
+        """Captures the queue and playback state, or returns `None` if there's nothing to resume"""
+
+        voice_channel_id = self.current_voice_channel_id
+        if not (voice_channel_id and (self._currently_playing or self._queue)):
+            return None
+
+        currently_playing: MusicQueueItemSnapshot | None = None
+        if self._currently_playing:
+            currently_playing = MusicQueueItemSnapshot(
+                url=self._currently_playing.music.url,
+                requestor_id=self._currently_playing.requestor.id,
+                start_at=self._currently_playing.position or self._currently_playing.start_at,
+            )
+
+        return MusicQueueSnapshot(
+            voice_channel_id=voice_channel_id,
+            message_channel_id=(
+                self._currently_playing_message.channel.id if self._currently_playing_message else None
+            ),
+            currently_playing=currently_playing,
+            queue=[
+                MusicQueueItemSnapshot(url=item.music.url, requestor_id=item.requestor.id, start_at=item.start_at)
+                for item in self._queue.snapshot()
+            ],
+            effect=self._applied_effect.value if self._applied_effect else None,
+            volume=self._volume,
+            repeat_once=self._repeat_once,
+            repeat_forever=self._repeat_forever,
+            fair_queue=self._fair_queue,
+        )
+
+    async def restore(
+        self,
+        snapshot: MusicQueueSnapshot,
+        items: list[MusicQueueItem],
+        voice_channel: VocalGuildChannel,
+        message_channel: Messageable | None,
+    ) -> None:
+        """
+        Restores a snapshot and resumes playback
+
+        items: The snapshot's items, starting with the item which was playing, if any
+        """
+
+        self._applied_effect = AudioStreamEffect(snapshot.effect) if snapshot.effect else None
+        self._volume = snapshot.volume
+        self._repeat_once = snapshot.repeat_once
+        self._repeat_forever = snapshot.repeat_forever
+        self._fair_queue = snapshot.fair_queue
+        for item in items:
+            # the snapshot was taken from a valid queue, so it may exceed the limit by the item which was playing
+            self._queue.insert(len(self._queue), item)
+
+        message = await message_channel.send("Resuming playback...") if message_channel else None
+        await self.start_playing(message, voice_channel)
+
+    def _peek_next_item(self) -> MusicQueueItem | None:
+        """The item which will play after the current one, if it's known ahead of time"""
+
+        if self._repeat_once or self._repeat_forever:
+            # repeats are copies of the current item, which are created when the current item ends
+            return None
+
+        return self._next_item_to_play or self._queue.peek()
+
+    def _cancel_prefetch(self) -> None:
+        if self._prefetch_task:
+            self._prefetch_task.cancel()
+            self._prefetch_task = None
+
+        if self._prefetched_item:
+            self._prefetched_item.unload_player()
+            self._prefetched_item = None
+
+    def _schedule_prefetch(self) -> None:
+        """Prepares the next item partway through the current one, if it isn't already prepared"""
+
+        if self._prefetched_item or not self._currently_playing:
+            return
+
+        if self._prefetch_task:
+            self._prefetch_task.cancel()
+
+        delay = max(0, self._prefetch_delay - self._currently_playing.position) / 1000
+        self._prefetch_task = self.bot.loop.create_task(self._prefetch_next(delay))
+
+    def _refresh_prefetch(self) -> None:
+        """Discards the prefetched item if it's no longer up next, then schedules a new prefetch"""
+
+        if self._prefetched_item and self._prefetched_item is not self._peek_next_item():
+            self._cancel_prefetch()
+
+        self._schedule_prefetch()
+
+    async def _prefetch_next(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+
+        item = self._peek_next_item()
+        if not item:
+            return
+
+        self._prefetched_item = item
+        if not self._prefetch_spawn_player:
+            await item.player_service.prefetch(item.music)
+            return
+
+        item.effect = self._applied_effect
+        item.volume = self._volume
+        await item.load_player()
+        if item.source and self._prefetch_buffer_duration:
+            source = item.source
+            await self.bot.loop.run_in_executor(None, lambda: source.prebuffer(self._prefetch_buffer_duration))
+
+    async def _claim_prefetched_item(self, item: MusicQueueItem) -> None:
+        """Waits for `item` to finish prefetching if it was prefetched, otherwise discards any prefetched item"""
+
+        if item is not self._prefetched_item:
+            return self._cancel_prefetch()
+
+        self._prefetched_item = None
+        if self._prefetch_task:
+            try:
+                await self._prefetch_task
+            except Exception:
+                # we'll just load the item normally
+                item.unload_player()
+            finally:
+                self._prefetch_task = None
+
     async def _start_voice_client(self, item: MusicQueueItem, client: VoiceClient) -> None:
+        due_at = time.perf_counter()
         player = await item.load_player()
+        player.source.due_at = due_at
+
         loop = asyncio.get_event_loop()
         client.play(player, after=lambda ex: asyncio.run_coroutine_threadsafe(self._play_next(ex), loop))
+        self._schedule_prefetch()
 
-    async def _trigger_hot_swap(self, old_item: MusicQueueItem, *, timeskip: int | None = None, **kwargs) -> None:
+    async def _trigger_hot_swap(self, old_item: MusicQueueItem, *, timeskip: int = 0, **kwargs) -> None:
         voice_client = self._get_voice_client()
         if not (voice_client and voice_client.is_connected()):
             return
 
-        self._hot_swap_currently_playing = old_item.copy(**kwargs)
+        with HOT_SWAP_DURATION.time():
+            self._hot_swap_currently_playing = old_item.copy(**kwargs)
 
-        # pre-load the player so it's ready faster
-        if timeskip is None:
-            timeskip = 1000  # hot-swapping takes about a second, so this makes the transition more seamless
-
-        await self._hot_swap_currently_playing.load_player(start_at=old_item.position + timeskip)
-        voice_client.stop()
+            # pre-load the player so it's ready faster
+            await self._hot_swap_currently_playing.load_player(start_at=old_item.position + timeskip)
+            voice_client.stop()
 
     async def _play_next(self, ex: Exception | None = None) -> None:
         if ex:
@@ -163,12 +354,15 @@ class MusicQueueService:
             return await self._start_voice_client(self._currently_playing, voice_client)
 
         try:
-            self._currently_playing = self._next_item_to_play or self._queue.get(block=False)
+            self._currently_playing = self._next_item_to_play or self._get_next_queued_item()
             self._currently_playing.effect = self._applied_effect
+            self._currently_playing.volume = self._volume
             self._next_item_to_play = None
-        except Empty:
+        except asyncio.QueueEmpty:
             return await self.stop()
 
+        await self._claim_prefetched_item(self._currently_playing)
+
         await self._start_voice_client(self._currently_playing, voice_client)
         if self._currently_playing_message:
             await self._currently_playing_message.edit(
@@ -178,7 +372,8 @@ class MusicQueueService:
     def clear(self) -> None:
         """Clear the queue"""
 
-        self._queue.queue.clear()
+        self._queue.clear()
+        self._refresh_prefetch()
 
     async def pause(self) -> None:
         """Pauses playback"""
@@ -205,12 +400,18 @@ class MusicQueueService:
         if not self._currently_playing:
             return
 
-        await self._trigger_hot_swap(self._currently_playing, timeskip=self._currently_playing.position + interval)
+        # short rewinds are replayed from memory, anything else restarts the stream at the new position
+        source = self._currently_playing.source
+        if interval < 0 and source and source.rewind(-interval):
+            return
+
+        await self._trigger_hot_swap(self._currently_playing, timeskip=interval)
 
     def set_next_item(self, item: MusicQueueItem) -> None:
-        """Set the next item to be played, ignoring the queue"""
+        """Puts an item at the front of the queue, even if the queue is full"""
 
-        self._next_item_to_play = item
+        self._queue.insert(0, item)
+        self._refresh_prefetch()
 
     async def skip(self) -> None:
         """Ends the current item and proceeds to the next one"""
@@ -246,26 +447,148 @@ class MusicQueueService:
             return
 
         self._applied_effect = effect
-        # TODO: passing the effect twice is redundant, we should fix the API so we can pass it just once
-        await self._trigger_hot_swap(
-            self._currently_playing, source=self._currently_playing.source.apply_effect(effect), effect=effect
-        )
+        source = self._currently_playing.source
+        if isinstance(source, AudioStream):
+            # effects are applied in-process, so there's no need to restart the stream
+            self._currently_playing.effect = effect
+            source.apply_effect(effect)
+        elif effect is not AudioStreamEffect.clear:
+            # passthrough streams need to be restarted so they're decoded
+            await self._trigger_hot_swap(self._currently_playing, effect=effect)
+
+        if self._prefetched_item:
+            self._prefetched_item.effect = effect
+            prefetched_source = self._prefetched_item.source
+            if isinstance(prefetched_source, AudioStream):
+                prefetched_source.apply_effect(effect)
+            elif prefetched_source and effect is not AudioStreamEffect.clear:
+                self._cancel_prefetch()
+                self._schedule_prefetch()
+
+    async def set_volume(self, volume: float) -> None:
+        """Sets the volume for this guild, where 1.0 is the original volume"""
+
+        self._volume = min(max(volume, 0.0), AudioPlayer.MAX_VOLUME)
+        if self._prefetched_item:
+            self._cancel_prefetch()
+            self._schedule_prefetch()
+
+        if not (self._currently_playing and self._currently_playing.source):
+            return
 
-    def add_to_queue(self, item: MusicQueueItem) -> None:
-        """Puts an item into the queue. Raises a `MusicQueueFullError` if the queue is full"""
+        self._currently_playing.volume = self._volume
+        player = await self._currently_playing.load_player()
+        if player.is_opus() and self._volume != 1.0:
+            # passthrough streams need to be restarted so they're decoded
+            await self._trigger_hot_swap(self._currently_playing, volume=self._volume)
+        else:
+            player.volume = self._volume
+
+    def _get_next_queued_item(self) -> MusicQueueItem:
+        """Takes the next item off the queue. Raises an `asyncio.QueueEmpty` if the queue is empty"""
+
+        rounds_in_sync = self._rounds_version == self._queue.version
+        item = self._queue.get_nowait()
+        if rounds_in_sync:
+            self._rounds.remove_first(item.requestor.id)
+            self._rounds_version = self._queue.version
+
+        return item
+
+    def _get_fair_position(self, item: MusicQueueItem) -> int:
+        """
+        Where to insert an item so requestors take turns, assuming it will be inserted there
 
-        if self._queue.qsize() > self._max_queue_size:
+        The queue is split into rounds, where each requestor's nth queued item is in round n. A new item joins the end
+        of the round after its requestor's last queued item, i.e. after every item in the same or an earlier round
+        """
+
+        if self._rounds_version != self._queue.version:
+            # the queue was changed some other way, e.g. an item was moved
+            self._rounds.rebuild(queued_item.requestor.id for queued_item in self._queue)
+
+        return self._rounds.add(item.requestor.id)
+
+    def _sort_fairly(self) -> None:
+        """Reorders the queue into rounds, keeping each requestor's items in order"""
+
+        keys: dict[int, tuple[int, int]] = {}
+        rounds: dict[int, int] = {}
+        requestor_order: dict[int, int] = {}
+        for id, item in self._queue.entries():
+            requestor_id = item.requestor.id
+            rounds[requestor_id] = rounds.get(requestor_id, -1) + 1
+
+            # within each round, requestors keep the order they first appear in
+            requestor_order.setdefault(requestor_id, len(requestor_order))
+            keys[id] = (rounds[requestor_id], requestor_order[requestor_id])
+
+        self._queue.sort(key=lambda entry: keys[entry[0]])
+
+    def toggle_fair_queue(self) -> bool:
+        """Toggles whether requestors take turns, rather than the queue playing in the order items were added"""
+
+        self._fair_queue = not self._fair_queue
+        if self._fair_queue:
+            self._sort_fairly()
+            self._refresh_prefetch()
+
+        return self._fair_queue
+
+    def add_to_queue(self, item: MusicQueueItem, position: int | None = None) -> None:
+        """
+        Puts an item into the queue. Raises a `MusicQueueFullError` if the queue is full
+
+        position: Where to insert the item, starting from 0. Defaults to the end of the queue,
+            or the end of the requestor's next turn if the queue is fair
+        """
+
+        if self._queue.full():
             raise MusicQueueFullError()
 
-        self._queue.put(item)
+        fair = position is None and self._fair_queue
+        if fair:
+            position = self._get_fair_position(item)
+
+        if position is None:
+            self._queue.put_nowait(item)
+        else:
+            self._queue.insert(position, item)
+
+        if fair:
+            self._rounds_version = self._queue.version
+
+        self._refresh_prefetch()
+
+    def remove_from_queue(self, position: int) -> MusicQueueItem:
+        """Removes the item at `position`, starting from 0. Raises an `IndexError` if there isn't one"""
+
+        item = self._queue.pop(position)
+        self._refresh_prefetch()
+        return item
+
+    def move_in_queue(self, position: int, new_position: int) -> MusicQueueItem:
+        """Moves the item at `position` to `new_position`, starting from 0. Raises an `IndexError` if there isn't one"""
+
+        item = self._queue[position]
+        self._queue.move(position, new_position)
+        self._refresh_prefetch()
+        return item
 
     def toggle_repeat_once(self, force_on=False) -> bool:
         self._repeat_once = True if force_on else not self._repeat_once
+        self._refresh_prefetch()
         return self._repeat_once
 
     def toggle_repeat_forever(self, force_on=False) -> bool:
         self._repeat_forever = True if force_on else not self._repeat_forever
+        self._refresh_prefetch()
         return self._repeat_forever
 
     def shuffle(self) -> None:
-        random.shuffle(self._queue.queue)
+        self._queue.shuffle()
+        if self._fair_queue:
+            # requestors still take turns, in a random order
+            self._sort_fairly()
+
+        self._refresh_prefetch()
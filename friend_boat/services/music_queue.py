@@ -0,0 +1,360 @@
+import asyncio
+import itertools
+import random
+from collections import deque
+from typing import Any, Callable, Generic, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class _Node(Generic[T]):
+    __slots__ = ("id", "value", "priority", "size", "left", "right", "parent")
+
+    def __init__(self, id: int, value: T) -> None:
+        self.id = id
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.left: _Node[T] | None = None
+        self.right: _Node[T] | None = None
+        self.parent: _Node[T] | None = None
+
+
+def _size(node: _Node | None) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node) -> None:
+    """Recomputes a node's size and re-links its children after they've changed"""
+
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left:
+        node.left.parent = node
+    if node.right:
+        node.right.parent = node
+
+
+def _split(node: _Node[T] | None, count: int) -> tuple[_Node[T] | None, _Node[T] | None]:
+    """Splits a tree into one holding its first `count` items and one holding the rest"""
+
+    if not node:
+        return None, None
+
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        _update(node)
+        return left, node
+    else:
+        node.right, right = _split(node.right, count - _size(node.left) - 1)
+        _update(node)
+        return node, right
+
+
+def _merge(left: _Node[T] | None, right: _Node[T] | None) -> _Node[T] | None:
+    """Joins two trees, keeping every item in `left` before every item in `right`"""
+
+    if not (left and right):
+        return left or right
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    else:
+        right.left = _merge(left, right.left)
+        _update(right)
+        return right
+
+
+class IndexedQueue(Generic[T]):
+    def __init__(self, maxsize: int = 0) -> None:
+        """
+        A FIFO queue which also supports inserting, removing and moving items at any position in O(log n)
+
+        Every item gets an id when it's added, which stays the same as it moves around the queue. Items are stored in
+        an implicit treap, i.e. a randomly-balanced binary tree ordered by position, which is only ever touched from
+        the event loop, so it doesn't need any locking
+
+        maxsize: The most items `put_nowait` will queue. Use 0 for no limit
+        """
+
+        self.maxsize = maxsize
+
+        self._root: _Node[T] | None = None
+        self._nodes: dict[int, _Node[T]] = {}
+        self._ids = itertools.count()
+
+        self._version = 0
+        """incremented on every change, so snapshots can be reused until the queue changes"""
+        self._snapshot: tuple[T, ...] = ()
+        self._snapshot_version = 0
+        self._listeners: list[Callable[[], None]] = []
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self.snapshot())
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._nodes
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self)
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Calls `listener` after every change to the queue. Listeners should be quick, e.g. scheduling work"""
+
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _set_root(self, root: _Node[T] | None) -> None:
+        if root:
+            root.parent = None
+
+        self._root = root
+        self._version += 1
+        for listener in list(self._listeners):
+            listener()
+
+    def _node_at(self, index: int) -> _Node[T]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+
+        node = self._root
+        while node:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node
+            else:
+                index -= left_size + 1
+                node = node.right
+
+        raise IndexError("queue index out of range")
+
+    def __getitem__(self, index: int) -> T:
+        return self._node_at(index).value
+
+    def id_at(self, index: int) -> int:
+        return self._node_at(index).id
+
+    def index_of(self, id: int) -> int:
+        """Gets the current position of an item by its id. Raises a `KeyError` if it isn't queued"""
+
+        node = self._nodes[id]
+        index = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                index += _size(node.parent.left) + 1
+
+            node = node.parent
+
+        return index
+
+    def peek(self) -> T | None:
+        """The next item in the queue, without removing it"""
+
+        return self[0] if self._root else None
+
+    def insert(self, index: int, item: T) -> int:
+        """Inserts an item before `index`, ignoring `maxsize`, and returns its id"""
+
+        node = _Node(next(self._ids), item)
+        self._nodes[node.id] = node
+
+        # like list.insert, out-of-range indexes are clamped
+        index = min(max(index if index >= 0 else index + len(self), 0), len(self))
+        left, right = _split(self._root, index)
+        self._set_root(_merge(_merge(left, node), right))
+        return node.id
+
+    def put_nowait(self, item: T) -> int:
+        """Adds an item to the end of the queue and returns its id. Raises an `asyncio.QueueFull` if it is full"""
+
+        if self.full():
+            raise asyncio.QueueFull()
+
+        return self.insert(len(self), item)
+
+    def pop(self, index: int = 0) -> T:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("pop index out of range")
+
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        assert node
+
+        del self._nodes[node.id]
+        self._set_root(_merge(left, right))
+        return node.value
+
+    def get_nowait(self) -> T:
+        """Removes and returns the next item. Raises an `asyncio.QueueEmpty` if the queue is empty"""
+
+        if not self._root:
+            raise asyncio.QueueEmpty()
+
+        return self.pop(0)
+
+    def remove(self, id: int) -> T:
+        """Removes an item by its id. Raises a `KeyError` if it isn't queued"""
+
+        return self.pop(self.index_of(id))
+
+    def move(self, index: int, new_index: int) -> None:
+        """Moves the item at `index` so it ends up at `new_index`, keeping its id"""
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("move index out of range")
+
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        assert node
+        rest = _merge(left, right)
+
+        size = _size(rest) + 1
+        new_index = min(max(new_index if new_index >= 0 else new_index + size, 0), size - 1)
+        left, right = _split(rest, new_index)
+        self._set_root(_merge(_merge(left, node), right))
+
+    def clear(self) -> None:
+        self._nodes.clear()
+        self._set_root(None)
+
+    def _rebuild(self, nodes: list[_Node[T]]) -> None:
+        root: _Node[T] | None = None
+        for node in nodes:
+            node.left = node.right = None
+            node.size = 1
+            root = _merge(root, node)
+
+        self._set_root(root)
+
+    def shuffle(self) -> None:
+        """Shuffles the queue in place. Items keep their ids"""
+
+        nodes = list(self._iter_nodes())
+        random.shuffle(nodes)
+        self._rebuild(nodes)
+
+    def sort(self, key: Callable[[tuple[int, T]], Any]) -> None:
+        """Stably sorts the queue in place, where `key` is given each item alongside its id. Items keep their ids"""
+
+        nodes = list(self._iter_nodes())
+        nodes.sort(key=lambda node: key((node.id, node.value)))
+        self._rebuild(nodes)
+
+    def _iter_nodes(self) -> Iterator[_Node[T]]:
+        stack: list[_Node[T]] = []
+        node = self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+
+            node = stack.pop()
+            yield node
+            node = node.right
+
+    def snapshot(self) -> tuple[T, ...]:
+        """All queued items in order. The snapshot is only rebuilt after the queue changes"""
+
+        if self._snapshot_version != self._version:
+            self._snapshot = tuple(node.value for node in self._iter_nodes())
+            self._snapshot_version = self._version
+
+        return self._snapshot
+
+    def entries(self) -> list[tuple[int, T]]:
+        """All queued items in order, alongside their ids"""
+
+        return [(node.id, node.value) for node in self._iter_nodes()]
+
+
+class QueueRounds:
+    def __init__(self) -> None:
+        """
+        Tracks the rounds of a queue where requestors take turns, so each new item's position is found in O(1)
+        instead of by rescanning the queue
+
+        Every requestor's items are in increasing rounds, and rounds never decrease along the queue, so a round ends
+        after every item in it or an earlier round. Round ends are stored as positions counted from the start of the
+        queue's history, so items leaving the front of the queue don't shift every round's end
+        """
+
+        self._requestor_rounds: dict[int, int] = {}
+        """the round of each requestor's last queued item"""
+        self._requestor_counts: dict[int, int] = {}
+        """how many items each requestor has queued"""
+        self._ends: deque[int] = deque()
+        """where each round ends, starting from the first round which still has items queued"""
+        self._first_round = 0
+        self._removed = 0
+        """how many items have left the front of the queue"""
+
+    def rebuild(self, requestor_ids: Iterable[int]) -> None:
+        """Recomputes the rounds from the requestors of every queued item, in order"""
+
+        self._requestor_rounds.clear()
+        self._requestor_counts.clear()
+        self._ends.clear()
+        self._first_round = 0
+        self._removed = 0
+
+        current_round = 0
+        for position, requestor_id in enumerate(requestor_ids):
+            # items moved out of turn are treated as part of the round they're in
+            current_round = max(current_round, self._requestor_rounds.get(requestor_id, -1) + 1)
+            self._requestor_rounds[requestor_id] = current_round
+            self._requestor_counts[requestor_id] = self._requestor_counts.get(requestor_id, 0) + 1
+            while len(self._ends) <= current_round:
+                self._ends.append(position)
+
+            self._ends[current_round] = position + 1
+
+    def add(self, requestor_id: int) -> int:
+        """Puts a requestor's next item at the end of their next turn, and returns the position to insert it at"""
+
+        last_round = self._requestor_rounds.get(requestor_id)
+        item_round = self._first_round if last_round is None else last_round + 1
+        index = item_round - self._first_round
+        if index == len(self._ends):
+            self._ends.append(self._ends[-1] if self._ends else self._removed)
+
+        position = self._ends[index] - self._removed
+
+        # only the new item's round and the rounds after it move, which is usually just the last round
+        for i in range(index, len(self._ends)):
+            self._ends[i] += 1
+
+        self._requestor_rounds[requestor_id] = item_round
+        self._requestor_counts[requestor_id] = self._requestor_counts.get(requestor_id, 0) + 1
+        return position
+
+    def remove_first(self, requestor_id: int) -> None:
+        """Removes the item at the front of the queue"""
+
+        self._removed += 1
+        while self._ends and self._ends[0] <= self._removed:
+            self._ends.popleft()
+            self._first_round += 1
+
+        self._requestor_counts[requestor_id] -= 1
+        if not self._requestor_counts[requestor_id]:
+            del self._requestor_counts[requestor_id]
+            del self._requestor_rounds[requestor_id]
@@ -0,0 +1,120 @@
+import logging
+import threading
+from typing import Callable
+
+
+class ReadAheadBuffer:
+    def __init__(self, read_into: Callable[[memoryview], int | None], frame_size: int, capacity: int) -> None:
+        """
+        Reads fixed-size frames ahead of playback on a dedicated thread, so hiccups in ffmpeg or the network are
+        absorbed by the buffer instead of delaying the audio thread
+
+        Frames are read straight into a preallocated ring of `capacity` frames, so filling the buffer doesn't allocate.
+        A short frame ends the stream, the same as `FFmpegPCMAudio.read`
+
+        read_into: Reads into the given buffer and returns how many bytes were read, e.g. a pipe's `readinto`
+        frame_size: The size of each frame, in bytes
+        capacity: How many frames to buffer
+        """
+
+        self.frame_size = frame_size
+        self.capacity = max(capacity, 1)
+
+        self._read_into = read_into
+        self._buffer = bytearray(frame_size * self.capacity)
+        self._view = memoryview(self._buffer)
+
+        self._head = 0
+        """the slot holding the next frame to hand out"""
+        self._count = 0
+        """how many slots hold frames which haven't been handed out yet"""
+        self._eof = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self.underruns = 0
+        """how many reads found the buffer empty and had to wait for ffmpeg"""
+
+        self._thread = threading.Thread(target=self._fill, name="friend_boat-read-ahead", daemon=True)
+
+    @property
+    def buffered(self) -> int:
+        """How many frames are buffered"""
+
+        return self._count
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _read_frame_into(self, view: memoryview) -> int:
+        filled = 0
+        while filled < self.frame_size:
+            n = self._read_into(view[filled:])
+            if not n:
+                break
+
+            filled += n
+
+        return filled
+
+    def _fill(self) -> None:
+        while True:
+            with self._condition:
+                while self._count == self.capacity and not self._closed:
+                    self._condition.wait()
+
+                if self._closed:
+                    return
+
+                tail = (self._head + self._count) % self.capacity
+
+            # the slot isn't visible to readers until the count is bumped, so it can be filled without the lock
+            start = tail * self.frame_size
+            try:
+                filled = self._read_frame_into(self._view[start : start + self.frame_size])
+            except (OSError, ValueError):
+                # the pipe was closed while we were reading
+                logging.debug("Stopped reading ahead from a closed audio stream")
+                filled = 0
+
+            with self._condition:
+                if filled < self.frame_size:
+                    self._eof = True
+                else:
+                    self._count += 1
+
+                self._condition.notify_all()
+                if self._eof:
+                    return
+
+    def wait_until_buffered(self, frames: int, timeout: float | None = None) -> bool:
+        """Blocks until at least `frames` frames are buffered, or the stream ends. Returns whether they were"""
+
+        frames = min(frames, self.capacity)
+        with self._condition:
+            self._condition.wait_for(lambda: self._count >= frames or self._eof or self._closed, timeout)
+            return self._count >= frames
+
+    def read(self) -> bytes:
+        """Hands out the next frame, waiting for one if the buffer is empty. Returns nothing once the stream ends"""
+
+        with self._condition:
+            if not self._count and not (self._eof or self._closed):
+                self.underruns += 1
+                self._condition.wait_for(lambda: self._count or self._eof or self._closed)
+
+            if not self._count or self._closed:
+                return b""
+
+            start = self._head * self.frame_size
+            frame = bytes(self._view[start : start + self.frame_size])
+            self._head = (self._head + 1) % self.capacity
+            self._count -= 1
+            self._condition.notify_all()
+
+        return frame
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -0,0 +1,194 @@
+import threading
+from collections import OrderedDict
+
+
+class ReplayCache:
+    def __init__(self, max_track_bytes: int, max_bytes: int) -> None:
+        """
+        Keeps the encoded Opus packets of whole tracks in memory, so repeats can be played without ffmpeg or the
+        network. Evicts the least-recently-played tracks once it exceeds `max_bytes`
+
+        Tracks still being captured reserve their packets against `max_bytes` as they grow, so the budget covers
+        every capture in progress as well as every kept track
+
+        max_track_bytes: The largest track to keep, in bytes. Longer tracks aren't captured at all
+        max_bytes: How much memory every kept track and capture in progress can use in total, in bytes
+        """
+
+        self.max_track_bytes = max_track_bytes
+        self.max_bytes = max_bytes
+
+        self._tracks: OrderedDict[str, tuple[tuple[bytes, ...], int]] = OrderedDict()
+        """packets and their total size keyed by track, from least to most recently played"""
+        self._size = 0
+        """the total size of every kept track, in bytes"""
+        self._reserved = 0
+        """the total size of every capture in progress, in bytes"""
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._tracks
+
+    @property
+    def size(self) -> int:
+        """The total size of every kept track, in bytes"""
+
+        return self._size
+
+    @property
+    def reserved(self) -> int:
+        """The total size of every capture in progress, in bytes"""
+
+        return self._reserved
+
+    def _evict(self) -> None:
+        """Removes the least-recently-played tracks until the cache fits in its budget. Requires the lock"""
+
+        while self._tracks and self._size + self._reserved > self.max_bytes:
+            _, (_, size) = self._tracks.popitem(last=False)
+            self._size -= size
+
+    def resize(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key: str) -> tuple[bytes, ...] | None:
+        with self._lock:
+            entry = self._tracks.get(key)
+            if not entry:
+                self.misses += 1
+                return None
+
+            self._tracks.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, packets: tuple[bytes, ...], size: int, *, reserved: int = 0) -> None:
+        """
+        Keeps a track
+
+        reserved: How much of the budget was reserved for this track while it was captured, in bytes. The reservation
+            is released whether or not the track is kept
+        """
+
+        with self._lock:
+            self._reserved -= reserved
+            if not packets or size <= 0 or size > min(self.max_track_bytes, self.max_bytes):
+                return
+
+            previous = self._tracks.pop(key, None)
+            if previous:
+                self._size -= previous[1]
+
+            self._tracks[key] = (packets, size)
+            self._size += size
+            self._evict()
+
+    def reserve(self, size: int) -> bool:
+        """
+        Reserves part of the budget for a capture in progress, evicting kept tracks to make room. Returns `False`,
+        without reserving anything, if other captures in progress have already reserved the rest of the budget
+        """
+
+        with self._lock:
+            if self._reserved + size > self.max_bytes:
+                return False
+
+            self._reserved += size
+            self._evict()
+            return True
+
+    def release(self, size: int) -> None:
+        """Releases part of the budget reserved for a capture which was abandoned"""
+
+        with self._lock:
+            self._reserved -= size
+
+    def capture(self, key: str, duration: int | None) -> "ReplayCapture | None":
+        """
+        Starts capturing a track as it plays, unless it's already kept
+
+        duration: How long the track is, in milliseconds. Tracks of unknown length aren't captured, since there's no
+            way to tell whether they were captured in full
+        """
+
+        if not duration or key in self._tracks:
+            return None
+
+        return ReplayCapture(self, key, duration)
+
+
+class ReplayCapture:
+    PACKET_DURATION = 20
+    """how much audio each Opus packet holds, in milliseconds"""
+    DURATION_TOLERANCE = 2000
+    """how far a capture's length can be from the track's duration, in milliseconds. Durations are rounded to the
+    second, and the container may pad the start or end of the audio"""
+
+    def __init__(self, cache: ReplayCache, key: str, duration: int) -> None:
+        """
+        Collects a track's packets as they're read, and keeps them in the cache once the whole track has been read
+
+        Packets are kept by reference, so capturing doesn't copy any audio. Every packet is reserved against the
+        cache's budget as it's added, so the capture must be either finished or discarded to release it
+
+        duration: How long the track is, in milliseconds
+        """
+
+        self.cache = cache
+        self.key = key
+        self.duration = duration
+
+        self._packets: list[bytes] = []
+        self._size = 0
+
+    def add(self, packet: bytes) -> bool:
+        """
+        Adds the next packet. Returns `False` once the track is too large to keep, or the cache's budget is used up
+        by other captures, after which it's discarded
+        """
+
+        if self._size + len(packet) > self.cache.max_track_bytes or not self.cache.reserve(len(packet)):
+            self.discard()
+            return False
+
+        self._size += len(packet)
+        self._packets.append(packet)
+        return True
+
+    def discard(self) -> None:
+        """Abandons the capture, releasing its reservation"""
+
+        self.cache.release(self._size)
+        self._packets.clear()
+        self._size = 0
+
+    @property
+    def is_complete(self) -> bool:
+        """Whether the captured audio is as long as the track, i.e. the stream didn't end early"""
+
+        captured = len(self._packets) * self.PACKET_DURATION
+        return abs(captured - self.duration) <= self.DURATION_TOLERANCE
+
+    def finish(self) -> bool:
+        """
+        Keeps the captured track if it's complete, and returns whether it was. Only call this once the stream has
+        ended successfully
+        """
+
+        complete = self.is_complete
+        if complete:
+            self.cache.set(self.key, tuple(self._packets), self._size, reserved=self._size)
+        else:
+            self.cache.release(self._size)
+
+        self._packets.clear()
+        self._size = 0
+        return complete
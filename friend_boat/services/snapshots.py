@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+
+from friend_boat.models.music import MusicQueueSnapshot
+
+
+class MusicQueueSnapshotStore:
+    def __init__(self, directory: str) -> None:
+        """
+        Saves each guild's queue snapshot to its own file, so guilds can be saved and restored independently
+        """
+
+        self.directory = directory
+
+    def _get_path(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    def guild_ids(self) -> list[int]:
+        """The ids of every guild with a saved snapshot, without loading any of them"""
+
+        if not os.path.isdir(self.directory):
+            return []
+
+        guild_ids: list[int] = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+
+            guild_id = name.removesuffix(".json")
+            if not guild_id.isdigit():
+                logging.warning(f'Ignoring unexpected snapshot file "{os.path.join(self.directory, name)}"')
+                continue
+
+            guild_ids.append(int(guild_id))
+
+        return guild_ids
+
+    def load(self, guild_id: int) -> MusicQueueSnapshot | None:
+        path = self._get_path(guild_id)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path) as f:
+                return MusicQueueSnapshot.from_json(json.load(f))
+        except Exception:
+            logging.exception(f'Unable to load snapshot file "{path}"')
+            return None
+
+    def save(self, guild_id: int, snapshot: MusicQueueSnapshot) -> None:
+        """Atomically writes a guild's snapshot to disk"""
+
+        path = self._get_path(guild_id)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # several processes may share the same directory
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot.to_json(), f, separators=(",", ":"))
+
+            os.replace(tmp_path, path)
+        except OSError:
+            logging.exception(f'Unable to save snapshot file "{path}"')
+
+    def delete(self, guild_id: int) -> None:
+        try:
+            os.remove(self._get_path(guild_id))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,142 @@
+import time
+from array import array
+from collections import deque
+from dataclasses import dataclass
+
+from .read_ahead import ReadAheadBuffer
+
+
+@dataclass
+class StreamStall:
+    at: float
+    """when the stall happened, as a unix timestamp"""
+    duration: float
+    """how long the read took, in seconds"""
+    wait: float
+    """how much of the read was spent waiting on ffmpeg, in seconds"""
+
+    @property
+    def cause(self) -> str:
+        """Whether the stall was spent waiting on ffmpeg (e.g. the network) or processing the audio (the CPU)"""
+
+        return "network" if self.wait >= self.duration / 2 else "cpu"
+
+
+class StreamStats:
+    WINDOW = 1500
+    """how many recent reads to keep latencies for, i.e. 30 seconds of audio"""
+    STALL_THRESHOLD = 0.1
+    """reads slower than this are recorded as stalls, in seconds"""
+    PAUSE_THRESHOLD = 1.0
+    """gaps between reads longer than this are assumed to be pauses rather than drift, in seconds"""
+    FRAME_INTERVAL = 0.02
+
+    def __init__(self, frame_size: int | None = None) -> None:
+        """
+        Read instrumentation for a single stream, to tell network starvation from CPU starvation
+
+        Recording a read is a handful of arithmetic operations and writes into preallocated buffers, so it's cheap
+        enough to do on every frame. Percentiles are only computed when they're asked for
+
+        frame_size: The size of a full frame, in bytes, or `None` if frames vary in size (e.g. Opus packets)
+        """
+
+        self.frame_size = frame_size
+
+        self.reads = 0
+        self.short_frames = 0
+        self.empty_frames = 0
+        self.stall_count = 0
+        self.stalls: deque[StreamStall] = deque(maxlen=20)
+        """the most recent stalls"""
+        self.drift = 0.0
+        """how far playback has fallen behind the wall clock, in seconds, ignoring pauses"""
+
+        self.read_ahead: ReadAheadBuffer | None = None
+        """the stream's read-ahead buffer, if it has one"""
+
+        self.pending_wait = 0.0
+        """time spent waiting on ffmpeg during the current read, in seconds. Consumed by `record`"""
+
+        self._latencies = array("d", bytes(8 * self.WINDOW))
+        self._waits = array("d", bytes(8 * self.WINDOW))
+        self._last_read_at: float | None = None
+
+    def record(self, started_at: float, finished_at: float, frame: bytes) -> None:
+        """Records a read which started and finished at the given `time.perf_counter` times"""
+
+        duration = finished_at - started_at
+        wait = self.pending_wait
+        self.pending_wait = 0.0
+
+        index = self.reads % self.WINDOW
+        self._latencies[index] = duration
+        self._waits[index] = wait
+        self.reads += 1
+
+        if not frame:
+            self.empty_frames += 1
+        elif self.frame_size and len(frame) < self.frame_size:
+            self.short_frames += 1
+
+        if duration >= self.STALL_THRESHOLD:
+            self.stall_count += 1
+            self.stalls.append(StreamStall(time.time(), duration, wait))
+
+        if self._last_read_at is not None:
+            gap = started_at - self._last_read_at
+            if gap < self.PAUSE_THRESHOLD:
+                self.drift += gap - self.FRAME_INTERVAL
+
+        self._last_read_at = started_at
+
+    def _percentiles(self, values: array, percentiles: tuple[float, ...]) -> list[float]:
+        count = min(self.reads, self.WINDOW)
+        if not count:
+            return [0.0 for _ in percentiles]
+
+        ordered = sorted(values[:count])
+        return [ordered[min(int(p / 100 * count), count - 1)] for p in percentiles]
+
+    def latency_percentiles(self, percentiles: tuple[float, ...] = (50, 90, 99)) -> list[float]:
+        """Percentiles of recent read latencies, in seconds"""
+
+        return self._percentiles(self._latencies, percentiles)
+
+    def wait_percentiles(self, percentiles: tuple[float, ...] = (50, 90, 99)) -> list[float]:
+        """Percentiles of how long recent reads spent waiting on ffmpeg, in seconds"""
+
+        return self._percentiles(self._waits, percentiles)
+
+    def summary(
+        self,
+        latency_percentiles: tuple[float, ...] = (50, 90, 99),
+        wait_percentiles: tuple[float, ...] = (50, 90, 99),
+    ) -> dict:
+        """
+        Everything recorded so far, with the requested percentiles keyed like "latency_p99" and "wait_p50"
+
+        Each kind of percentile sorts its whole window, so pass an empty tuple to skip ones you don't need
+        """
+
+        percentiles: dict[str, float] = {}
+        if latency_percentiles:
+            values = self.latency_percentiles(latency_percentiles)
+            percentiles.update({f"latency_p{p:g}": v for p, v in zip(latency_percentiles, values)})
+        if wait_percentiles:
+            values = self.wait_percentiles(wait_percentiles)
+            percentiles.update({f"wait_p{p:g}": v for p, v in zip(wait_percentiles, values)})
+
+        return {
+            "reads": self.reads,
+            **percentiles,
+            "short_frames": self.short_frames,
+            "empty_frames": self.empty_frames,
+            "drift": self.drift,
+            "stalls": self.stall_count,
+            "recent_network_stalls": sum(stall.cause == "network" for stall in self.stalls),
+            "recent_cpu_stalls": sum(stall.cause == "cpu" for stall in self.stalls),
+            "buffered": self.read_ahead.buffered * self.FRAME_INTERVAL if self.read_ahead else 0.0,
+            "buffer_capacity": self.read_ahead.capacity * self.FRAME_INTERVAL if self.read_ahead else 0.0,
+            "underruns": self.read_ahead.underruns if self.read_ahead else 0,
+        }
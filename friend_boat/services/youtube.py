@@ -1,17 +1,42 @@
 import asyncio
+import logging
 import os
 import re
-import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, replace
+from queue import Empty, Queue
 from tempfile import TemporaryDirectory
-from typing import cast
+from typing import AsyncIterator, Callable, Iterator, cast
+from urllib.parse import parse_qs, urlparse
 
+import aiohttp
 import yt_dlp  # type: ignore
-from pyyoutube import Api, SearchListResponse, SearchResult, Video, VideoListResponse  # type: ignore
+from pyyoutube import (  # type: ignore
+    Api,
+    PlaylistItemListResponse,
+    SearchListResponse,
+    SearchResult,
+    Video,
+    VideoListResponse,
+)
+from requests.adapters import HTTPAdapter
 
 from friend_boat.models._base import MusicItemBase
-from friend_boat.models.youtube import SearchType, YoutubeVideo
+from friend_boat.models.youtube import SearchType, YoutubeStream, YoutubeVideo
 
-from ._base import AudioStream, AudioStreamEffect, MusicPlayerServiceBase
+from ._base import (
+    AudioStream,
+    AudioStreamEffect,
+    BaseAudioStream,
+    MusicPlayerServiceBase,
+    OpusAudioStream,
+    ReplayAudioStream,
+)
+from .cache import FileCache, LRUCache, PersistentLRUCache, SingleFlight
+from .loudness import LoudnessAnalyzer
+from .metrics import GET_SOURCE_LATENCY, SEARCH_LATENCY
+from .replay import ReplayCache, ReplayCapture
 
 youtube_video_id_pattern = re.compile(
     r"^(?:https?:\/\/)?(?:www\.)?(?:youtu\.be\/|youtube\.com"
@@ -19,16 +44,191 @@ youtube_video_id_pattern = re.compile(
 )
 
 
+class YouTubeSearchCache(PersistentLRUCache[YoutubeVideo]):
+    """Caches search results by normalized query and by video id"""
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        return "query:" + " ".join(query.split()).casefold()
+
+    @staticmethod
+    def video_key(video_id: str) -> str:
+        return f"video:{video_id}"
+
+    def _serialize(self, value: YoutubeVideo) -> dict:
+        return asdict(value)
+
+    def _deserialize(self, data: dict) -> YoutubeVideo:
+        return YoutubeVideo(**data)
+
+
+class YouTubeStreamCache(LRUCache[YoutubeStream]):
+    """Caches resolved media streams by video id until shortly before their media URLs expire"""
+
+    def __init__(self, max_size: int, ttl: float | None = None, expiry_margin: float = 0) -> None:
+        super().__init__(max_size, ttl)
+        self.expiry_margin = expiry_margin
+
+    def add(self, video_id: str, stream: YoutubeStream) -> None:
+        expires_at = stream.expires_at - self.expiry_margin if stream.expires_at else None
+        self.set(video_id, stream, expires_at=expires_at)
+
+
+class YoutubeDLPool:
+    def __init__(self, factory: Callable[[], yt_dlp.YoutubeDL], max_size: int) -> None:
+        """
+        A bounded pool of warm YoutubeDL instances
+
+        YoutubeDL instances aren't thread-safe, so each one is only ever lent to one executor thread at a time.
+        If every instance is in use, borrowers wait for one to be returned.
+        """
+
+        self._factory = factory
+        self._max_size = max_size
+        self._idle: Queue[yt_dlp.YoutubeDL] = Queue()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self) -> Iterator[yt_dlp.YoutubeDL]:
+        try:
+            ytdl = self._idle.get(block=False)
+        except Empty:
+            with self._lock:
+                can_create = self._size < self._max_size
+                if can_create:
+                    self._size += 1
+
+            if can_create:
+                try:
+                    ytdl = self._factory()
+                except Exception:
+                    # give the slot back, otherwise borrowers could wait on an instance which will never exist
+                    with self._lock:
+                        self._size -= 1
+
+                    raise
+            else:
+                ytdl = self._idle.get()
+
+        try:
+            yield ytdl
+        finally:
+            self._idle.put(ytdl)
+
+
 class YouTubeService(MusicPlayerServiceBase):
-    def __init__(self, api_key: str) -> None:
+    AUDIO_DOWNLOAD_CHUNK_SIZE = 10 * 1024**2
+    """How much audio to request at a time when downloading to the audio cache, in bytes"""
+
+    PLAYLIST_PAGE_SIZE = 50
+    """How many playlist items to fetch per request. This is the most the YouTube Data API allows"""
+
+    STREAM_BEFORE_OPTIONS: dict[str, str | None] = {
+        "-reconnect": "1",
+        "-reconnect_streamed": "1",
+        "-reconnect_delay_max": "5",
+    }
+    """prevents early stream terminations (requires ffmpeg >= 3): https://github.com/Rapptz/discord.py/issues/315"""
+
+    def __init__(
+        self,
+        api_key: str,
+        *,
+        search_cache: YouTubeSearchCache | None = None,
+        stream_cache: YouTubeStreamCache | None = None,
+        audio_cache: FileCache | None = None,
+        replay_cache: ReplayCache | None = None,
+        loudness_analyzer: LoudnessAnalyzer | None = None,
+        opus_passthrough: bool = True,
+        read_ahead: int = 0,
+        rewind_history: int = 0,
+        rewind_history_pcm: int = 0,
+        http_pool_size: int = 10,
+        ytdl_pool_size: int = 4,
+    ) -> None:
+        """
+        A long-lived service for searching and streaming YouTube videos, meant to be shared across guilds
+
+        audio_cache: If provided, audio is downloaded to disk while it plays and later played back from disk
+        replay_cache: If provided, Opus audio is kept in memory while it plays, so repeats don't need ffmpeg or the
+            network
+        loudness_analyzer: If provided, tracks are measured in the background and normalized once they have been
+        opus_passthrough: Whether to send Opus audio to Discord as-is when no effects are applied
+        read_ahead: How much decoded audio to read ahead of playback on a separate thread, in milliseconds
+        rewind_history: How much recently played Opus audio each stream keeps so it can be rewound instantly,
+            in milliseconds
+        rewind_history_pcm: The same for decoded audio, which takes roughly ten times as much memory as Opus audio
+        http_pool_size: How many keep-alive connections to hold open to the YouTube Data API
+        ytdl_pool_size: How many YoutubeDL instances can extract streams concurrently
+        """
+
         self.api = Api(api_key=api_key)
-        self._temp_dir = TemporaryDirectory().name
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size)
+        self.api.session.mount("https://", adapter)
 
-    def __del__(self):
-        try:
-            shutil.rmtree(self._temp_dir)
-        except FileNotFoundError:
-            pass
+        self.search_cache = search_cache
+        self.stream_cache = stream_cache
+        self.audio_cache = audio_cache
+        self.replay_cache = replay_cache
+        self.loudness_analyzer = loudness_analyzer
+        self.opus_passthrough = opus_passthrough
+        self.read_ahead = read_ahead
+        self.rewind_history = rewind_history
+        self.rewind_history_pcm = rewind_history_pcm
+        self.search_flight: SingleFlight[YoutubeVideo | None] = SingleFlight()
+
+        self._temp_dir = TemporaryDirectory(prefix="friend_boat-")
+        self._ytdl_pool = YoutubeDLPool(self.get_ytdl, ytdl_pool_size)
+        self._http_session: aiohttp.ClientSession | None = None
+        self._audio_downloads: dict[str, asyncio.Task] = {}
+
+    async def close(self) -> None:
+        """Saves pending cache changes, closes pooled connections and removes the temporary directory"""
+
+        if self.search_cache:
+            self.search_cache.close()
+
+        for task in self._audio_downloads.values():
+            task.cancel()
+
+        if self.loudness_analyzer:
+            self.loudness_analyzer.close()
+
+        if self._http_session:
+            await self._http_session.close()
+            self._http_session = None
+
+        self.api.session.close()
+        self._temp_dir.cleanup()
+
+    def resize_caches(
+        self,
+        *,
+        search_cache_size: int | None = None,
+        stream_cache_size: int | None = None,
+        audio_cache_max_bytes: int | None = None,
+        replay_cache_max_bytes: int | None = None,
+        loudness_cache_size: int | None = None,
+    ) -> None:
+        """Changes the budgets of whichever caches are in use, e.g. after the settings are reloaded"""
+
+        if self.search_cache and search_cache_size is not None:
+            self.search_cache.resize(search_cache_size)
+        if self.stream_cache and stream_cache_size is not None:
+            self.stream_cache.resize(stream_cache_size)
+        if self.audio_cache and audio_cache_max_bytes is not None:
+            self.audio_cache.resize(audio_cache_max_bytes)
+        if self.replay_cache and replay_cache_max_bytes is not None:
+            self.replay_cache.resize(replay_cache_max_bytes)
+        if self.loudness_analyzer and loudness_cache_size is not None:
+            self.loudness_analyzer.cache.resize(loudness_cache_size)
+
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        if not self._http_session or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+
+        return self._http_session
 
     @staticmethod
     def get_youtube_video_id_from_url(url: str | None) -> str | None:
@@ -47,11 +247,40 @@ class YouTubeService(MusicPlayerServiceBase):
     def build_url_from_video_id(video_id: str) -> str:
         return f"https://www.youtube.com/watch?v={video_id}"
 
+    def _get_cached_search(self, query: str, video_id: str | None) -> YoutubeVideo | None:
+        if not self.search_cache:
+            return None
+
+        if video_id:
+            cached = self.search_cache.get(self.search_cache.video_key(video_id))
+        else:
+            cached = self.search_cache.get(self.search_cache.query_key(query))
+
+        return replace(cached, original_query=query) if cached else None
+
+    def _cache_search(self, query: str, video_id: str, video: YoutubeVideo) -> None:
+        if not self.search_cache:
+            return
+
+        self.search_cache.set(self.search_cache.video_key(video_id), video)
+        if self.get_youtube_video_id_from_url(query) != video_id:
+            self.search_cache.set(self.search_cache.query_key(query), video)
+
+        self.search_cache.schedule_save()
+
     def search_video(self, query: str) -> YoutubeVideo | None:
         """Searches YouTube for a video using a query string and returns the URL of that video, if found"""
 
-        response: SearchListResponse | VideoListResponse | None = None
+        with SEARCH_LATENCY.time():
+            return self._search_video(query)
+
+    def _search_video(self, query: str) -> YoutubeVideo | None:
         video_id = self.get_youtube_video_id_from_url(query)
+        cached = self._get_cached_search(query, video_id)
+        if cached:
+            return cached
+
+        response: SearchListResponse | VideoListResponse | None = None
         if video_id:
             # try to find the video by searching by id
             response = self.api.get_video_by_id(video_id=video_id)
@@ -66,41 +295,170 @@ class YouTubeService(MusicPlayerServiceBase):
 
         result: SearchResult | Video | None = None
         for item in response.items:
-            if item.snippet.liveBroadcastContent and item.snippet.liveBroadcastContent != "none":
+            if self._is_live(item):
                 continue
 
             result = item
             break
 
-        if not (result and result.snippet):
+        if not (result and result.snippet and result.id):
             return None
 
+        result_video_id = result.id.videoId if isinstance(result, SearchResult) else result.id
+        video = self._build_video(result, result_video_id, query)
+        self._cache_search(query, result_video_id, video)
+        return video
+
+    @staticmethod
+    def _is_live(result: SearchResult | Video) -> bool:
+        """Whether a result is a livestream (or an upcoming one), which can't be played"""
+
+        return bool(
+            result.snippet and result.snippet.liveBroadcastContent and result.snippet.liveBroadcastContent != "none"
+        )
+
+    def _build_video(self, result: SearchResult | Video, video_id: str, query: str | None) -> YoutubeVideo:
         thumbnail_url = (
             result.snippet.thumbnails.default.url
             if result.snippet.thumbnails and result.snippet.thumbnails.default
             else None
         )
 
-        if not result.id:
-            return None
-        elif isinstance(result, SearchResult):
-            url = self.build_url_from_video_id(result.id.videoId)
-        else:
-            url = self.build_url_from_video_id(result.id)
-
         return YoutubeVideo(
-            url=url,
+            url=self.build_url_from_video_id(video_id),
             name=self.cln(result.snippet.title),
             description=self.cln(result.snippet.description),
             thumbnail_url=thumbnail_url,
             original_query=query,
         )
 
+    @staticmethod
+    def get_youtube_playlist_id_from_url(url: str | None) -> str | None:
+        """Extracts the playlist id from a YouTube playlist URL, if the URL has one"""
+
+        if not url:
+            return None
+
+        parsed_url = urlparse(url if "://" in url else f"https://{url}")
+        if not (parsed_url.hostname and parsed_url.hostname.removeprefix("www.") in ["youtube.com", "youtu.be"]):
+            return None
+
+        playlist_ids = parse_qs(parsed_url.query).get("list")
+        return playlist_ids[0] if playlist_ids else None
+
+    def get_playlist_page(
+        self, playlist_id: str, page_token: str | None = None
+    ) -> tuple[list[YoutubeVideo], str | None]:
+        """
+        Fetches one page of up to 50 videos from a playlist, skipping videos which can't be played,
+        and returns them alongside the token for the next page, if there is one
+
+        Videos are fetched in two requests: one for the page of playlist items, and one for all of their details
+        """
+
+        # Api.get_playlist_items keeps requesting pages until it has `count` items (or all of them if `count`
+        # is None) and returns the last page's token, which would skip items whenever a page comes back short,
+        # so we request exactly one page ourselves
+        args = {"playlistId": playlist_id, "part": "contentDetails", "maxResults": self.PLAYLIST_PAGE_SIZE}
+        if page_token:
+            args["pageToken"] = page_token
+
+        response = self.api._request(resource="playlistItems", method="GET", args=args)
+        items_response = PlaylistItemListResponse.from_dict(self.api._parse_response(response))
+
+        video_ids = [
+            item.contentDetails.videoId
+            for item in items_response.items
+            if item.contentDetails and item.contentDetails.videoId
+        ]
+        if not video_ids:
+            return [], items_response.nextPageToken
+
+        # private and deleted videos are omitted from the response
+        videos_response = self.api.get_video_by_id(video_id=video_ids, parts="snippet")
+        results_by_id: dict[str, Video] = {
+            result.id: result for result in (videos_response.items if videos_response else []) if result.id
+        }
+
+        videos: list[YoutubeVideo] = []
+        for video_id in video_ids:
+            result = results_by_id.get(video_id)
+            if not (result and result.snippet) or self._is_live(result):
+                continue
+
+            video = self._build_video(result, video_id, None)
+            if self.search_cache:
+                self.search_cache.set(self.search_cache.video_key(video_id), video)
+
+            videos.append(video)
+
+        if self.search_cache:
+            self.search_cache.schedule_save()
+
+        return videos, items_response.nextPageToken
+
+    async def iter_playlist(self, playlist_id: str) -> AsyncIterator[list[YoutubeVideo]]:
+        """Yields the videos in a playlist one page at a time, fetching each page in an executor"""
+
+        loop = asyncio.get_event_loop()
+        page_token: str | None = None
+        while True:
+            videos, page_token = await loop.run_in_executor(None, self.get_playlist_page, playlist_id, page_token)
+            yield videos
+
+            if not page_token:
+                return
+
+    async def search_video_async(self, query: str) -> YoutubeVideo | None:
+        """
+        Same as `search_video`, but runs the search in an executor so it doesn't block the event loop
+
+        Concurrent searches for the same video or query share a single request
+        """
+
+        video_id = self.get_youtube_video_id_from_url(query)
+        key = YouTubeSearchCache.video_key(video_id) if video_id else YouTubeSearchCache.query_key(query)
+        if self.search_cache and key in self.search_cache:
+            # cache hits don't touch the network, so there's no need to leave the event loop
+            return self.search_video(query)
+
+        loop = asyncio.get_event_loop()
+        video = await self.search_flight.do(key, lambda: loop.run_in_executor(None, self.search_video, query))
+        return replace(video, original_query=query) if video else None
+
+    async def search_videos_async(
+        self, queries: list[str], concurrency: int = 4
+    ) -> AsyncIterator[tuple[str, YoutubeVideo | None]]:
+        """
+        Runs `search_video_async` for many queries, at most `concurrency` at a time, and yields each query alongside
+        its video (or `None` if the search found nothing or failed) in the original order, as soon as it and every
+        query before it have finished
+        """
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def search(query: str) -> YoutubeVideo | None:
+            async with semaphore:
+                try:
+                    return await self.search_video_async(query)
+                except Exception:
+                    logging.warning(f'Unable to search for "{query}"', exc_info=True)
+                    return None
+
+        tasks = [asyncio.ensure_future(search(query)) for query in queries]
+        try:
+            for query, task in zip(queries, tasks):
+                yield query, await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
     def get_ytdl(self) -> yt_dlp.YoutubeDL:
         return yt_dlp.YoutubeDL(
             {
-                "format": "bestaudio/best",
-                "outtmpl": os.path.join(self._temp_dir, "%(extractor)s-%(id)s-%(title)s.%(ext)s"),
+                # prefer Opus, since it can be passed straight through to Discord
+                "format": "bestaudio[acodec=opus]/bestaudio/best",
+                "outtmpl": os.path.join(self._temp_dir.name, "%(extractor)s-%(id)s-%(title)s.%(ext)s"),
                 "restrictfilenames": True,
                 "noplaylist": True,
                 "nocheckcertificate": True,
@@ -113,19 +471,37 @@ class YouTubeService(MusicPlayerServiceBase):
             }
         )
 
-    async def get_source(
-        self,
-        item: MusicItemBase,
-        *,
-        start_at: int = 0,
-        effect: AudioStreamEffect | None = None,
-    ) -> AudioStream:
-        if not isinstance(item, YoutubeVideo):
-            raise Exception("This service does not support this item")
+    @staticmethod
+    def get_stream_expiration(url: str) -> float | None:
+        """Gets the expiration of a googlevideo media URL as a unix timestamp, if it has one"""
+
+        parsed_url = urlparse(url)
+        expire_values = parse_qs(parsed_url.query).get("expire")
+        if not expire_values:
+            match = re.search(r"/expire/(\d+)", parsed_url.path)
+            expire_values = [match.group(1)] if match else None
+
+        try:
+            return float(expire_values[0]) if expire_values else None
+        except ValueError:
+            return None
+
+    async def is_stream_available(self, url: str) -> bool:
+        """Checks whether a media URL can still be streamed. Network errors are assumed to be transient"""
+
+        try:
+            async with self._get_http_session().get(url, headers={"Range": "bytes=0-0"}) as response:
+                return response.status not in [403, 404, 410]
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return True
+
+    def _extract_info(self, url: str) -> dict:
+        with self._ytdl_pool.borrow() as ytdl:
+            return ytdl.extract_info(url, download=False)
 
+    async def _extract_stream(self, item: YoutubeVideo) -> YoutubeStream:
         loop = asyncio.get_event_loop()
-        ytdl = self.get_ytdl()
-        data: dict = await loop.run_in_executor(None, lambda: ytdl.extract_info(item.url, download=False))
+        data = await loop.run_in_executor(None, self._extract_info, item.url)
         if "entries" in data:
             # take first item from a playlist
             data = cast(dict, data["entries"][0])
@@ -138,12 +514,237 @@ class YouTubeService(MusicPlayerServiceBase):
         except (KeyError, TypeError, ValueError):
             bitrate = 48000
 
-        return AudioStream(
-            data["url"],
+        return YoutubeStream(
+            url=data["url"],
             bitrate=bitrate,
+            format_id=data.get("format_id"),
+            ext=data.get("ext"),
+            acodec=data.get("acodec"),
+            expires_at=self.get_stream_expiration(data["url"]),
+            duration=data.get("duration"),
+        )
+
+    async def resolve_stream(self, item: YoutubeVideo) -> YoutubeStream:
+        """
+        Resolves the media stream for a video, reusing a cached stream if it's still valid
+
+        Cached streams which have been revoked (e.g. they return a 403) are transparently re-resolved
+        """
+
+        video_id = self.get_youtube_video_id_from_url(item.url)
+        if not (self.stream_cache and video_id):
+            return await self._extract_stream(item)
+
+        stream = self.stream_cache.get(video_id)
+        if stream:
+            if await self.is_stream_available(stream.url):
+                return stream
+
+            self.stream_cache.pop(video_id)
+
+        stream = await self._extract_stream(item)
+        self.stream_cache.add(video_id, stream)
+        return stream
+
+    async def prefetch(self, item: MusicItemBase) -> None:
+        if not isinstance(item, YoutubeVideo):
+            return
+
+        stream = await self.resolve_stream(item)
+        video_id = self.get_youtube_video_id_from_url(item.url)
+        if video_id:
+            self._analyze_loudness(video_id, stream.url, self.STREAM_BEFORE_OPTIONS)
+
+    def _analyze_loudness(
+        self, video_id: str, source: str, before_options: dict[str, str | None] | None = None
+    ) -> None:
+        if self.loudness_analyzer:
+            before_options_list = BaseAudioStream._consolidate_options(before_options).split()
+            self.loudness_analyzer.enqueue(video_id, source, before_options_list)
+
+    def _get_known_duration(self, video_id: str) -> float | None:
+        """A video's duration, in seconds, if its stream is still cached"""
+
+        stream = self.stream_cache.peek(video_id) if self.stream_cache else None
+        return stream.duration if stream else None
+
+    def _get_gain(self, video_id: str | None) -> float:
+        if not (self.loudness_analyzer and video_id):
+            return 1.0
+
+        return self.loudness_analyzer.get_gain(video_id)
+
+    async def _download_to_audio_cache(self, video_id: str, stream: YoutubeStream) -> None:
+        """Downloads a stream into the audio cache in chunks, then commits it once it's complete"""
+
+        if not self.audio_cache:
+            return
+
+        loop = asyncio.get_event_loop()
+        session = self._get_http_session()
+        timeout = aiohttp.ClientTimeout(total=60)
+
+        partial_path = self.audio_cache.get_partial_path(video_id, stream.ext or "audio")
+        committed = False
+        try:
+            with open(partial_path, "wb") as f:
+                start = 0
+                while True:
+                    end = start + self.AUDIO_DOWNLOAD_CHUNK_SIZE - 1
+                    headers = {"Range": f"bytes={start}-{end}"}
+                    async with session.get(stream.url, headers=headers, timeout=timeout) as response:
+                        response.raise_for_status()
+
+                        # Content-Range looks like "bytes 0-1023/4096"
+                        total_size = response.headers.get("Content-Range", "").rpartition("/")[2]
+                        if total_size.isdigit() and int(total_size) > self.audio_cache.max_bytes:
+                            return
+
+                        chunk = await response.read()
+
+                    await loop.run_in_executor(None, f.write, chunk)
+                    start += len(chunk)
+                    if response.status != 206 or len(chunk) < self.AUDIO_DOWNLOAD_CHUNK_SIZE:
+                        break
+
+            await loop.run_in_executor(None, self.audio_cache.commit, partial_path)
+            committed = True
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            logging.warning(f"Unable to download {video_id} to the audio cache", exc_info=True)
+        finally:
+            self._audio_downloads.pop(video_id, None)
+            if not committed:
+                try:
+                    os.remove(partial_path)
+                except FileNotFoundError:
+                    pass
+
+    def _start_audio_cache_download(self, video_id: str, stream: YoutubeStream) -> None:
+        if self.audio_cache and video_id not in self._audio_downloads:
+            self._audio_downloads[video_id] = asyncio.get_event_loop().create_task(
+                self._download_to_audio_cache(video_id, stream)
+            )
+
+    def _can_pass_through(
+        self, *, is_opus: bool, effect: AudioStreamEffect | None, gain: float, allow_passthrough: bool
+    ) -> bool:
+        return (
+            self.opus_passthrough
+            and allow_passthrough
+            and is_opus
+            and effect in [None, AudioStreamEffect.clear]
+            and gain == 1.0
+        )
+
+    def _build_source(
+        self,
+        source: str,
+        *,
+        is_opus: bool,
+        start_at: int,
+        effect: AudioStreamEffect | None,
+        gain: float,
+        allow_passthrough: bool,
+        replay_key: str | None = None,
+        duration: float | None = None,
+        before_options: dict[str, str | None] | None = None,
+        options: dict[str, str | None] | None = None,
+    ) -> BaseAudioStream:
+        """
+        Passes Opus audio straight through when nothing needs it to be decoded, otherwise decodes it to PCM
+
+        replay_key: If provided, Opus audio played from the start is captured so it can be replayed from memory
+        duration: How long the track is, in seconds. Tracks are only captured if it's known, so incomplete captures
+            can be told apart from complete ones
+        """
+
+        if self._can_pass_through(is_opus=is_opus, effect=effect, gain=gain, allow_passthrough=allow_passthrough):
+            capture: ReplayCapture | None = None
+            if self.replay_cache and replay_key and duration and not start_at:
+                capture = self.replay_cache.capture(replay_key, int(duration * 1000))
+
+            return OpusAudioStream(
+                source,
+                start_at=start_at,
+                history=self.rewind_history,
+                capture=capture,
+                before_options=before_options,
+                options=options,
+            )
+        else:
+            return AudioStream(
+                source,
+                start_at=start_at,
+                effect=effect,
+                gain=gain,
+                read_ahead=self.read_ahead,
+                history=self.rewind_history_pcm,
+                before_options=before_options,
+                options=options,
+            )
+
+    async def get_source(
+        self,
+        item: MusicItemBase,
+        *,
+        start_at: int = 0,
+        effect: AudioStreamEffect | None = None,
+        allow_passthrough: bool = True,
+    ) -> BaseAudioStream:
+        if not isinstance(item, YoutubeVideo):
+            raise Exception("This service does not support this item")
+
+        with GET_SOURCE_LATENCY.time():
+            return await self._get_source(item, start_at=start_at, effect=effect, allow_passthrough=allow_passthrough)
+
+    async def _get_source(
+        self, item: YoutubeVideo, *, start_at: int, effect: AudioStreamEffect | None, allow_passthrough: bool
+    ) -> BaseAudioStream:
+        video_id = self.get_youtube_video_id_from_url(item.url)
+        gain = self._get_gain(video_id)
+        if (
+            self.replay_cache
+            and video_id
+            and not start_at
+            and self._can_pass_through(is_opus=True, effect=effect, gain=gain, allow_passthrough=allow_passthrough)
+        ):
+            packets = self.replay_cache.get(video_id)
+            if packets:
+                return ReplayAudioStream(packets, history=self.rewind_history)
+
+        if self.audio_cache and video_id:
+            # looking files up may rescan the cache directory
+            cached_path = await asyncio.get_event_loop().run_in_executor(None, self.audio_cache.get, video_id)
+            if cached_path:
+                self._analyze_loudness(video_id, cached_path)
+
+                # YouTube only serves Opus audio in webm containers
+                return self._build_source(
+                    cached_path,
+                    is_opus=cached_path.endswith(".webm"),
+                    start_at=start_at,
+                    effect=effect,
+                    gain=gain,
+                    allow_passthrough=allow_passthrough,
+                    replay_key=video_id,
+                    duration=self._get_known_duration(video_id),
+                    options={"-vn": None},
+                )
+
+        stream = await self.resolve_stream(item)
+        if video_id:
+            self._start_audio_cache_download(video_id, stream)
+            self._analyze_loudness(video_id, stream.url, self.STREAM_BEFORE_OPTIONS)
+
+        return self._build_source(
+            stream.url,
+            is_opus=stream.acodec == "opus",
             start_at=start_at,
             effect=effect,
-            # prevents early stream terminations (requires ffmpeg >= 3): https://github.com/Rapptz/discord.py/issues/315
-            before_options={"-reconnect": "1", "-reconnect_streamed": "1", "-reconnect_delay_max": "5"},
+            gain=gain,
+            allow_passthrough=allow_passthrough,
+            replay_key=video_id,
+            duration=stream.duration,
+            before_options=dict(self.STREAM_BEFORE_OPTIONS),
             options={"-vn": None, "-segment_time": "10"},
         )
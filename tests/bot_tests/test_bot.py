@@ -1,8 +1,105 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+from typing import cast
+
+from discord import Member, VoiceState
+
 from friend_boat.bots.bot import init_bot
 from friend_boat.bots.cogs import all_cogs
+from friend_boat.bots.cogs.music import Music
+from friend_boat.bots.settings import Settings, SettingsProvider
+from friend_boat.bots.supervisor import split_shards
+from friend_boat.services.music import MusicQueueService
 
 
 def test_healthcheck():
     bot = init_bot()
     for cog in all_cogs():
         assert isinstance(bot.cogs.get(cog.__cog_name__), cog)
+
+
+def test_split_shards():
+    assert split_shards(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert split_shards(2, 4) == [[0], [1]]
+
+
+def test_idle_queue_services_are_evicted():
+    bot = init_bot()
+    music = cast(Music, bot.cogs["Music"])
+    assert music.find_queue_service(1) is None
+    assert music.queue_service_metrics["active"] == 0
+
+    music.get_queue_service(1)
+    music.evict_idle_queue_services()
+    assert music.queue_service_metrics == {"active": 1, "idle": 1, "created": 1, "evicted": 0}
+
+    music._queue_service_idle_ttl = 0
+    music.evict_idle_queue_services()
+    assert music.find_queue_service(1) is None
+    assert music.queue_service_metrics == {"active": 0, "idle": 0, "created": 1, "evicted": 1}
+
+
+def test_leaving_empty_voice_channels_is_debounced(monkeypatch):
+    bot = init_bot()
+    music = cast(Music, bot.cogs["Music"])
+    music._leave_when_alone_delay = 0.05
+    music._occupied_channels[10] = 1
+
+    alone = True
+    monkeypatch.setattr(MusicQueueService, "is_alone", property(lambda _: alone))
+    player_service = music.get_queue_service(1)
+
+    def voice_state(channel_id: int | None) -> VoiceState:
+        return cast(VoiceState, SimpleNamespace(channel=SimpleNamespace(id=channel_id) if channel_id else None))
+
+    member = cast(Member, SimpleNamespace(id=2, guild=SimpleNamespace(id=1)))
+
+    async def run():
+        nonlocal alone
+
+        # events in other channels are ignored
+        await music.on_voice_state_update(member, voice_state(20), voice_state(None))
+        assert not music._pending_leaves
+
+        # a quick rejoin cancels the leave
+        await music.on_voice_state_update(member, voice_state(10), voice_state(None))
+        assert music._pending_leaves
+        alone = False
+        await music.on_voice_state_update(member, voice_state(None), voice_state(10))
+        assert not music._pending_leaves
+
+        alone = True
+        await music.on_voice_state_update(member, voice_state(10), voice_state(None))
+        await asyncio.sleep(0.1)
+        assert not music._pending_leaves
+
+    stopped = []
+
+    async def stop():
+        stopped.append(True)
+
+    monkeypatch.setattr(player_service, "stop", stop)
+    asyncio.run(run())
+    assert stopped == [True]
+
+
+def test_settings_are_reloaded_from_file(tmp_path):
+    provider = SettingsProvider(Settings(data_dir=str(tmp_path)))
+    changes: list[Settings] = []
+    provider.subscribe(changes.append)
+    assert not provider.reload()
+
+    (tmp_path / "settings.json").write_text(json.dumps({"max_queue_size": 5, "discord_bot_token": "ignored"}))
+    assert provider.reload()
+    assert provider.settings.max_queue_size == 5
+    assert provider.settings.discord_bot_token != "ignored"
+    assert changes == [provider.settings]
+
+    # unchanged and invalid files keep the current settings
+    assert not provider.reload()
+    (tmp_path / "settings.json").write_text(json.dumps({"max_queue_size": "lots"}))
+    os.utime(tmp_path / "settings.json", (0, 0))
+    assert not provider.reload()
+    assert provider.settings.max_queue_size == 5
@@ -0,0 +1,160 @@
+import subprocess
+import sys
+import time
+
+from discord import AudioSource
+
+from friend_boat.services._base import BaseAudioStream, ReplayAudioStream
+from friend_boat.services.metrics import FIRST_FRAME_LATENCY, QUEUE_TO_AUDIO_LATENCY
+from friend_boat.services.replay import ReplayCache
+
+
+class FakeSource(AudioSource):
+    def __init__(self, frames: list[bytes]) -> None:
+        self.frames = frames
+
+    def read(self) -> bytes:
+        return self.frames.pop(0) if self.frames else b""
+
+
+class FakeStream(BaseAudioStream, FakeSource):
+    def __init__(self, frames: list[bytes], history: int = 0) -> None:
+        self._init_stream(0, history=history)
+        FakeSource.__init__(self, frames)
+
+
+def test_first_frame_is_only_measured_once():
+    first_frames = FIRST_FRAME_LATENCY.count
+    queue_to_audio = QUEUE_TO_AUDIO_LATENCY.count
+
+    stream = FakeStream([b"a", b"b", b"c"])
+    stream.due_at = time.perf_counter()
+    assert [stream.read(), stream.read(), stream.read()] == [b"a", b"b", b"c"]
+    assert stream.position == 60
+
+    # the first-frame wrapper removes itself, leaving the plain read path
+    assert "_read_frame" not in vars(stream)
+    assert FIRST_FRAME_LATENCY.count == first_frames + 1
+    assert QUEUE_TO_AUDIO_LATENCY.count == queue_to_audio + 1
+
+
+def test_short_rewinds_are_replayed_from_memory():
+    stream = FakeStream([bytes([i]) for i in range(10)], history=100)
+    assert [stream.read() for _ in range(6)] == [bytes([i]) for i in range(6)]
+    assert stream.position == 120
+
+    # only the last 5 frames are kept
+    assert not stream.rewind(120)
+    assert stream.rewind(60)
+    assert stream.rewind(40)
+
+    assert [stream.read() for _ in range(7)] == [bytes([i]) for i in [1, 2, 3, 4, 5, 6, 7]]
+    assert stream.position == 160
+
+
+def _play(stream: BaseAudioStream) -> None:
+    while stream.read():
+        pass
+
+    stream.cleanup()
+
+
+def test_tracks_are_captured_and_replayed():
+    cache = ReplayCache(max_track_bytes=8, max_bytes=12)
+    packets = [b"ab", b"cd", b"ef"]
+
+    stream = FakeStream(list(packets))
+    stream._capture = cache.capture("a", duration=60)
+    assert [stream.read() for _ in range(4)] == [*packets, b""]
+
+    # tracks are only kept once the stream is cleaned up, after ffmpeg has exited
+    assert "a" not in cache
+    stream.cleanup()
+    assert cache.get("a") == tuple(packets)
+    assert cache.capture("a", duration=60) is None
+
+    replay = ReplayAudioStream(cache.get("a") or ())
+    assert replay.is_opus()
+    assert [replay.read() for _ in range(4)] == [*packets, b""]
+
+    # tracks over the per-track budget aren't kept, and the least-recently-played tracks are evicted
+    stream = FakeStream([b"abcd", b"efgh", b"ijkl"])
+    stream._capture = cache.capture("b", duration=60)
+    _play(stream)
+    assert "b" not in cache
+
+    for key in ["c", "d"]:
+        stream = FakeStream([b"abcd", b"efgh"])
+        stream._capture = cache.capture(key, duration=40)
+        _play(stream)
+
+    assert "a" not in cache
+    assert "c" not in cache
+    assert cache.get("d") == (b"abcd", b"efgh")
+
+
+def test_incomplete_tracks_are_not_captured():
+    cache = ReplayCache(max_track_bytes=8, max_bytes=12)
+
+    # skipped before the end
+    stream = FakeStream([b"ab", b"cd"])
+    stream._capture = cache.capture("a", duration=40)
+    stream.read()
+    stream.cleanup()
+    assert "a" not in cache
+
+    # ended early, e.g. the media URL expired partway through
+    stream = FakeStream([b"ab", b"cd"])
+    stream._capture = cache.capture("a", duration=10_000)
+    _play(stream)
+    assert "a" not in cache
+
+    # ended with nothing at all, which must not stop the track being captured later
+    stream = FakeStream([])
+    stream._capture = cache.capture("a", duration=40)
+    _play(stream)
+    assert cache.get("a") is None
+    assert cache.capture("a", duration=40) is not None
+
+    # tracks of unknown length can't be checked, so they aren't captured
+    assert cache.capture("a", duration=None) is None
+
+
+def test_failed_ffmpeg_processes_are_not_captured():
+    cache = ReplayCache(max_track_bytes=8, max_bytes=12)
+    stream = FakeStream([b"ab", b"cd"])
+    stream._capture = cache.capture("a", duration=40)
+    stream._process = subprocess.Popen([sys.executable, "-c", "raise SystemExit(1)"])  # type: ignore[attr-defined]
+    _play(stream)
+    assert "a" not in cache
+
+
+def test_captures_in_progress_count_towards_the_budget():
+    cache = ReplayCache(max_track_bytes=8, max_bytes=12)
+    kept = FakeStream([b"abcd"])
+    kept._capture = cache.capture("a", duration=20)
+    _play(kept)
+    assert cache.size == 4
+
+    # growing captures evict kept tracks, then are abandoned once other captures have reserved the rest
+    first = cache.capture("b", duration=40)
+    second = cache.capture("c", duration=40)
+    assert first and second
+    assert first.add(b"abcd") and first.add(b"efgh")
+    assert "a" in cache
+    assert second.add(b"ijkl")
+    assert "a" not in cache
+    assert not second.add(b"mnop")
+    assert cache.reserved == 8
+
+    # abandoned and finished captures release their reservations
+    first.finish()
+    assert cache.reserved == 0
+    assert cache.size == 8
+
+    skipped = FakeStream([b"ab", b"cd"])
+    skipped._capture = cache.capture("d", duration=40)
+    skipped.read()
+    assert cache.reserved == 2
+    skipped.cleanup()
+    assert cache.reserved == 0
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from friend_boat.models.youtube import YoutubeStream, YoutubeVideo
+from friend_boat.services.cache import FileCache, LRUCache, SingleFlight
+from friend_boat.services.youtube import YouTubeSearchCache, YouTubeService, YouTubeStreamCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache: LRUCache[int] = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    cache: LRUCache[int] = LRUCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, expires_at=time.time() - 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_search_cache_persists(tmp_path):
+    path = str(tmp_path / "search_cache.json")
+    video = YoutubeVideo(url="https://www.youtube.com/watch?v=soXQiu5Nrn4", name="name", description="description")
+
+    cache = YouTubeSearchCache(path, max_size=10, ttl=60)
+    cache.set(cache.query_key("  Some   SONG "), video)
+    cache.save()
+
+    reloaded = YouTubeSearchCache(path, max_size=10, ttl=60)
+    reloaded.load()
+    assert reloaded.get(reloaded.query_key("some song")) == video
+
+
+def test_search_cache_saves_concurrently_and_debounced(tmp_path):
+    path = str(tmp_path / "search_cache.json")
+    cache = YouTubeSearchCache(path, max_size=100, save_delay=60)
+
+    def save(i: int) -> None:
+        video = YoutubeVideo(url=f"https://www.youtube.com/watch?v={i}", name=str(i), description="")
+        cache.set(cache.video_key(str(i)), video)
+        cache.save()
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(save, range(50)))
+
+    # every write went to its own temp file, so the result is whole and nothing is left behind
+    assert os.listdir(tmp_path) == ["search_cache.json"]
+    reloaded = YouTubeSearchCache(path, max_size=100)
+    reloaded.load()
+    assert len(reloaded) == 50
+
+    # scheduled saves wait, and closing flushes them
+    cache.set(cache.video_key("new"), YoutubeVideo(url="new", name="new", description=""))
+    cache.schedule_save()
+    cache.schedule_save()
+    reloaded.load()
+    assert len(reloaded) == 50
+
+    cache.close()
+    reloaded.load()
+    assert len(reloaded) == 51
+
+
+def test_stream_cache_expires_with_media_url():
+    expire = int(time.time()) + 120
+    url = f"https://rr1---sn-abc.googlevideo.com/videoplayback?expire={expire}&itag=251"
+    assert YouTubeService.get_stream_expiration(url) == expire
+
+    stream = YoutubeStream(url=url, bitrate=48000, expires_at=YouTubeService.get_stream_expiration(url))
+    cache = YouTubeStreamCache(max_size=10, expiry_margin=60)
+    cache.add("soXQiu5Nrn4", stream)
+    assert cache.get("soXQiu5Nrn4") == stream
+
+    cache = YouTubeStreamCache(max_size=10, expiry_margin=300)
+    cache.add("soXQiu5Nrn4", stream)
+    assert cache.get("soXQiu5Nrn4") is None
+
+
+def test_single_flight_coalesces_calls():
+    calls = 0
+
+    async def search() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run() -> list[str]:
+        flight: SingleFlight[str] = SingleFlight()
+        results = await asyncio.gather(*[flight.do("query", search) for _ in range(10)])
+        assert not len(flight)
+        return results
+
+    assert asyncio.run(run()) == ["result"] * 10
+    assert calls == 1
+
+
+def test_file_cache_evicts_to_budget(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=10)
+    for key in ["a", "b", "c"]:
+        partial_path = cache.get_partial_path(key, "webm")
+        with open(partial_path, "wb") as f:
+            f.write(b"12345")
+
+        # partial files don't change the directory, so they don't trigger a rescan
+        scanned_at = cache._scanned_at
+        assert cache.get(key) is None
+        assert cache._scanned_at == scanned_at
+        cache.commit(partial_path)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == str(tmp_path / "b.webm")
+    assert cache.size == 10
+
+    # abandoned partial downloads are discarded on startup, but ones which may still be in progress are kept
+    abandoned_path = cache.get_partial_path("d", "webm")
+    open(abandoned_path, "wb").close()
+    abandoned_at = time.time() - FileCache.PARTIAL_MAX_AGE - 1
+    os.utime(abandoned_path, (abandoned_at, abandoned_at))
+    in_progress_path = cache.get_partial_path("e", "webm")
+    open(in_progress_path, "wb").close()
+
+    # including ones left in the directory itself by older versions
+    legacy_path = str(tmp_path / "f.webm.1.part")
+    open(legacy_path, "wb").close()
+    os.utime(legacy_path, (abandoned_at, abandoned_at))
+
+    reloaded = FileCache(str(tmp_path), max_bytes=10)
+    assert reloaded.get("d") is None
+    assert reloaded.get("e") is None
+    assert reloaded.get("f") is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == [FileCache.PARTIAL_DIRECTORY, "b.webm", "c.webm"]
+    assert os.listdir(reloaded.partial_directory) == [os.path.basename(in_progress_path)]
+
+
+def test_file_cache_is_shared_between_processes(tmp_path):
+    def commit(cache: FileCache, key: str) -> None:
+        partial_path = cache.get_partial_path(key, "webm")
+        with open(partial_path, "wb") as f:
+            f.write(b"12345")
+
+        cache.commit(partial_path)
+
+    worker_1 = FileCache(str(tmp_path), max_bytes=10)
+    worker_2 = FileCache(str(tmp_path), max_bytes=10)
+    commit(worker_1, "a")
+
+    # files downloaded by one worker are served by the others
+    assert worker_2.get("a") == str(tmp_path / "a.webm")
+
+    # and the budget covers every worker's files
+    commit(worker_1, "b")
+    commit(worker_2, "c")
+    assert sorted(path.name for path in tmp_path.iterdir()) == [FileCache.PARTIAL_DIRECTORY, "b.webm", "c.webm"]
+    assert worker_1.get("a") is None
+    assert worker_1.get("c") == str(tmp_path / "c.webm")
+
+
+def test_file_cache_misses_when_evicted_during_get(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path), max_bytes=10)
+    partial_path = cache.get_partial_path("a", "webm")
+    with open(partial_path, "wb") as f:
+        f.write(b"12345")
+
+    cache.commit(partial_path)
+
+    # another worker evicts the file between the existence check and touching it
+    utime = os.utime
+
+    def evict_then_utime(path, *args, **kwargs):
+        os.remove(path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "utime", evict_then_utime)
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.size == 0
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from friend_boat.services._base import AudioStreamEffect
+from friend_boat.services.effects import FRAME_SAMPLES, apply_gain
+
+
+def build_frames(frequency: int, seconds: int) -> list[bytes]:
+    t = np.arange(48000 * seconds) / 48000
+    signal = (np.sin(2 * np.pi * frequency * t) * 0.5 * 32767).astype(np.int16)
+    pcm = np.stack([signal, signal], axis=1).tobytes()
+    frame_size = FRAME_SAMPLES * 4
+    return [pcm[i : i + frame_size] for i in range(0, len(pcm), frame_size)]
+
+
+def peak_frequency(pcm: bytes) -> int:
+    samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, 2)[-48000:, 0].astype(np.float64)
+    return int(np.argmax(np.abs(np.fft.rfft(samples))))
+
+
+@pytest.mark.parametrize(
+    "effect, expected_frequency, expected_frames",
+    [
+        (AudioStreamEffect.deep, 330, 150),
+        (AudioStreamEffect.void, 220, 150),
+        (AudioStreamEffect.space_odyssey, 440, 150),
+        (AudioStreamEffect.dark_brandon, 330, 160),
+    ],
+)
+def test_effect_chains(effect: AudioStreamEffect, expected_frequency: int, expected_frames: int):
+    frames = iter(build_frames(440, 3))
+    chain = effect.build_chain()
+    assert chain
+
+    output: list[bytes] = []
+    while frame := chain.read(lambda: next(frames, b"")):
+        assert len(frame) == FRAME_SAMPLES * 4
+        output.append(frame)
+
+    assert abs(len(output) - expected_frames) <= 1
+    assert abs(peak_frequency(b"".join(output)) - expected_frequency) <= 15
+
+
+def test_clear_effect_has_no_chain():
+    assert AudioStreamEffect.clear.build_chain() is None
+
+
+def test_apply_gain_saturates():
+    frame = np.array([1000, -1000, 30000, -30000], dtype=np.int16).tobytes()
+    scaled = np.frombuffer(apply_gain(frame, 2.0), dtype=np.int16)
+    assert scaled.tolist() == [2000, -2000, 32767, -32768]
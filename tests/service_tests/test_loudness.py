@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+import pytest
+
+from friend_boat.services.loudness import LoudnessAnalyzer, LoudnessCache
+
+
+@pytest.mark.parametrize(
+    "loudness, expected_gain",
+    [
+        (None, 1.0),  # not measured yet
+        (-14.5, 1.0),  # within tolerance
+        (-20.0, 10 ** (6 / 20)),
+        (-8.0, 10 ** (-6 / 20)),
+        (-70.0, 10 ** (12 / 20)),  # silence is capped at the max gain
+    ],
+)
+def test_loudness_gain(loudness: float | None, expected_gain: float):
+    cache = LoudnessCache(None, max_size=10)
+    if loudness is not None:
+        cache.set("video", loudness)
+
+    analyzer = LoudnessAnalyzer(cache, target=-14.0, max_gain=12.0, tolerance=1.0)
+    assert analyzer.get_gain("video") == pytest.approx(expected_gain)
+
+
+def test_measurements_are_saved_in_the_background(tmp_path):
+    path = str(tmp_path / "loudness_cache.json")
+    analyzer = LoudnessAnalyzer(LoudnessCache(path, max_size=10, save_delay=60))
+
+    async def measure(source: str, before_options: list[str] | None = None) -> float:
+        return -20.0
+
+    analyzer.measure = measure  # type: ignore[method-assign]
+
+    async def run() -> None:
+        analyzer.enqueue("video", "source")
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert "video" in analyzer.cache
+    assert not os.path.exists(path)
+
+    analyzer.close()
+    reloaded = LoudnessCache(path, max_size=10)
+    reloaded.load()
+    assert reloaded.get("video") == -20.0
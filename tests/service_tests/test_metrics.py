@@ -0,0 +1,72 @@
+import pytest
+
+from friend_boat.services.metrics import MetricsRegistry
+from friend_boat.services.stream_stats import StreamStats
+
+
+def test_metrics_are_rendered():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "test histogram", buckets=(0.1, 1.0))
+    counter = registry.counter("test_total", "test counter")
+    registry.register_callback("test_depth", "test gauge", lambda: {"1": 3.0}, label="guild")
+
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    counter.inc(2)
+
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_seconds_count 3" in lines
+    assert "test_total 2.0" in lines
+    assert 'test_depth{guild="1"} 3.0' in lines
+
+
+def test_callback_metric_groups_are_computed_once_per_render():
+    registry = MetricsRegistry()
+    calls = 0
+
+    def callback() -> dict[str, dict[str, float]]:
+        nonlocal calls
+        calls += 1
+        return {"test_a": {"1": 1.0}, "test_b_total": {"1": 2.0}}
+
+    registry.register_callback_group(
+        "test", [("test_a", "test gauge", "gauge"), ("test_b_total", "test counter", "counter")], callback, label="guild"
+    )
+
+    lines = registry.render().splitlines()
+    assert calls == 1
+    assert 'test_a{guild="1"} 1.0' in lines
+    assert "# TYPE test_b_total counter" in lines
+    assert 'test_b_total{guild="1"} 2.0' in lines
+
+
+def test_stream_stats():
+    stats = StreamStats(frame_size=4)
+    started_at = 100.0
+    for frame, duration, wait in [(b"abcd", 0.001, 0.0), (b"ab", 0.002, 0.001), (b"", 0.001, 0.0), (b"abcd", 0.2, 0.15)]:
+        stats.pending_wait = wait
+        stats.record(started_at, started_at + duration, frame)
+        started_at += 0.03
+
+    summary = stats.summary()
+    assert summary["reads"] == 4
+    assert summary["short_frames"] == 1
+    assert summary["empty_frames"] == 1
+    assert summary["latency_p99"] == pytest.approx(0.2)
+    assert summary["stalls"] == 1
+    assert summary["recent_network_stalls"] == 1
+    assert round(summary["drift"], 6) == 0.03
+
+    # long gaps are pauses, not drift
+    stats.record(started_at + 60, started_at + 60.001, b"abcd")
+    assert round(stats.drift, 6) == 0.03
+
+    # only the requested percentiles are computed
+    summary = stats.summary(latency_percentiles=(50, 99), wait_percentiles=(99,))
+    assert summary["latency_p99"] == pytest.approx(0.2)
+    assert summary["wait_p99"] == pytest.approx(0.15)
+    assert "latency_p90" not in summary and "wait_p50" not in summary
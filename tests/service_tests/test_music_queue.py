@@ -0,0 +1,195 @@
+import asyncio
+import random
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from discord import Bot, Member
+
+from friend_boat.models._base import MusicItemBase
+from friend_boat.models.music import MusicQueueEmbeds, MusicQueueItem
+from friend_boat.services._base import MusicPlayerServiceBase
+from friend_boat.services.music import MusicQueueService
+from friend_boat.services.music_queue import IndexedQueue, QueueRounds
+
+
+def test_indexed_queue_matches_list():
+    queue: IndexedQueue[int] = IndexedQueue()
+    expected: list[int] = []
+    rng = random.Random(0)
+
+    for i in range(1000):
+        op = rng.choice(["insert", "pop", "move"]) if expected else "insert"
+        if op == "insert":
+            index = rng.randint(0, len(expected))
+            queue.insert(index, i)
+            expected.insert(index, i)
+        elif op == "pop":
+            index = rng.randrange(len(expected))
+            assert queue.pop(index) == expected.pop(index)
+        else:
+            index, new_index = rng.randrange(len(expected)), rng.randrange(len(expected))
+            queue.move(index, new_index)
+            expected.insert(new_index, expected.pop(index))
+
+        assert list(queue.snapshot()) == expected
+
+    for index in range(len(expected)):
+        assert queue.index_of(queue.id_at(index)) == index
+
+
+def test_indexed_queue_ids_are_stable():
+    queue: IndexedQueue[str] = IndexedQueue()
+    a = queue.put_nowait("a")
+    queue.put_nowait("b")
+    queue.put_nowait("c")
+
+    queue.move(0, 2)
+    assert queue.index_of(a) == 2
+
+    queue.shuffle()
+    assert queue.remove(a) == "a"
+    assert a not in queue
+    assert sorted(queue.snapshot()) == ["b", "c"]
+
+
+def test_indexed_queue_limits():
+    queue: IndexedQueue[int] = IndexedQueue(maxsize=2)
+    queue.put_nowait(1)
+    queue.put_nowait(2)
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(3)
+
+    assert queue.get_nowait() == 1
+    assert queue.get_nowait() == 2
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+
+
+def test_indexed_queue_snapshot_is_reused():
+    queue: IndexedQueue[int] = IndexedQueue()
+    queue.put_nowait(1)
+    snapshot = queue.snapshot()
+    assert queue.snapshot() is snapshot
+
+    queue.put_nowait(2)
+    assert queue.snapshot() == (1, 2)
+
+
+def _queue_service_with_requests(requestor_ids: list[int]) -> MusicQueueService:
+    service = MusicQueueService(cast(Bot, None), guild_id=1)
+    if not service.fair_queue:
+        service.toggle_fair_queue()
+
+    for i, requestor_id in enumerate(requestor_ids):
+        item = MusicQueueItem(
+            player_service=cast(MusicPlayerServiceBase, None),
+            music=cast(MusicItemBase, SimpleNamespace(name=f"{requestor_id}-{i}")),
+            requestor=cast(Member, SimpleNamespace(id=requestor_id)),
+        )
+        service.add_to_queue(item)
+
+    return service
+
+
+def _play_order(service: MusicQueueService) -> list[int]:
+    return [item.requestor.id for item in service._queue.snapshot()]
+
+
+def test_fair_queue_takes_turns():
+    service = _queue_service_with_requests([1, 1, 1, 2, 3, 3, 2])
+    assert _play_order(service) == [1, 2, 3, 1, 3, 2, 1]
+
+    # requestors keep their own order
+    names = [item.music.name for item in service._queue.snapshot() if item.requestor.id == 1]
+    assert names == ["1-0", "1-1", "1-2"]
+
+
+def test_fair_queue_shuffle_takes_turns():
+    service = _queue_service_with_requests([1, 1, 1, 2, 2, 3])
+    service.shuffle()
+
+    order = _play_order(service)
+    assert sorted(order[:3]) == [1, 2, 3]
+    assert sorted(order[3:5]) == [1, 2]
+    assert order[5] == 1
+
+
+def test_queue_rounds_match_rescanning():
+    rounds = QueueRounds()
+    queue: list[tuple[int, int]] = []
+    """(requestor, round) of every queued item"""
+    rng = random.Random(0)
+
+    for _ in range(2000):
+        if queue and rng.random() < 0.3:
+            requestor_id, _ = queue.pop(0)
+            rounds.remove_first(requestor_id)
+            continue
+
+        requestor_id = rng.randrange(5)
+        last_rounds = [r for id, r in queue if id == requestor_id]
+        item_round = last_rounds[-1] + 1 if last_rounds else (queue[0][1] if queue else 0)
+        expected = sum(1 for _, r in queue if r <= item_round)
+
+        assert rounds.add(requestor_id) == expected
+        queue.insert(expected, (requestor_id, item_round))
+
+
+def test_fair_queue_keeps_turns_while_playing():
+    service = _queue_service_with_requests([1, 1, 2])
+    assert _play_order(service) == [1, 2, 1]
+
+    # requestor 1 already had their turn this round, so requestor 3 goes before their next item
+    service._get_next_queued_item()
+    service.add_to_queue(
+        MusicQueueItem(
+            player_service=cast(MusicPlayerServiceBase, None),
+            music=cast(MusicItemBase, SimpleNamespace(name="3-0")),
+            requestor=cast(Member, SimpleNamespace(id=3)),
+        )
+    )
+    assert _play_order(service) == [2, 3, 1]
+
+    # moving an item rebuilds the rounds from the new order
+    service.move_in_queue(2, 0)
+    service.add_to_queue(
+        MusicQueueItem(
+            player_service=cast(MusicPlayerServiceBase, None),
+            music=cast(MusicItemBase, SimpleNamespace(name="2-1")),
+            requestor=cast(Member, SimpleNamespace(id=2)),
+        )
+    )
+    assert _play_order(service) == [1, 2, 3, 2]
+
+
+def test_queue_pages_are_rendered_lazily():
+    queue: IndexedQueue[MusicQueueItem] = IndexedQueue()
+    embeds = MusicQueueEmbeds(queue, page_size=2)
+    changes: list[int] = []
+    embeds.add_listener(lambda: changes.append(queue.version))
+
+    for i in range(5):
+        queue.put_nowait(
+            MusicQueueItem(
+                player_service=cast(MusicPlayerServiceBase, None),
+                music=cast(MusicItemBase, SimpleNamespace(name=f"song-{i}")),
+                requestor=cast(Member, SimpleNamespace(display_name="someone")),
+            )
+        )
+
+    assert len(changes) == 5
+    assert embeds.page_count == 3
+
+    page = embeds.get_page(2)
+    assert "song-4" in (page.description or "")
+    assert embeds.get_page(2) is page
+
+    # pages are re-rendered after the queue changes, and pages past the end are clamped
+    queue.pop(0)
+    assert embeds.get_page(2) is not page
+    assert "song-3" in (embeds.get_page(1).description or "")
+
+    queue.clear()
+    assert embeds.page_count == 1
+    assert embeds.get_page(5).description == "Nothing is currently queued"
@@ -0,0 +1,36 @@
+import io
+import os
+import threading
+
+from friend_boat.services.read_ahead import ReadAheadBuffer
+
+
+def test_read_ahead_wraps_around():
+    data = b"".join(bytes([i]) * 4 for i in range(10)) + b"xy"
+    buffer = ReadAheadBuffer(io.BytesIO(data).readinto, frame_size=4, capacity=3)
+    buffer.start()
+
+    assert buffer.wait_until_buffered(3, timeout=5)
+    assert buffer.buffered == 3
+
+    # the short frame at the end ends the stream, like FFmpegPCMAudio
+    assert [buffer.read() for _ in range(11)] == [bytes([i]) * 4 for i in range(10)] + [b""]
+    assert buffer.read() == b""
+
+
+def test_read_ahead_waits_for_slow_pipes():
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, "rb") as reader, os.fdopen(write_fd, "wb", buffering=0) as writer:
+        buffer = ReadAheadBuffer(reader.readinto, frame_size=4, capacity=2)
+        buffer.start()
+        assert not buffer.wait_until_buffered(1, timeout=0.05)
+
+        # reads wait for frames, which can arrive in pieces
+        writes = threading.Timer(0.05, lambda: [writer.write(b"ab"), writer.write(b"cd")])
+        writes.start()
+        assert buffer.read() == b"abcd"
+        assert buffer.underruns == 1
+        writes.join()
+
+        buffer.close()
+        assert buffer.read() == b""
@@ -0,0 +1,35 @@
+from friend_boat.models.music import MusicQueueItemSnapshot, MusicQueueSnapshot
+from friend_boat.services.snapshots import MusicQueueSnapshotStore
+
+
+def test_snapshot_store_round_trip(tmp_path):
+    store = MusicQueueSnapshotStore(str(tmp_path / "snapshots"))
+    assert store.guild_ids() == []
+
+    snapshot = MusicQueueSnapshot(
+        voice_channel_id=1,
+        message_channel_id=2,
+        currently_playing=MusicQueueItemSnapshot("https://www.youtube.com/watch?v=soXQiu5Nrn4", 3, start_at=45_000),
+        queue=[MusicQueueItemSnapshot("https://www.youtube.com/watch?v=dQw4w9WgXcQ", 4)],
+        effect="chipmunk",
+        repeat_forever=True,
+    )
+    store.save(123, snapshot)
+    assert store.guild_ids() == [123]
+
+    loaded = store.load(123)
+    assert loaded == snapshot
+    assert loaded and loaded.saved_at == snapshot.saved_at
+
+    store.delete(123)
+    assert store.load(123) is None
+    assert store.guild_ids() == []
+
+
+def test_snapshot_store_ignores_unexpected_files(tmp_path):
+    store = MusicQueueSnapshotStore(str(tmp_path))
+    store.save(123, MusicQueueSnapshot(voice_channel_id=1, message_channel_id=2, currently_playing=None, queue=[]))
+    (tmp_path / "123-backup.json").write_text("{}")
+    (tmp_path / "notes.txt").write_text("")
+
+    assert store.guild_ids() == [123]
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+from pyyoutube import VideoListResponse  # type: ignore
+
+from friend_boat.models.youtube import YoutubeVideo
+from friend_boat.services.youtube import YoutubeDLPool, YouTubeService
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://www.youtube.com/playlist?list=PL123", "PL123"),
+        ("youtube.com/watch?v=soXQiu5Nrn4&list=PL123", "PL123"),
+        ("https://www.youtube.com/watch?v=soXQiu5Nrn4", None),
+        ("https://example.com/playlist?list=PL123", None),
+        ("never gonna give you up", None),
+    ],
+)
+def test_get_youtube_playlist_id_from_url(url: str, expected: str | None):
+    assert YouTubeService.get_youtube_playlist_id_from_url(url) == expected
+
+
+class FakeResponse:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def json(self) -> dict:
+        return self.data
+
+
+def get_videos_by_id(*, video_id: list[str], **kwargs) -> VideoListResponse:
+    return VideoListResponse.from_dict(
+        {"items": [{"id": id, "snippet": {"title": f"title {id}", "description": ""}} for id in video_id]}
+    )
+
+
+def test_get_playlist_page_hydrates_videos_in_one_batch():
+    service = YouTubeService("api-key")
+    video_ids = ["video-1", "video-2", "deleted", "live"]
+    video_requests: list[list[str]] = []
+
+    def request(**kwargs) -> FakeResponse:
+        return FakeResponse(
+            {
+                "items": [{"contentDetails": {"videoId": video_id}} for video_id in video_ids],
+                "nextPageToken": "next",
+            }
+        )
+
+    def get_video_by_id(*, video_id: list[str], **kwargs) -> VideoListResponse:
+        video_requests.append(video_id)
+        return VideoListResponse.from_dict(
+            {
+                "items": [
+                    {
+                        "id": id,
+                        "snippet": {
+                            "title": f"title {id}",
+                            "description": "",
+                            "liveBroadcastContent": "live" if id == "live" else "none",
+                        },
+                    }
+                    for id in video_id
+                    if id != "deleted"
+                ]
+            }
+        )
+
+    service.api._request = request
+    service.api.get_video_by_id = get_video_by_id
+
+    videos, next_page_token = service.get_playlist_page("PL123")
+    assert [video.name for video in videos] == ["title video-1", "title video-2"]
+    assert next_page_token == "next"
+    assert video_requests == [video_ids]
+
+
+def test_get_playlist_page_does_not_skip_items_after_a_short_page():
+    service = YouTubeService("api-key")
+    pages = {
+        None: {"items": [{"contentDetails": {"videoId": "video-1"}}], "nextPageToken": "page-2"},
+        "page-2": {
+            "items": [{"contentDetails": {"videoId": f"video-{i}"}} for i in range(2, 52)],
+            "nextPageToken": "page-3",
+        },
+    }
+    requested_tokens: list[str | None] = []
+
+    def request(*, args: dict, **kwargs) -> FakeResponse:
+        requested_tokens.append(args.get("pageToken"))
+        return FakeResponse(pages[args.get("pageToken")])
+
+    service.api._request = request
+    service.api.get_video_by_id = get_videos_by_id
+
+    # the short first page is returned on its own, with its own token for the next page
+    videos, next_page_token = service.get_playlist_page("PL123")
+    assert [video.name for video in videos] == ["title video-1"]
+    assert next_page_token == "page-2"
+
+    videos, next_page_token = service.get_playlist_page("PL123", next_page_token)
+    assert [video.name for video in videos] == [f"title video-{i}" for i in range(2, 52)]
+    assert next_page_token == "page-3"
+    assert requested_tokens == [None, "page-2"]
+
+
+def test_search_videos_async_preserves_order_and_bounds_concurrency():
+    service = YouTubeService("api-key")
+    running = 0
+    max_running = 0
+
+    async def search_video_async(query: str) -> YoutubeVideo | None:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+
+        # later queries finish first
+        await asyncio.sleep(0.01 / int(query))
+        running -= 1
+        return YoutubeVideo(url=query, name=query, description="") if query != "3" else None
+
+    service.search_video_async = search_video_async  # type: ignore [method-assign]
+
+    async def search_all() -> list[tuple[str, YoutubeVideo | None]]:
+        return [result async for result in service.search_videos_async([str(i) for i in range(1, 9)], 3)]
+
+    results = asyncio.run(search_all())
+    assert [query for query, _ in results] == [str(i) for i in range(1, 9)]
+    assert [video is None for _, video in results] == [i == 3 for i in range(1, 9)]
+    assert max_running == 3
+
+
+def test_ytdl_pool_releases_slot_when_factory_fails():
+    attempts = 0
+
+    def factory():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise RuntimeError("unable to create YoutubeDL")
+
+        return object()
+
+    pool = YoutubeDLPool(factory, max_size=1)
+    with pytest.raises(RuntimeError):
+        with pool.borrow():
+            pass
+
+    # the failed instance didn't use up the only slot, so this doesn't block forever
+    with pool.borrow() as ytdl:
+        assert ytdl is not None
+
+    assert attempts == 2